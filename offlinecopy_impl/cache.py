@@ -0,0 +1,92 @@
+import collections
+import os
+
+from . import target
+
+
+Candidate = collections.namedtuple(
+    "Candidate",
+    ["target", "relpath", "size", "last_access"]
+)
+
+
+def scan_subtree(path, selection=None):
+    # return (size, last_access) of the subtree at path, or None if a file
+    # in it is not transferred with the selection: evicting the subtree
+    # would delete local data which never reached the source
+    st = os.lstat(path)
+    size = st.st_blocks * 512
+    last_access = max(st.st_atime, st.st_mtime)
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        if not target.is_selected(selection, os.path.basename(path), st):
+            return None
+        return size, last_access
+
+    stack = [path]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except (FileNotFoundError, PermissionError):
+            continue
+        with it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                size += st.st_blocks * 512
+                last_access = max(last_access, st.st_atime, st.st_mtime)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif not target.is_selected(selection, entry.name, st):
+                    return None
+
+    return size, last_access
+
+
+def iter_included_nodes(node, relpath=""):
+    if node.state == target.State.INCLUDED or (
+            node.parent is None and node.get_state() == target.State.INCLUDED):
+        yield node, relpath
+    for segment, child in sorted(node.childmap.items(),
+                                 key=lambda x: x[0]):
+        yield from iter_included_nodes(child, relpath + "/" + segment)
+
+
+def iter_candidates(t):
+    # candidates are the entries directly below each included node which are
+    # not mentioned in the rule tree themselves; included files are
+    # candidates on their own. Below a selection, entries holding files
+    # which are not transferred are no candidates.
+    for node, relpath in iter_included_nodes(t.rules):
+        path = t.dest / relpath[1:]
+        if not path.is_dir():
+            if path.exists():
+                size, last_access = scan_subtree(str(path))
+                yield Candidate(t, relpath, size, last_access)
+            continue
+
+        selection = node.get_selection()
+        for entry in sorted(os.listdir(str(path))):
+            if entry in node.childmap:
+                continue
+            result = scan_subtree(str(path / entry), selection)
+            if result is None:
+                continue
+            size, last_access = result
+            yield Candidate(t, relpath + "/" + entry, size, last_access)
+
+
+def select_evictions(candidates, budget):
+    candidates = sorted(candidates, key=lambda c: c.last_access)
+    usage = sum(c.size for c in candidates)
+
+    result = []
+    for candidate in candidates:
+        if usage <= budget:
+            break
+        result.append(candidate)
+        usage -= candidate.size
+
+    return result
@@ -0,0 +1,52 @@
+import collections
+
+from . import target
+
+
+def get_roots(t):
+    # return (src_root, dest_root) of the parent directories of the source
+    # and the destination of the target, or None if the target cannot be
+    # transferred as part of its parent: the source has to be a directory
+    # with the same name as the destination
+    if not t.src.endswith("/"):
+        return None
+    head, sep, name = t.src.rstrip("/").rpartition("/")
+    if not sep or not name or name != t.dest.name:
+        return None
+    return head + "/", t.dest.parent
+
+
+def group(targets, key=None):
+    # group the targets which have the same roots (and the same key, if
+    # given) in the order of their first member; targets without roots are
+    # in groups of their own
+    groups = collections.OrderedDict()
+    for t in targets:
+        roots = get_roots(t)
+        if roots is None:
+            groups[t] = [t]
+            continue
+        groups.setdefault((roots, key(t) if key is not None else None),
+                          []).append(t)
+    return list(groups.values())
+
+
+def combine(targets):
+    # return a target for the common roots of the targets whose rules are
+    # those of the targets, rebased to their names; everything else below
+    # the roots is excluded
+    src_root, dest_root = get_roots(targets[0])
+    flat_nodes = [(target.State.EVICTED, "")]
+    selections = []
+    for t in sorted(targets, key=lambda t: t.dest.name):
+        if get_roots(t) != (src_root, dest_root):
+            raise ValueError("{!r} is not below {!r}".format(
+                str(t.dest), str(dest_root)))
+        flat_nodes.extend(target.rebase_rules(t.dest.name,
+                                              t.iter_flat_nodes()))
+        selections.extend(target.rebase_rules(t.dest.name,
+                                              t.iter_selections()))
+
+    result = target.Target(src_root, dest_root)
+    result.from_flat_nodes(flat_nodes, selections)
+    return result
@@ -1,6 +1,6 @@
 import lxml.builder
 
-from . import target
+from . import schedule, strategy, target, transport
 
 
 xmlns_1_0 = "https://xmlns.zombofant.net/fancysync/targets/1.0/"
@@ -20,23 +20,204 @@ def embed_flat_nodes(parent, nodes):
                              location=path))
 
 
+def extract_selections(subtree):
+    for el in subtree.iterchildren("{{{}}}selection".format(xmlns_1_0)):
+        max_size = el.get("max-size")
+        yield target.Selection(
+            tuple(pattern.get("glob")
+                  for pattern in el.iterchildren(
+                      "{{{}}}pattern".format(xmlns_1_0))),
+            None if max_size is None else int(max_size),
+        ), el.get("location")
+
+
+def embed_selections(parent, selections):
+    for selection, path in selections:
+        el = E.selection(location=path)
+        if selection.max_size is not None:
+            el.set("max-size", str(selection.max_size))
+        for pattern in selection.patterns:
+            el.append(E.pattern(glob=pattern))
+        parent.append(el)
+
+
+def extract_mirrors(subtree):
+    for mirror in subtree.iterchildren("{{{}}}mirror".format(xmlns_1_0)):
+        yield mirror.get("src")
+
+
+def embed_mirrors(parent, mirrors):
+    for src in mirrors:
+        parent.append(E.mirror(src=src))
+
+
+def extract_transport(subtree):
+    el = subtree.find("{{{}}}transport".format(xmlns_1_0))
+    if el is None:
+        return None
+
+    profile = transport.Profile()
+    for name, _ in profile.iter_settings():
+        value = el.get(name.replace("_", "-"))
+        if value is not None:
+            setattr(profile, name, transport.Setting(value))
+    profile.checksum_choice = el.get("checksum-choice")
+    return profile
+
+
+def embed_transport(parent, profile):
+    if profile is None:
+        return
+
+    el = E.transport()
+    for name, value in profile.iter_settings():
+        el.set(name.replace("_", "-"), value.value)
+    if profile.checksum_choice is not None:
+        el.set("checksum-choice", profile.checksum_choice)
+    parent.append(el)
+
+
+def extract_schedule(subtree):
+    el = subtree.find("{{{}}}schedule".format(xmlns_1_0))
+    if el is None:
+        return None
+
+    return schedule.Schedule(
+        int(el.get("interval")),
+        [
+            (schedule.parse_time(window.get("start")),
+             schedule.parse_time(window.get("end")))
+            for window in el.iterchildren("{{{}}}window".format(xmlns_1_0))
+        ]
+    )
+
+
+def embed_schedule(parent, sched):
+    if sched is None:
+        return
+
+    el = E.schedule(interval=str(sched.interval))
+    for start, end in sched.windows:
+        el.append(E.window(start=schedule.format_time(start),
+                           end=schedule.format_time(end)))
+    parent.append(el)
+
+
 def load_targets(subtree):
     for target_el in subtree.iterchildren("{{{}}}target".format(xmlns_1_0)):
         t = target.Target(
             target_el.get("src"),
             target_el.get("dest")
         )
-        t.from_flat_nodes(extract_flat_nodes(target_el))
+        t.from_flat_nodes(extract_flat_nodes(target_el),
+                          extract_selections(target_el))
+        budget = target_el.get("budget")
+        if budget is not None:
+            t.budget = int(budget)
+        t.mirrors = list(extract_mirrors(target_el))
+        t.transport = extract_transport(target_el)
+        t.schedule = extract_schedule(target_el)
         yield t
 
 
 def save_targets(parent, targets):
     for t in targets:
         el = E.target(src=t.src, dest=str(t.dest))
+        if t.budget is not None:
+            el.set("budget", str(t.budget))
         embed_flat_nodes(el, t.iter_flat_nodes())
+        embed_selections(el, t.iter_selections())
+        embed_mirrors(el, t.mirrors)
+        embed_transport(el, t.transport)
+        embed_schedule(el, t.schedule)
         parent.append(el)
 
 
+def _target_fields(t):
+    return {
+        "src": t.src,
+        "budget": t.budget,
+        "mirrors": list(t.mirrors),
+        "transport": (None if t.transport is None
+                      else transport.Profile(**vars(t.transport))),
+        "schedule": (None if t.schedule is None
+                     else schedule.Schedule(t.schedule.interval,
+                                            t.schedule.windows)),
+        "nodes": {path: state for state, path in t.iter_flat_nodes()},
+        "selections": {path: selection
+                       for selection, path in t.iter_selections()},
+    }
+
+
+class TargetList(list):
+    # targets together with the state they were loaded in, so that changes
+    # made to them can be merged into a targets file which another process
+    # changed in the meantime
+
+    def __init__(self, targets=()):
+        super().__init__(targets)
+        self.mark_clean()
+
+    def mark_clean(self):
+        self.baseline = {str(t.dest): _target_fields(t) for t in self}
+
+
+def _merge_target(t, base, other):
+    # apply the changes made to t since base on top of other, storing the
+    # result in t; where both changed the same setting or node, t wins
+    ours = _target_fields(t)
+
+    for field in ["src", "budget", "mirrors", "transport", "schedule"]:
+        if ours[field] == base[field]:
+            setattr(t, field, getattr(other, field))
+
+    theirs = _target_fields(other)
+    for key in ["nodes", "selections"]:
+        for path in set(base[key]) | set(ours[key]):
+            if base[key].get(path) == ours[key].get(path):
+                continue
+            if path in ours[key]:
+                theirs[key][path] = ours[key][path]
+            else:
+                theirs[key].pop(path, None)
+
+    t.from_flat_nodes(
+        ((state, path)
+         for path, state in sorted(theirs["nodes"].items(),
+                                   key=lambda x: target.path_split(x[0]))),
+        ((selection, path)
+         for path, selection in theirs["selections"].items()),
+    )
+
+
+def merge_targets(targets, current):
+    # merge the changes made to the TargetList targets since it was loaded
+    # into current, a freshly loaded list of targets; targets is updated in
+    # place with the result
+    theirs = {str(t.dest): t for t in current}
+    result = []
+    for t in targets:
+        dest = str(t.dest)
+        base = targets.baseline.get(dest)
+        other = theirs.get(dest)
+        if base is not None:
+            if other is None:
+                # removed by someone else; only keep it if it was changed
+                if _target_fields(t) == base:
+                    continue
+            else:
+                _merge_target(t, base, other)
+        result.append(t)
+
+    ours = {str(t.dest) for t in targets}
+    for dest, other in theirs.items():
+        if dest not in ours and dest not in targets.baseline:
+            result.append(other)
+
+    targets[:] = result
+    targets.mark_clean()
+
+
 class Config:
     @staticmethod
     def parse_stringlist(s):
@@ -47,9 +228,77 @@ class Config:
             raise ValueError('value must be a list of strings (["foo", "bar"])')
         return value
 
+    @staticmethod
+    def parse_size(s):
+        s = s.strip()
+        factor = 1
+        for i, suffix in enumerate("KMGT", 1):
+            if s.upper().endswith(suffix):
+                s = s[:-1]
+                factor = 1024**i
+                break
+        value = int(float(s) * factor)
+        if value < 0:
+            raise ValueError("size must not be negative")
+        return value
+
     def __init__(self, parser):
         cfgvalue = parser.get("offlinecopy", "rsync-args", fallback="").strip()
         if not cfgvalue:
             self.rsync_args = []
         else:
             self.rsync_args = self.parse_stringlist(cfgvalue)
+
+        cfgvalue = parser.get("offlinecopy", "cache-budget",
+                              fallback="").strip()
+        if not cfgvalue:
+            self.cache_budget = None
+        else:
+            self.cache_budget = self.parse_size(cfgvalue)
+
+        cfgvalue = parser.get("offlinecopy", "retain-budget",
+                              fallback="").strip()
+        if not cfgvalue:
+            self.retain_budget = None
+        else:
+            self.retain_budget = self.parse_size(cfgvalue)
+
+        for key, attr in [("stall-timeout", "stall_timeout"),
+                          ("timeout", "timeout")]:
+            cfgvalue = parser.get("offlinecopy", key, fallback="").strip()
+            if not cfgvalue:
+                setattr(self, attr, None)
+            else:
+                setattr(self, attr, float(cfgvalue))
+
+        self.local_engine = parser.get("offlinecopy", "local-engine",
+                                       fallback="").strip() or "rsync"
+        if self.local_engine not in ("rsync", "native"):
+            raise ValueError(
+                "local-engine must be either rsync or native, not {!r}".format(
+                    self.local_engine
+                )
+            )
+
+        self.summon_jobs = int(parser.get("offlinecopy", "summon-jobs",
+                                          fallback="").strip() or 2)
+        if self.summon_jobs < 1:
+            raise ValueError("summon-jobs must be at least 1")
+
+        self.push_retries = int(parser.get("offlinecopy", "push-retries",
+                                           fallback="").strip() or 2)
+        if self.push_retries < 0:
+            raise ValueError("push-retries must not be negative")
+        self.retry_delay = float(parser.get("offlinecopy", "retry-delay",
+                                            fallback="").strip() or 30)
+
+        self.transfer_strategy = parser.get(
+            "offlinecopy", "transfer-strategy", fallback=""
+        ).strip() or "auto"
+        if self.transfer_strategy not in strategy.MODES:
+            raise ValueError(
+                "transfer-strategy must be one of {}, not {!r}".format(
+                    ", ".join(strategy.MODES),
+                    self.transfer_strategy,
+                )
+            )
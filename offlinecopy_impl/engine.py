@@ -0,0 +1,212 @@
+import asyncio
+import subprocess
+import sys
+
+
+# bytes of output kept for the caller, e.g. to parse rsync --stats
+TAIL_SIZE = 65536
+
+# seconds to wait for a child to exit after SIGTERM before it is killed
+TERMINATE_GRACE = 5
+
+
+class LinePrefixer:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.at_line_start = True
+
+    def __call__(self, data):
+        result = bytearray()
+        for line in data.splitlines(keepends=True):
+            if self.at_line_start:
+                result += self.prefix
+            result += line
+            self.at_line_start = line.endswith((b"\n", b"\r"))
+        return bytes(result)
+
+
+class TrailerCutter:
+    # passes output through until a line starting with marker, which starts
+    # a trailer (like the block printed by rsync --stats) that is dropped
+    # together with the empty lines right before it
+
+    def __init__(self, marker):
+        self.marker = marker
+        self.blanks = bytearray()
+        self.partial = bytearray()
+        self.in_line = False
+        self.cut = False
+
+    def __call__(self, data):
+        if self.cut:
+            return b""
+        result = bytearray()
+        for piece in data.splitlines(keepends=True):
+            complete = piece.endswith((b"\n", b"\r"))
+            if self.in_line:
+                result += piece
+                self.in_line = not complete
+                continue
+            line = bytes(self.partial) + piece
+            del self.partial[:]
+            if line.startswith(self.marker):
+                self.cut = True
+                del self.blanks[:]
+                break
+            if complete and not line.strip():
+                # kept back until it is known whether the trailer follows
+                self.blanks += line
+            elif not complete and self.marker.startswith(line):
+                # may still turn into the marker
+                self.partial += line
+            else:
+                result += self.blanks
+                del self.blanks[:]
+                result += line
+                self.in_line = not complete
+        return bytes(result)
+
+    def flush(self):
+        result = bytes(self.blanks + self.partial)
+        del self.blanks[:]
+        del self.partial[:]
+        return result
+
+
+async def _pump(stream, out, activity, tail=None, prefix=None,
+                cutter=None):
+    loop = asyncio.get_event_loop()
+    prefixer = LinePrefixer(prefix) if prefix else None
+
+    def write(data):
+        if prefixer is not None:
+            data = prefixer(data)
+        if data:
+            out.write(data)
+            out.flush()
+
+    while True:
+        data = await stream.read(65536)
+        if not data:
+            break
+        activity[0] = loop.time()
+        if tail is not None:
+            tail.extend(data)
+            del tail[:-TAIL_SIZE]
+        if cutter is not None:
+            data = cutter(data)
+        write(data)
+    if cutter is not None:
+        write(cutter.flush())
+
+
+async def _watchdog(activity, stall_timeout):
+    loop = asyncio.get_event_loop()
+    while True:
+        remaining = activity[0] + stall_timeout - loop.time()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(remaining)
+
+
+async def _terminate(proc):
+    if proc.returncode is not None:
+        return
+    try:
+        proc.terminate()
+        await asyncio.wait_for(proc.wait(), TERMINATE_GRACE)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+
+async def run(cmd,
+              stall_timeout=None,
+              timeout=None,
+              prefix=None,
+              stdout=None,
+              stderr=None,
+              hide_from=None):
+    # run cmd, passing its output through (with an optional line prefix to
+    # tell concurrent transfers apart) and return the tail of its standard
+    # output. The child is terminated if the call is cancelled, if it does
+    # not produce output for stall_timeout seconds or if it runs longer than
+    # timeout seconds; the latter two raise subprocess.TimeoutExpired.
+    # With hide_from, standard output from the first line starting with it
+    # on is only kept in the tail.
+    if stdout is None:
+        stdout = sys.stdout.buffer
+    if stderr is None:
+        stderr = sys.stderr.buffer
+    if isinstance(prefix, str):
+        prefix = prefix.encode("utf-8")
+    cutter = TrailerCutter(hide_from) if hide_from else None
+
+    loop = asyncio.get_event_loop()
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    activity = [loop.time()]
+    tail = bytearray()
+    main = asyncio.ensure_future(asyncio.gather(
+        _pump(proc.stdout, stdout, activity, tail=tail, prefix=prefix,
+              cutter=cutter),
+        _pump(proc.stderr, stderr, activity, prefix=prefix),
+        proc.wait(),
+    ))
+    waiters = {main}
+    watchdog = None
+    if stall_timeout is not None:
+        watchdog = asyncio.ensure_future(_watchdog(activity, stall_timeout))
+        waiters.add(watchdog)
+
+    try:
+        done, _ = await asyncio.wait(
+            waiters,
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if main not in done:
+            raise subprocess.TimeoutExpired(
+                cmd,
+                stall_timeout if watchdog in done else timeout,
+            )
+        main.result()
+    except BaseException:
+        await _terminate(proc)
+        main.cancel()
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    return tail.decode("utf-8", errors="replace")
+
+
+async def gather_limited(coros, jobs):
+    # run the coroutines with at most jobs of them at a time; all of them
+    # are run to completion and the first exception (if any) is raised
+    # afterwards
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def limited(coro):
+        async with semaphore:
+            return await coro
+
+    results = await asyncio.gather(
+        *(limited(coro) for coro in coros),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
@@ -0,0 +1,198 @@
+import os
+
+from . import target
+
+
+class _RuleNode:
+    def __init__(self):
+        self.childmap = {}
+        self.exact = None
+        self.star = None
+
+
+def parse_filter_rules(lines):
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip("\n")
+        if not line.strip() or line.lstrip().startswith(("#", ";")):
+            continue
+
+        mode, sep, pattern = line.partition(" ")
+        mode = {"include": "+", "exclude": "-"}.get(mode, mode)
+        if mode not in ("+", "-") or not sep:
+            raise ValueError(
+                "line {}: unsupported filter rule: {!r}".format(lineno, line)
+            )
+
+        if not pattern.startswith("/"):
+            raise ValueError(
+                "line {}: only anchored patterns (starting with /) are"
+                " supported: {!r}".format(lineno, line)
+            )
+
+        pattern = pattern.rstrip("/")
+        star = pattern == "/*" or pattern.endswith("/*")
+        if star:
+            pattern = pattern[:-2]
+
+        if any(c in pattern for c in "*?[]"):
+            raise ValueError(
+                "line {}: wildcards are only supported as trailing /*:"
+                " {!r}".format(lineno, line)
+            )
+
+        yield mode, target.path_split(pattern), star
+
+
+def _build_rule_trie(rules):
+    root = _RuleNode()
+    for index, (mode, parts, star) in enumerate(rules):
+        node = root
+        for part in parts:
+            node = node.childmap.setdefault(part, _RuleNode())
+        # the first matching rule wins in rsync
+        if star:
+            if node.star is None:
+                node.star = index, mode
+        elif node.exact is None:
+            node.exact = index, mode
+    return root
+
+
+def _children_state(node):
+    if node.star is not None and node.star[1] == "-":
+        return target.State.EVICTED
+    return target.State.INCLUDED
+
+
+def _iter_trie_nodes(node, prefix):
+    for segment, child in sorted(node.childmap.items(),
+                                 key=lambda x: x[0]):
+        path = prefix + segment
+        matches = [match for match in (child.exact, node.star)
+                   if match is not None]
+        if matches and min(matches)[1] == "-":
+            yield target.State.EVICTED, path
+            continue
+
+        yield _children_state(child), path
+        yield from _iter_trie_nodes(child, path + "/")
+
+
+def flat_nodes_from_filter_rules(rules):
+    root = _build_rule_trie(rules)
+    yield _children_state(root), ""
+    yield from _iter_trie_nodes(root, "")
+
+
+def flat_nodes_from_path_list(lines):
+    paths = set()
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.strip():
+            paths.add(target.path_split(line))
+
+    if () in paths:
+        yield target.State.INCLUDED, ""
+        return
+
+    yield target.State.EVICTED, ""
+    for parts in sorted(paths):
+        yield target.State.INCLUDED, "/".join(parts)
+
+
+def _compile_trie(node):
+    # a compiled node is either a State, if the decision does not depend on
+    # deeper path components, or a tuple (children, default); children maps
+    # a path component to the compiled node of the path extended by it and
+    # default applies to all components without their own rule
+    if not node.childmap and node.star is None:
+        return target.State.INCLUDED
+
+    children = {}
+    for segment, child in node.childmap.items():
+        matches = [match for match in (child.exact, node.star)
+                   if match is not None]
+        if matches and min(matches)[1] == "-":
+            children[segment] = target.State.EVICTED
+        else:
+            children[segment] = _compile_trie(child)
+
+    default = target.State.INCLUDED
+    if node.star is not None and node.star[1] == "-":
+        default = target.State.EVICTED
+
+    return children, default
+
+
+class Matcher:
+    # decides for paths relative to the target root whether rsync transfers
+    # them with the given (anchored) rules, i.e. whether neither the path
+    # nor any of its parent directories is excluded; directories which are
+    # only traversed to reach included paths below them count as included.
+    #
+    # The walk of the previous path is cached, so that consecutive paths
+    # with a common prefix (as in sorted input) only walk the rest.
+    #
+    # A matcher for a target also applies its selections; the entries they
+    # decide on are looked up below the destination of the target to tell
+    # directories from files and to get their sizes.
+
+    def __init__(self, rules, selective=None):
+        self._root = _compile_trie(_build_rule_trie(list(rules)))
+        self._prev_parts = ()
+        self._stack = [self._root]
+        self._selective = selective
+
+    @classmethod
+    def from_target(cls, t):
+        # the rules without selections are those of the subtrees, the
+        # selections are applied on top of them
+        return cls(
+            parse_filter_rules(
+                "{} /{}".format(mode, rule)
+                for mode, rule in t.rules.iter_rules(selections=False)
+            ),
+            selective=t if t.has_selections() else None,
+        )
+
+    def _classify_selected(self, parts):
+        t = self._selective
+        path = "/".join(parts)
+        selection = t.get_entry_selection(path)
+        if selection is None:
+            return target.State.INCLUDED
+        try:
+            st = os.lstat(os.path.join(str(t.dest), path))
+        except OSError:
+            st = None
+        return t.get_entry_state(path, st)
+
+    def classify_parts(self, parts):
+        prev_parts = self._prev_parts
+        stack = self._stack
+
+        common = 0
+        for prev_part, part in zip(prev_parts, parts):
+            if prev_part != part:
+                break
+            common += 1
+        del stack[common+1:]
+
+        node = stack[-1]
+        for part in parts[len(stack)-1:]:
+            if node.__class__ is target.State:
+                break
+            children, default = node
+            node = children.get(part, default)
+            stack.append(node)
+
+        self._prev_parts = parts
+        if node.__class__ is target.State:
+            if     (node is target.State.INCLUDED and
+                    self._selective is not None):
+                return self._classify_selected(parts)
+            return node
+        return target.State.INCLUDED
+
+    def classify(self, path):
+        return self.classify_parts(target.path_split(path))
@@ -0,0 +1,72 @@
+import collections
+import json
+import math
+
+
+def append(path, record):
+    with open(path, "a") as f:
+        print(json.dumps(record, sort_keys=True, separators=(",", ":")),
+              file=f)
+
+
+def read(path, target=None):
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return []
+
+    records = []
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a record truncated by a crash
+                continue
+            if target is not None and record.get("target") != target:
+                continue
+            records.append(record)
+    return records
+
+
+def percentile(values, p):
+    # nearest-rank percentile
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(int(math.ceil(p / 100 * len(values))), 1)
+    return values[rank-1]
+
+
+def trend(records, key="duration"):
+    # least squares slope of key over time, in units per day
+    points = [(record["time"] / 86400, record[key])
+              for record in records
+              if record.get(key) is not None]
+    if len(points) < 2:
+        return None
+
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x)**2 for x, _ in points)
+    if not var_x:
+        return None
+
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def expected_duration(records, direction="push", samples=10):
+    durations = [record["duration"]
+                 for record in records
+                 if record.get("direction") == direction and
+                 record.get("status") == 0][-samples:]
+    if not durations:
+        return None
+    return percentile(durations, 50)
+
+
+def group_by_direction(records):
+    result = collections.OrderedDict()
+    for record in records:
+        result.setdefault(record.get("direction"), []).append(record)
+    return result
@@ -0,0 +1,328 @@
+import collections
+import concurrent.futures
+import errno
+import fcntl
+import os
+import shutil
+import stat
+import threading
+
+from . import target
+
+
+DEFAULT_JOBS = 8
+
+# ioctl number of FICLONE on Linux, which creates a reflink copy on
+# file systems supporting it (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+class PartialTransferError(OSError):
+    pass
+
+
+def is_local_source(src):
+    # rsync treats host:path, host::module and rsync:// URLs as remote; a
+    # colon after the first slash is part of a local path
+    if src.startswith("rsync://"):
+        return False
+    return ":" not in src.split("/", 1)[0]
+
+
+def _copy_data(fsrc, fdst, size):
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return "reflink"
+    except OSError:
+        pass
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            copied = 0
+            while copied < size:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                       size - copied)
+                if n == 0:
+                    break
+                copied += n
+            else:
+                return "copy_file_range"
+            if copied == 0 and size == 0:
+                return "copy_file_range"
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP):
+                raise
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+
+    shutil.copyfileobj(fsrc, fdst, 1024**2)
+    return "copy"
+
+
+def _copy_xattrs(src, dst, follow_symlinks=True):
+    try:
+        names = os.listxattr(src, follow_symlinks=follow_symlinks)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.setxattr(dst, name,
+                        os.getxattr(src, name,
+                                    follow_symlinks=follow_symlinks),
+                        follow_symlinks=follow_symlinks)
+        except OSError:
+            pass
+
+
+def _quick_check_equal(src_st, dst_st):
+    return (stat.S_IFMT(src_st.st_mode) == stat.S_IFMT(dst_st.st_mode) and
+            src_st.st_size == dst_st.st_size and
+            src_st.st_mtime_ns == dst_st.st_mtime_ns)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+class Copier:
+    # copies the included part of src_root to dest_root according to the
+    # rule tree of a target, with the semantics of the rsync invocation
+    # offlinecopy would otherwise use (quick check by size and mtime,
+    # excluded paths are neither copied nor deleted)
+
+    def __init__(self, rules, src_root, dest_root,
+                 delete=True,
+                 ignore_existing=False,
+                 xattrs=True,
+                 dry_run=False,
+                 jobs=DEFAULT_JOBS,
+                 log=None):
+        self.rules = rules
+        self.src_root = str(src_root)
+        self.dest_root = str(dest_root)
+        self.delete = delete
+        self.ignore_existing = ignore_existing
+        self.xattrs = xattrs
+        self.dry_run = dry_run
+        self.jobs = jobs
+        self.log = log
+        self.chown = os.geteuid() == 0
+
+        self.stats = collections.Counter()
+        self.errors = []
+        self._lock = threading.Lock()
+        self._hardlinks = {}
+        self._links = []
+        self._dirs = []
+
+    def _log(self, action, relpath):
+        if self.log is not None:
+            with self._lock:
+                self.log(action, relpath)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _apply_metadata(self, path, st, symlink=False):
+        if self.chown:
+            try:
+                os.chown(path, st.st_uid, st.st_gid,
+                         follow_symlinks=not symlink)
+            except OSError:
+                pass
+        if not symlink:
+            os.chmod(path, stat.S_IMODE(st.st_mode))
+        if os.utime in os.supports_follow_symlinks or not symlink:
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns),
+                     follow_symlinks=not symlink)
+
+    def _copy_file(self, src, dst, st, relpath):
+        if st.st_nlink > 1:
+            key = st.st_dev, st.st_ino
+            with self._lock:
+                first = self._hardlinks.setdefault(key, dst)
+            if first != dst:
+                # the first path may still be being copied by another
+                # worker; the links are made once all copies are done
+                self._log("link", relpath)
+                with self._lock:
+                    self._links.append((first, dst, relpath))
+                return
+
+        self._log("copy", relpath)
+        self._count("files")
+        self._count("bytes", st.st_size)
+        if self.dry_run:
+            return
+
+        tmp = os.path.join(os.path.dirname(dst),
+                           ".{}.offlinecopy".format(os.path.basename(dst)))
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            method = _copy_data(fsrc, fdst, st.st_size)
+        self._count(method)
+        if self.xattrs:
+            _copy_xattrs(src, tmp)
+        self._apply_metadata(tmp, st)
+        os.replace(tmp, dst)
+
+    def _copy_symlink(self, src, dst, st, dst_st, relpath):
+        link = os.readlink(src)
+        if dst_st is not None and stat.S_ISLNK(dst_st.st_mode) and \
+                os.readlink(dst) == link:
+            return
+        self._log("copy", relpath)
+        self._count("files")
+        if self.dry_run:
+            return
+        if dst_st is not None:
+            _remove(dst)
+        os.symlink(link, dst)
+        self._apply_metadata(dst, st, symlink=True)
+
+    def _delete(self, path, relpath):
+        self._log("delete", relpath)
+        self._count("deleted")
+        if not self.dry_run:
+            _remove(path)
+
+    def _sync_dir(self, relpath, node, state):
+        src_dir = os.path.join(self.src_root, relpath)
+        dst_dir = os.path.join(self.dest_root, relpath)
+
+        def scan(path):
+            try:
+                with os.scandir(path) as it:
+                    return {
+                        entry.name: entry.stat(follow_symlinks=False)
+                        for entry in it
+                    }
+            except FileNotFoundError:
+                return {}
+
+        src_entries = scan(src_dir)
+        dst_entries = scan(dst_dir)
+        subdirs = []
+
+        for name in sorted(set(src_entries) | set(dst_entries)):
+            child = node.childmap.get(name) if node is not None else None
+            if child is not None:
+                child_state = child.get_state()
+            else:
+                child_state = state
+            traverse = child is not None and bool(child.childmap)
+            if child_state != target.State.INCLUDED and not traverse:
+                # excluded paths are protected on both sides
+                continue
+
+            child_relpath = os.path.join(relpath, name)
+            src = os.path.join(src_dir, name)
+            dst = os.path.join(dst_dir, name)
+            src_st = src_entries.get(name)
+            dst_st = dst_entries.get(name)
+
+            try:
+                if src_st is None:
+                    if not self.delete:
+                        continue
+                    if child_state == target.State.INCLUDED:
+                        self._delete(dst, child_relpath)
+                    elif stat.S_ISDIR(dst_st.st_mode):
+                        subdirs.append((child_relpath, child, child_state))
+                    continue
+
+                if dst_st is not None and \
+                        stat.S_IFMT(src_st.st_mode) != \
+                        stat.S_IFMT(dst_st.st_mode):
+                    if self.ignore_existing:
+                        continue
+                    self._delete(dst, child_relpath)
+                    dst_st = None
+
+                if stat.S_ISDIR(src_st.st_mode):
+                    if dst_st is None:
+                        self._log("mkdir", child_relpath)
+                        if not self.dry_run:
+                            os.mkdir(dst)
+                    with self._lock:
+                        self._dirs.append((dst, src, src_st))
+                    subdirs.append((child_relpath, child, child_state))
+                elif stat.S_ISLNK(src_st.st_mode):
+                    if dst_st is not None and self.ignore_existing:
+                        continue
+                    self._copy_symlink(src, dst, src_st, dst_st,
+                                       child_relpath)
+                elif stat.S_ISREG(src_st.st_mode):
+                    if dst_st is not None and (
+                            self.ignore_existing or
+                            _quick_check_equal(src_st, dst_st)):
+                        continue
+                    self._copy_file(src, dst, src_st, child_relpath)
+                # devices, fifos and sockets are skipped
+            except OSError as exc:
+                with self._lock:
+                    self.errors.append((child_relpath, exc))
+
+        return subdirs
+
+    def run(self, relpath=""):
+        parts = target.path_split(relpath)
+        relpath = os.path.join(*parts) if parts else ""
+
+        node, subpath = self.rules.get_node(relpath)
+        if subpath:
+            node = None
+        state = self.rules.get_node(relpath)[0].get_state()
+
+        src = os.path.join(self.src_root, relpath)
+        dst = os.path.join(self.dest_root, relpath)
+        if not self.dry_run:
+            os.makedirs(dst, exist_ok=True)
+
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            pending = {executor.submit(self._sync_dir, relpath, node, state)}
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    for args in future.result():
+                        pending.add(executor.submit(self._sync_dir, *args))
+
+        if not self.dry_run:
+            for first, dst_file, link_relpath in self._links:
+                try:
+                    if os.path.lexists(dst_file):
+                        os.unlink(dst_file)
+                    os.link(first, dst_file)
+                except OSError as exc:
+                    self.errors.append((link_relpath, exc))
+
+            # directory times change while their contents are written, so
+            # they are applied last, innermost first
+            self._dirs.sort(key=lambda item: item[0].count(os.sep),
+                            reverse=True)
+            for dst_dir, src_dir, st in self._dirs:
+                try:
+                    if self.xattrs:
+                        _copy_xattrs(src_dir, dst_dir)
+                    self._apply_metadata(dst_dir, st)
+                except OSError as exc:
+                    self.errors.append((dst_dir, exc))
+            if relpath == "" and os.path.isdir(src):
+                self._apply_metadata(dst, os.lstat(src))
+
+        if self.errors:
+            raise PartialTransferError(
+                "{} files could not be transferred, first error at {!r}:"
+                " {}".format(len(self.errors), self.errors[0][0],
+                             self.errors[0][1])
+            )
+
+        return self.stats
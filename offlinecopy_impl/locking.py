@@ -0,0 +1,63 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+
+
+# seconds between attempts of acquire_async
+POLL_INTERVAL = 0.2
+
+
+class BusyError(Exception):
+    pass
+
+
+class FileLock:
+    # exclusive advisory lock on a lock file; the lock is released when the
+    # file is closed, which includes the process exiting or crashing
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking=True):
+        f = open(self.path, "a")
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            f.close()
+            return False
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+        return True
+
+    async def acquire_async(self, interval=POLL_INTERVAL):
+        # polls instead of blocking a thread, so that cancelling the waiting
+        # task neither hangs the loop nor leaves a lock behind which is
+        # acquired later by an abandoned thread
+        while not self.acquire(blocking=False):
+            await asyncio.sleep(interval)
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def get_target_lock_path(lock_dir, t):
+    return os.path.join(
+        lock_dir,
+        hashlib.sha1(str(t.dest).encode("utf-8")).hexdigest() + ".lock"
+    )
@@ -1,12 +1,16 @@
 import argparse
+import asyncio
 import configparser
 import contextlib
 import os.path
 import pathlib
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
 from enum import Enum
 
@@ -14,7 +18,11 @@ import lxml.etree
 
 import xdg.BaseDirectory
 
-from . import config, target
+from . import (
+    cache, combine, config, engine, filters, history, localcopy, locking,
+    mirrors, mirrorstate, plan, retention, retry, rulefiles, scan, schedule,
+    strategy, summonqueue, target, transport, trash, usage, verify,
+)
 
 
 def get_targets_path():
@@ -31,20 +39,208 @@ def get_config_path():
     )
 
 
+def get_trash_registry_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "trash-dirs"
+    )
+
+
+def get_history_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "history.jsonl"
+    )
+
+
+def get_queue_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "summon-queue.json"
+    )
+
+
+def get_queue_log_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "summon-queue.log"
+    )
+
+
+def get_mirror_state_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "mirror-state.json"
+    )
+
+
+def get_retention_registry_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "retention-dirs"
+    )
+
+
+def get_default_retention_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "retained"
+    )
+
+
+def get_default_trash_path():
+    return os.path.join(
+        xdg.BaseDirectory.save_data_path("offlinecopy"),
+        "trash"
+    )
+
+
+def get_target_lock_path(t):
+    lock_dir = os.path.join(xdg.BaseDirectory.save_data_path("offlinecopy"),
+                            "locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    return locking.get_target_lock_path(lock_dir, t)
+
+
+@contextlib.asynccontextmanager
+async def target_lock(t, prefix=None, wait=True):
+    # transfers of the same target are serialized across processes, so that
+    # e.g. a scheduled push and an interactive summon do not interleave
+    lock = locking.FileLock(get_target_lock_path(t))
+    if not lock.acquire(blocking=False):
+        if not wait:
+            raise locking.BusyError(
+                "{!r} is in use by another offlinecopy process".format(
+                    str(t.dest))
+            )
+        print("{}waiting for another offlinecopy process using {!r}".format(
+                  prefix or "", str(t.dest)),
+              file=sys.stderr)
+        await lock.acquire_async()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def get_snapshot_path(t):
+    return plan.get_snapshot_path(
+        xdg.BaseDirectory.save_cache_path("offlinecopy"),
+        t
+    )
+
+
+def record_snapshot(t, relpath=None):
+    path = get_snapshot_path(t)
+    if relpath is None:
+        files = plan.take_snapshot(t)
+    else:
+        files = plan.load_snapshot(path, t)
+        if files is None:
+            # a partial snapshot would be worse than none
+            return
+        plan.update_snapshot(files, t, relpath)
+    plan.save_snapshot(path, t, files)
+
+
+@contextlib.contextmanager
+def FilterFile(t, relpath=""):
+    # rule files are cached by the content hash of the rule tree, so they are
+    # only generated again after include or exclude changed the rules
+    yield rulefiles.get_rule_file(
+        os.path.join(xdg.BaseDirectory.save_cache_path("offlinecopy"),
+                     "filters"),
+        t,
+        relpath,
+    )
+
+
 @contextlib.contextmanager
-def FilterFile(t):
+def FilesFromFile(roots):
     with tempfile.NamedTemporaryFile(mode="w", delete=False) as f:
         try:
-            for mode, rule in t.iter_filter_rules():
-                print("{} /{}".format(mode, rule), file=f)
+            for root in roots:
+                print(root.lstrip("/"), file=f)
             f.close()
             yield f.name
         finally:
             os.unlink(f.name)
 
 
-def rsync_invocation_base(cfg, verbosity=0, delete=True):
-    cmd = ["rsync", "-raHEAXS", "--protect-args"]
+def get_transport_profile(t):
+    profile = t.transport or transport.Profile()
+    return transport.resolve(
+        profile,
+        history.read(get_history_path(), target=str(t.dest))
+    )
+
+
+# the block printed by rsync --stats starts with this line
+STATS_MARKER = b"Number of files: "
+
+
+def run_rsync(cfg, cmd, prefix=None, hide_from=None):
+    return engine.run(cmd,
+                      stall_timeout=cfg.stall_timeout,
+                      timeout=cfg.timeout,
+                      prefix=prefix,
+                      hide_from=hide_from)
+
+
+async def run_recorded(cfg, cmd, t, direction, profile, prefix=None,
+                       strategy=None, relpath=None, mirror=None,
+                       members=None):
+    # with members, the transfer of combined targets is recorded for each
+    # of them, with the figures of the whole transfer. The stats are only
+    # shown when asked for or with -v
+    hide_from = None
+    if "--stats" not in cmd and "-v" not in cmd:
+        hide_from = STATS_MARKER
+    cmd = cmd[:1] + ["--stats"] + cmd[1:]
+    t0 = time.monotonic()
+    record = {
+        "time": time.time(),
+        "target": str(t.dest),
+        "direction": direction,
+        "compress": profile.compress == transport.Setting.YES,
+    }
+    if strategy is not None:
+        record["strategy"] = strategy
+    if relpath:
+        record["relpath"] = relpath
+    if mirror is not None:
+        record["mirror"] = mirror
+    try:
+        output = await run_rsync(cfg, cmd, prefix=prefix,
+                                 hide_from=hide_from)
+    except subprocess.CalledProcessError as exc:
+        record["status"] = exc.returncode
+        raise
+    except subprocess.TimeoutExpired:
+        record["status"] = "timeout"
+        raise
+    except asyncio.CancelledError:
+        record["status"] = "cancelled"
+        raise
+    else:
+        record["status"] = 0
+        record.update(transport.parse_stats(output))
+    finally:
+        record["duration"] = time.monotonic() - t0
+        if members is None:
+            history.append(get_history_path(), record)
+        else:
+            record["combined"] = len(members)
+            for member in members:
+                history.append(get_history_path(),
+                               dict(record, target=str(member.dest)))
+
+
+def rsync_invocation_base(cfg, verbosity=0, delete=True, profile=None):
+    if profile is None:
+        profile = transport.Profile()
+
+    cmd = ["rsync"] + transport.flags(profile) + ["--protect-args"]
 
     cmd.extend(cfg.rsync_args)
 
@@ -61,35 +257,340 @@ def rsync_invocation_base(cfg, verbosity=0, delete=True):
     return cmd
 
 
-def rsync_target(cfg, t,
-                 additional_args=[],
-                 verbosity=0,
-                 revert=False,
-                 dry_run=False,
-                 delete=True):
+def rank_sources(t, verbosity=0, dry_run=False):
+    # with a local dry run, nothing must be executed, not even the probes
+    if not t.mirrors or dry_run == DryRunMode.LOCAL:
+        return [t.src]
+
+    ranked = mirrors.rank_sources([t.src] + t.mirrors)
+    if not ranked:
+        print("warning: no source of {!r} responded, using {!r}".format(
+                  str(t.dest), t.src),
+              file=sys.stderr)
+        return [t.src]
+
+    if verbosity > 0:
+        print("using source {!r}".format(ranked[0]))
+
+    return ranked
+
+
+def use_local_engine(cfg, t, additional_args=[]):
+    # the native engine cannot honour rsync options and does not probe
+    # mirrors, so such targets are always left to rsync
+    return (cfg.local_engine == "native" and
+            not cfg.rsync_args and
+            not additional_args and
+            not t.mirrors and
+            not t.has_selections() and
+            localcopy.is_local_source(t.src) and
+            t.dest.is_dir())
+
+
+async def run_local(cfg, t, src_root, dest_root, direction,
+                    relpath="",
+                    verbosity=0,
+                    dry_run=False,
+                    delete=True,
+                    ignore_existing=False,
+                    prefix=None):
+    if dry_run == DryRunMode.LOCAL:
+        print("{}copy {!r} to {!r} (native engine)".format(
+            prefix or "", os.path.join(src_root, relpath[1:]),
+            os.path.join(dest_root, relpath[1:])))
+        return
+
+    def log(action, path):
+        print("{}{} {}".format(prefix or "", action, path))
+
+    profile = get_transport_profile(t)
+    copier = localcopy.Copier(
+        t.rules, src_root, dest_root,
+        delete=delete,
+        ignore_existing=ignore_existing,
+        xattrs=(profile.xattrs == transport.Setting.YES or
+                profile.acls == transport.Setting.YES),
+        dry_run=bool(dry_run),
+        log=log if dry_run or verbosity >= 1 else None,
+    )
+
+    loop = asyncio.get_event_loop()
+    t0 = time.monotonic()
+    record = {
+        "time": time.time(),
+        "target": str(t.dest),
+        "direction": direction,
+        "engine": "native",
+    }
+    if relpath and direction != "summon":
+        record["relpath"] = relpath
+    try:
+        stats = await loop.run_in_executor(None, copier.run, relpath)
+    except localcopy.PartialTransferError as exc:
+        print("error: {}".format(exc), file=sys.stderr)
+        # same exit status as rsync uses for a partial transfer
+        record["status"] = 23
+        raise subprocess.CalledProcessError(
+            23, ["offlinecopy-native", src_root, dest_root]
+        ) from exc
+    else:
+        record["status"] = 0
+        record["files"] = stats["files"]
+        record["size"] = stats["bytes"]
+    finally:
+        if not dry_run:
+            record["duration"] = time.monotonic() - t0
+            history.append(get_history_path(), record)
+
+
+async def rsync_target_async(cfg, t, prefix=None, wait=True, **kwargs):
+    async with target_lock(t, prefix=prefix, wait=wait):
+        await _rsync_target_async(cfg, t, prefix=prefix, **kwargs)
+
+
+async def _rsync_target_async(cfg, t,
+                              additional_args=[],
+                              verbosity=0,
+                              revert=False,
+                              dry_run=False,
+                              delete=True,
+                              prefix=None,
+                              relpath="",
+                              mirror=None,
+                              write_batch=None,
+                              read_batch=None):
+    # with mirror, the push goes to that mirror instead of the source; a
+    # batch file can be written by a push (covering a single rsync run) and
+    # replayed to a mirror
+    loop = asyncio.get_event_loop()
+
+    if mirror is not None:
+        t = t.copy()
+        t.src = mirror
+        t.mirrors = []
+
+    # with a relpath, only the subtree is transferred, using the rules of
+    # the subtree; deletions are confined to it as well
+    scope = t.subtarget(relpath)
+    if scope.rules.get_state() == target.State.EVICTED and \
+            not scope.rules.childmap:
+        print("{}note: {!r} is excluded, nothing to transfer".format(
+                  prefix or "", str(scope.dest)),
+              file=sys.stderr)
+        return
+
+    if not revert and not dry_run and t.mirrors:
+        # the mirrors are out of step with the source from now on, until
+        # they are pushed to as well
+        with mirrorstate.modify(get_mirror_state_path()) as state:
+            mirrorstate.advance(state, t)
+
+    if     (use_local_engine(cfg, t, additional_args) and
+            write_batch is None and read_batch is None):
+        src_root = t.src.rstrip("/") or "/"
+        if revert:
+            await run_local(cfg, t, src_root, str(t.dest), "revert",
+                            relpath=relpath,
+                            verbosity=verbosity, dry_run=dry_run,
+                            delete=delete, prefix=prefix)
+        else:
+            await run_local(cfg, t, str(t.dest), src_root, "push",
+                            relpath=relpath,
+                            verbosity=verbosity, dry_run=dry_run,
+                            delete=delete, prefix=prefix)
+        if not dry_run and mirror is None:
+            await loop.run_in_executor(None, record_snapshot, t,
+                                       relpath or None)
+        return
+
+    # size limits need separate rsync runs
+    for part, part_relpath, max_size in t.split_size_limits(relpath):
+        await _rsync_part_async(cfg, part,
+                                additional_args=additional_args,
+                                verbosity=verbosity,
+                                revert=revert,
+                                dry_run=dry_run,
+                                delete=delete,
+                                prefix=prefix,
+                                relpath=part_relpath,
+                                max_size=max_size,
+                                mirror=mirror,
+                                write_batch=write_batch,
+                                read_batch=read_batch)
+
+    # the snapshot describes the state of the source
+    if not dry_run and mirror is None:
+        await loop.run_in_executor(None, record_snapshot, t,
+                                   relpath or None)
+
+
+async def _rsync_part_async(cfg, t,
+                            additional_args=[],
+                            verbosity=0,
+                            revert=False,
+                            dry_run=False,
+                            delete=True,
+                            prefix=None,
+                            relpath="",
+                            max_size=None,
+                            mirror=None,
+                            write_batch=None,
+                            read_batch=None,
+                            members=None):
+    # members are the targets combined into t, if any
+    loop = asyncio.get_event_loop()
+    scope = t.subtarget(relpath)
+
+    if max_size is not None and not revert:
+        # files above the limit are missing locally, which must not make
+        # rsync delete them on the remote side
+        delete = False
+
+    profile = get_transport_profile(members[0] if members else t)
     cmd = rsync_invocation_base(cfg,
                                 verbosity=verbosity,
-                                delete=delete)
+                                delete=delete,
+                                profile=profile)
+    if max_size is not None:
+        cmd.append("--max-size={}".format(max_size))
+
+    if write_batch is not None:
+        cmd.append("--write-batch={}".format(write_batch))
+    elif read_batch is not None:
+        cmd.append("--read-batch={}".format(read_batch))
+
+    transfer_strategy, roots = strategy.choose(
+        scope,
+        # the file list of a batch is replayed as it is
+        strategy.FILTER if write_batch or read_batch
+        else cfg.transfer_strategy,
+    )
+    if verbosity > 0:
+        if transfer_strategy == strategy.LIST:
+            print("{}using list mode with {} included roots".format(
+                prefix or "", len(roots)))
+        else:
+            print("{}using filter mode".format(prefix or ""))
 
-    with FilterFile(t) as name:
+    with contextlib.ExitStack() as stack:
+        name = stack.enter_context(FilterFile(t, relpath))
         cmd.extend(["--filter", ". {}".format(name)])
+
+        if transfer_strategy == strategy.LIST:
+            # the filter rules still apply below the listed roots; roots
+            # which do not exist on the sending side are deleted on the
+            # receiving side, as the filter mode would do
+            cmd.extend(["--files-from",
+                        stack.enter_context(FilesFromFile(roots))])
+            if delete:
+                cmd.append("--delete-missing-args")
+
         cmd.extend(additional_args)
 
-        dest_path = str(t.dest)
-        if t.dest.is_dir():
+        dest_path = str(scope.dest)
+        if scope.dest.is_dir():
             dest_path += "/"
 
         if revert:
-            cmd.append(t.src)
+            sources = await loop.run_in_executor(
+                None, rank_sources, scope, verbosity, dry_run
+            )
+            source = sources[0]
+        else:
+            source = scope.src
+
+        if relpath and not scope.dest.is_dir():
+            # a file inside a directory target
+            source = source.rstrip("/")
+
+        if revert:
+            cmd.append(source)
             cmd.append(dest_path)
+        elif read_batch is not None:
+            # the data comes from the batch instead of the local copy
+            cmd.append(source)
         else:
             cmd.append(dest_path)
-            cmd.append(t.src)
+            cmd.append(source)
 
         if dry_run:
             apply_dry_run_mode(cmd, dry_run)
+            await run_rsync(cfg, cmd, prefix=prefix)
+            return
 
-        subprocess.check_call(cmd)
+        # pushes to mirrors and batch replays are recorded apart, so that
+        # they do not count towards the durations of pushes to the source
+        if revert:
+            direction = "revert"
+        elif mirror is not None:
+            direction = "push-mirror"
+        else:
+            direction = "push"
+        await run_recorded(cfg, cmd, t, direction,
+                           profile, prefix=prefix,
+                           strategy=transfer_strategy,
+                           relpath=relpath,
+                           mirror=mirror,
+                           members=members)
+
+
+def rsync_target(cfg, t, **kwargs):
+    return asyncio.run(rsync_target_async(cfg, t, **kwargs))
+
+
+async def push_mirrors_async(cfg, t, prefix=None, relpath="",
+                             dry_run=False, verbosity=0, **kwargs):
+    # push to the source and then to all mirrors of the target. The changes
+    # are computed once: the push to the source writes a batch file, which
+    # is replayed to the mirrors that were in step with the source. Other
+    # mirrors, and those the batch fails on, get a normal push.
+    kwargs.update(prefix=prefix, relpath=relpath, dry_run=dry_run,
+                  verbosity=verbosity)
+    async with target_lock(t, prefix=prefix):
+        if dry_run:
+            await _rsync_target_async(cfg, t, **kwargs)
+            for mirror in t.mirrors:
+                await _rsync_target_async(cfg, t, mirror=mirror, **kwargs)
+            return
+
+        state_path = get_mirror_state_path()
+        in_step = set()
+        if len(list(t.split_size_limits(relpath))) == 1:
+            state = mirrorstate.load(state_path)
+            in_step = {mirror for mirror in t.mirrors
+                       if mirrorstate.in_step(state, t, mirror)}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            batch = os.path.join(tmpdir, "batch") if in_step else None
+            await _rsync_target_async(cfg, t, write_batch=batch, **kwargs)
+
+            for mirror in t.mirrors:
+                if mirror in in_step:
+                    if verbosity > 0:
+                        print("{}replaying changes to {!r}".format(
+                            prefix or "", mirror))
+                    try:
+                        await _rsync_target_async(cfg, t, mirror=mirror,
+                                                  read_batch=batch, **kwargs)
+                    except subprocess.CalledProcessError as exc:
+                        print("{}note: replaying to {!r} failed ({}),"
+                              " pushing normally".format(
+                                  prefix or "", mirror, format_error(exc)),
+                              file=sys.stderr)
+                    else:
+                        with mirrorstate.modify(state_path) as state:
+                            mirrorstate.mark_synced(state, t, mirror)
+                        continue
+                elif verbosity > 0:
+                    print("{}{!r} is out of step, pushing normally".format(
+                        prefix or "", mirror))
+
+                await _rsync_target_async(cfg, t, mirror=mirror, **kwargs)
+                if mirror in in_step or not relpath:
+                    # outside of the subtree, the mirror is only known to
+                    # match the source if it was in step before
+                    with mirrorstate.modify(state_path) as state:
+                        mirrorstate.mark_synced(state, t, mirror)
 
 
 def read_config(path):
@@ -113,7 +614,7 @@ def read_targets(path):
         with f:
             targets = lxml.etree.parse(f).getroot()
 
-    return list(config.load_targets(targets))
+    return config.TargetList(config.load_targets(targets))
 
 
 def validate_targets(targets):
@@ -127,14 +628,22 @@ def validate_targets(targets):
 
 
 def write_targets(path, targets):
-    validate_targets(targets)
+    # other processes may have written the file since it was read; their
+    # changes are kept and ours are applied on top of them
+    with locking.FileLock(str(path) + ".lock"):
+        if isinstance(targets, config.TargetList):
+            config.merge_targets(targets, read_targets(path))
+
+        validate_targets(targets)
 
-    root = config.E.targets()
-    config.save_targets(root, targets)
-    data = lxml.etree.tostring(root, encoding="utf-8")
+        root = config.E.targets()
+        config.save_targets(root, targets)
+        data = lxml.etree.tostring(root, encoding="utf-8")
 
-    with open(path, "wb") as f:
-        f.write(data)
+        tmp_path = str(path) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, str(path))
 
 
 def get_target_from_path(targets, path):
@@ -152,6 +661,117 @@ def get_target_by_path(targets, path):
             return target
 
 
+def remove_local(path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(str(path))
+    else:
+        path.unlink()
+
+
+def move_to_trash(path, target_dests):
+    # returns False if the path had to be deleted synchronously
+    trash_dir = trash.find_trash_dir(str(path),
+                                     get_default_trash_path(),
+                                     forbidden=target_dests)
+    if trash_dir is None:
+        print("warning: no trash directory on the file system of {!r},"
+              " deleting synchronously".format(str(path)),
+              file=sys.stderr)
+        remove_local(pathlib.Path(path))
+        return False
+
+    trash.register(get_trash_registry_path(), trash_dir)
+    trash.move_to_trash(str(path), trash_dir)
+    return True
+
+
+def evict_local(targets, paths, retain_budget=None):
+    # with a retain_budget, the data is kept in the retention area (as far
+    # as the budget allows) instead of being deleted
+    retention_registry_path = get_retention_registry_path()
+    target_dests = [t.dest.resolve() for t in targets]
+
+    moved = retained = False
+    for path in paths:
+        if retain_budget is not None:
+            retention_dir = trash.find_trash_dir(
+                str(path),
+                get_default_retention_path(),
+                forbidden=target_dests,
+                name="retained",
+            )
+            if retention_dir is not None:
+                trash.register(retention_registry_path, retention_dir)
+                retention.retain(str(path), retention_dir)
+                retained = True
+                continue
+
+        moved = move_to_trash(path, target_dests) or moved
+
+    if retain_budget is not None:
+        moved = expire_retained(targets, retain_budget) or moved
+
+    if moved or retained:
+        # also picks up entries left behind by crashed workers and measures
+        # the newly retained data
+        spawn_drain()
+
+
+def expire_retained(targets, retain_budget):
+    target_dests = [t.dest.resolve() for t in targets]
+    moved = False
+    for entry in retention.expired(
+            trash.read_registry(get_retention_registry_path()),
+            retain_budget):
+        moved = drop_retained_entry(entry, target_dests) or moved
+    return moved
+
+
+def spawn_drain():
+    # the deletion is left to "offlinecopy trash --drain" in a separate
+    # interpreter and session, which outlives us; forking this process
+    # instead is unsafe with threads and a running event loop
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env.get("PYTHONPATH"),
+    ]))
+    proc = subprocess.Popen(
+        [sys.executable, "-c",
+         "import sys; sys.argv[0] = 'offlinecopy'; "
+         "import offlinecopy_impl.main; offlinecopy_impl.main.main()",
+         "trash", "--drain"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        env=env,
+        start_new_session=True,
+    )
+    # reaped by us while we are still running and by init afterwards
+    threading.Thread(target=proc.wait, daemon=True).start()
+
+
+def drop_retained_entry(entry, target_dests):
+    # another process may have dropped the entry already
+    try:
+        return move_to_trash(entry.path, target_dests)
+    except FileNotFoundError:
+        return False
+
+
+def drop_retained(targets, path):
+    # retained data of path is superseded once it has been summoned
+    target_dests = [t.dest.resolve() for t in targets]
+    moved = False
+    for entry in retention.superseded(
+            trash.read_registry(get_retention_registry_path()), path):
+        moved = drop_retained_entry(entry, target_dests) or moved
+    if moved:
+        spawn_drain()
+
+
 def cmdfunc_add(args, cfg, targets):
     dest = pathlib.Path(args.dest).resolve()
     parents = list(dest.parents)
@@ -205,12 +825,11 @@ def cmdfunc_exclude(args, cfg, targets):
         sys.exit(1)
 
     t.evict(relpath)
-    t.prune()
 
     write_targets(get_targets_path(), targets)
 
     if args.evict:
-        shutil.rmtree(path)
+        evict_local(targets, [path], retain_budget=cfg.retain_budget)
 
 
 def cmdfunc_include(args, cfg, targets):
@@ -226,107 +845,519 @@ def cmdfunc_include(args, cfg, targets):
               file=sys.stderr)
         sys.exit(1)
 
+    selection = get_selection(args)
     state = t.get_state(relpath)
-    if state == target.State.INCLUDED:
+    if     (state == target.State.INCLUDED and
+            t.get_selection(relpath) == selection):
         print("error: {!r} is already included".format(relpath),
               file=sys.stderr)
         sys.exit(1)
 
-    t.include(relpath)
-    t.prune()
-
-    if args.summon:
-        cmd = rsync_invocation_base(cfg,
-                                    verbosity=args.verbosity,
-                                    delete=False)
+    if args.summon and args.background:
         if args.dry_run:
-            apply_dry_run_mode(cmd, args.dry_run)
-
-        cmd.extend(args.rsync_opts)
-        cmd.append("--ignore-existing")
+            print("error: --background cannot be combined with --dry-run",
+                  file=sys.stderr)
+            sys.exit(1)
+        # the path is only included by the worker, after the transfer
+        with summonqueue.modify(get_queue_path()) as queue:
+            entry = summonqueue.add(queue, str(t.dest), relpath,
+                                    priority=args.priority,
+                                    rsync_opts=args.rsync_opts,
+                                    split=args.split,
+                                    verbosity=args.verbosity,
+                                    patterns=list(args.patterns),
+                                    max_size=args.max_size)
+        print("queued as #{}".format(entry["id"]))
+        spawn_queue_worker(cfg)
+        return
 
-        cmd.append(os.path.join(t.src, relpath[1:])+"/")
-        cmd.append(str(t.dest / relpath[1:]))
+    t.include(relpath, selection)
 
-        subprocess.check_call(cmd)
+    if args.summon:
+        summon(cfg, t, relpath,
+               additional_args=args.rsync_opts,
+               verbosity=args.verbosity,
+               dry_run=args.dry_run,
+               split=args.split)
 
     if not args.dry_run:
         write_targets(get_targets_path(), targets)
 
 
+async def summon_async(cfg, t, relpath, **kwargs):
+    async with target_lock(t):
+        await _summon_async(cfg, t, relpath, **kwargs)
+
+
+async def _summon_async(cfg, t, relpath,
+                        additional_args=[],
+                        verbosity=0,
+                        dry_run=False,
+                        split=False):
+    loop = asyncio.get_event_loop()
+
+    if use_local_engine(cfg, t, additional_args):
+        # the native engine copies from a local source, there is nothing to
+        # gain from retained data
+        await run_local(cfg, t, t.src.rstrip("/") or "/", str(t.dest),
+                        "summon",
+                        relpath=relpath,
+                        verbosity=verbosity,
+                        dry_run=dry_run,
+                        delete=False,
+                        ignore_existing=True)
+        if not dry_run:
+            await loop.run_in_executor(None, record_snapshot, t, relpath)
+        return
+
+    sources = await loop.run_in_executor(
+        None, rank_sources, t, verbosity, dry_run
+    )
+
+    profile = get_transport_profile(t)
+    cmd = rsync_invocation_base(cfg,
+                                verbosity=verbosity,
+                                delete=False,
+                                profile=profile)
+    if dry_run:
+        apply_dry_run_mode(cmd, dry_run)
+
+    cmd.extend(additional_args)
+    cmd.append("--ignore-existing")
+
+    if dry_run:
+        def run(cmd, prefix=None):
+            return run_rsync(cfg, cmd, prefix=prefix)
+    else:
+        def run(cmd, prefix=None):
+            return run_recorded(cfg, cmd, t, "summon", profile,
+                                prefix=prefix)
+
+    selective = t.subtarget(relpath).has_selections()
+    if selective:
+        # only what the selections allow is fetched, and directories which
+        # would stay empty are not created
+        cmd.append("--prune-empty-dirs")
+        parts = t.split_size_limits(relpath)
+    else:
+        parts = [(t, relpath, None)]
+
+    for part, part_relpath, max_size in parts:
+        with contextlib.ExitStack() as stack:
+            part_cmd = list(cmd)
+            if selective:
+                part_cmd.extend([
+                    "--filter",
+                    ". {}".format(stack.enter_context(
+                        FilterFile(part, part_relpath))),
+                ])
+            if max_size is not None:
+                part_cmd.append("--max-size={}".format(max_size))
+            # unchanged files are hard-linked from retained data of the
+            # path instead of being transferred again
+            for base in await loop.run_in_executor(
+                    None, retention.find_bases,
+                    trash.read_registry(get_retention_registry_path()),
+                    str(t.dest / part_relpath[1:])):
+                part_cmd.append("--link-dest={}".format(base))
+
+            if split and len(sources) > 1:
+                await summon_split(part_cmd, t, part_relpath, sources, run,
+                                   verbosity)
+            else:
+                part_cmd.append(
+                    os.path.join(sources[0], part_relpath[1:])+"/")
+                part_cmd.append(str(t.dest / part_relpath[1:]))
+
+                await run(part_cmd)
+
+    if not dry_run:
+        await loop.run_in_executor(None, record_snapshot, t, relpath)
+        drop_retained([t], str(t.dest / relpath[1:]))
+
+
+def summon(cfg, t, relpath, **kwargs):
+    return asyncio.run(summon_async(cfg, t, relpath, **kwargs))
+
+
+async def summon_split(cmd, t, relpath, sources, run, verbosity=0):
+    loop = asyncio.get_event_loop()
+    entries = await loop.run_in_executor(
+        None,
+        mirrors.list_entries,
+        os.path.join(sources[0], relpath[1:])+"/",
+    )
+    shares = mirrors.split_entries(entries, len(sources))
+
+    with contextlib.ExitStack() as stack:
+        transfers = []
+        for source, share in zip(sources, shares):
+            if not share:
+                continue
+            f = stack.enter_context(
+                tempfile.NamedTemporaryFile(mode="w")
+            )
+            for entry in share:
+                print(entry, file=f)
+            f.flush()
+
+            if verbosity > 0:
+                print("fetching {} entries from {!r}".format(
+                    len(share), source))
+
+            transfers.append(run(
+                cmd + [
+                    "--files-from", f.name,
+                    os.path.join(source, relpath[1:])+"/",
+                    str(t.dest / relpath[1:]),
+                ],
+                prefix="[{}] ".format(source),
+            ))
+
+        await engine.gather_limited(transfers, len(transfers))
+
+
+async def run_queued_summon(cfg, entry):
+    # the targets are read again, as they may have changed since the summon
+    # was queued
+    loop = asyncio.get_event_loop()
+    targets = read_targets(get_targets_path())
+    t = get_target_by_path(targets, pathlib.Path(entry["target"]))
+    if t is None:
+        raise LookupError("{!r} is not a target anymore".format(
+            entry["target"]))
+
+    relpath = entry["relpath"]
+    options = entry["options"]
+    selection = None
+    if options.get("patterns") or options.get("max_size") is not None:
+        selection = target.Selection(tuple(options.get("patterns", [])),
+                                     options.get("max_size"))
+    if     (t.get_state(relpath) == target.State.INCLUDED and
+            t.get_selection(relpath) == selection):
+        return
+
+    t.include(relpath, selection)
+    await summon_async(cfg, t, relpath,
+                       additional_args=options.get("rsync_opts", []),
+                       verbosity=options.get("verbosity", 0),
+                       split=options.get("split", False))
+    await loop.run_in_executor(None, write_targets, get_targets_path(),
+                               targets)
+
+
+def format_error(exc):
+    if isinstance(exc, subprocess.CalledProcessError):
+        return "rsync exited with status {}".format(exc.returncode)
+    return str(exc) or type(exc).__name__
+
+
+async def work_queue(cfg, jobs, poll_interval=1):
+    # process the summon queue until it is empty; returns False if another
+    # worker is already processing it
+    path = get_queue_path()
+    worker_lock = locking.FileLock(path + ".worker")
+    if not worker_lock.acquire(blocking=False):
+        return False
+
+    running = {}
+    try:
+        with summonqueue.modify(path) as queue:
+            summonqueue.reset_running(queue)
+
+        while True:
+            with summonqueue.modify(path) as queue:
+                for entry in queue["entries"]:
+                    if entry.get("cancel") and entry["id"] in running:
+                        running[entry["id"]].cancel()
+
+                for entry in summonqueue.next_entries(queue,
+                                                      jobs - len(running)):
+                    entry["state"] = summonqueue.RUNNING
+                    entry["started"] = time.time()
+                    print("summoning #{} {!r}".format(
+                        entry["id"], entry["target"] + entry["relpath"]))
+                    running[entry["id"]] = asyncio.ensure_future(
+                        run_queued_summon(cfg, dict(entry))
+                    )
+
+                if not running:
+                    # released while the queue is locked: whoever adds an
+                    # entry after this either sees no worker and starts one,
+                    # or added it before this check
+                    worker_lock.release()
+                    return True
+
+            await asyncio.wait(list(running.values()),
+                               timeout=poll_interval,
+                               return_when=asyncio.FIRST_COMPLETED)
+
+            finished = [id_ for id_, task in running.items() if task.done()]
+            if not finished:
+                continue
+
+            with summonqueue.modify(path) as queue:
+                for id_ in finished:
+                    task = running.pop(id_)
+                    entry = summonqueue.find(queue, id_)
+                    if entry is None:
+                        continue
+                    if task.cancelled():
+                        print("cancelled #{}".format(id_))
+                    elif task.exception() is not None:
+                        entry["state"] = summonqueue.FAILED
+                        entry["error"] = format_error(task.exception())
+                        print("error: #{} failed: {}".format(
+                                  id_, entry["error"]),
+                              file=sys.stderr)
+                        continue
+                    else:
+                        print("finished #{}".format(id_))
+                    queue["entries"].remove(entry)
+    finally:
+        for task in running.values():
+            task.cancel()
+        if running:
+            await asyncio.wait(list(running.values()))
+        worker_lock.release()
+
+
+def spawn_queue_worker(cfg):
+    summonqueue.spawn_worker(
+        lambda: asyncio.run(work_queue(cfg, cfg.summon_jobs)),
+        get_queue_log_path(),
+    )
+
+
+def select_scopes(targets, paths):
+    # map each path to (target, relpath); the relpath is empty for target
+    # roots
+    scopes = []
+    for path in paths:
+        path = pathlib.Path(path).resolve()
+        t, relpath = get_target_from_path(targets, path)
+        if t is None:
+            print("error: no matching target for paths:", file=sys.stderr)
+            print("  {!r}".format(str(path)), file=sys.stderr)
+            sys.exit(1)
+        scopes.append((t, relpath))
+    return scopes
+
+
+def format_scope(t, relpath):
+    return str(t.dest) + relpath
+
+
+def get_combined_units(cfg, scopes, additional_args=[]):
+    # group whole targets which can be pushed in one rsync session: their
+    # sources and destinations have common parents and they are transferred
+    # with the same options
+    def key(t):
+        return tuple(transport.flags(get_transport_profile(t)))
+
+    combinable = [
+        t for t, relpath in scopes
+        if not relpath and
+        t.dest.is_dir() and
+        not use_local_engine(cfg, t, additional_args)
+    ]
+    groups = {
+        t: group
+        for group in combine.group(combinable, key=key)
+        for t in group
+    }
+
+    units = []
+    for t, relpath in scopes:
+        if t not in groups:
+            units.append(((t, relpath),))
+        elif groups[t][0] is t:
+            units.append(tuple((member, "") for member in groups[t]))
+    return units
+
+
+async def push_combined_async(cfg, targets, prefix=None, **kwargs):
+    # push targets with common roots (see combine) in one rsync session
+    loop = asyncio.get_event_loop()
+    async with contextlib.AsyncExitStack() as stack:
+        for t in sorted(targets, key=lambda t: str(t.dest)):
+            await stack.enter_async_context(target_lock(t, prefix=prefix))
+
+        if any(t.mirrors for t in targets):
+            with mirrorstate.modify(get_mirror_state_path()) as state:
+                for t in targets:
+                    if t.mirrors:
+                        mirrorstate.advance(state, t)
+
+        combined = combine.combine(targets)
+        for part, relpath, max_size in combined.split_size_limits():
+            await _rsync_part_async(cfg, part,
+                                    prefix=prefix,
+                                    relpath=relpath,
+                                    max_size=max_size,
+                                    members=targets,
+                                    **kwargs)
+
+        for t in targets:
+            await loop.run_in_executor(None, record_snapshot, t, None)
+
+
 def cmdfunc_push(args, cfg, targets):
     if args.diff:
         args.dry_run = DryRunMode.RSYNC
         args.verbosity = 1
 
-    all_targets = frozenset(targets)
-    selection = {pathlib.Path(path).resolve() for path in args.targets}
-
-    if not selection:
-        matched_targets = set(targets)
-    else:
-        matched_targets = set()
-        for t in targets:
-            target_dest = pathlib.Path(t.dest).resolve()
-            if target_dest in selection:
-                matched_targets.add(t)
-                selection.remove(target_dest)
+    if args.combine and args.mirrors:
+        print("error: --combine cannot be used with --mirrors",
+              file=sys.stderr)
+        sys.exit(1)
 
-        if selection:
-            for path in selection:
-                print("error: no matching target for paths:", file=sys.stderr)
-                print("  {!r}".format(str(path)), file=sys.stderr)
-                sys.exit(1)
+    scopes = select_scopes(targets, args.targets)
 
     if args.not_:
-        matched_targets = all_targets - matched_targets
+        if any(relpath for _, relpath in scopes):
+            print("error: --not only accepts target directories",
+                  file=sys.stderr)
+            sys.exit(1)
+        excluded = {t for t, _ in scopes}
+        scopes = [(t, "") for t in targets if t not in excluded]
+    elif not scopes:
+        scopes = [(t, "") for t in targets]
 
-    if not matched_targets:
+    if not scopes:
         print("note: no targets selected", file=sys.stderr)
         sys.exit(1)
 
-    matched_targets = sorted(matched_targets,
-                             key=lambda target: target.dest)
+    scopes = sorted(set(scopes), key=lambda scope: format_scope(*scope))
+
+    if args.jobs > 1:
+        # start the targets which took longest in the past first, so that
+        # they do not end up running alone at the end; unknown targets go
+        # first. Subtree pushes say little about the duration of a full push.
+        records = history.read(get_history_path())
+        expected = {
+            scope: history.expected_duration(
+                [record for record in records
+                 if record.get("target") == str(scope[0].dest) and
+                 record.get("relpath", "") == scope[1]]
+            )
+            for scope in scopes
+        }
+        scopes.sort(
+            key=lambda scope: (expected[scope] is not None,
+                               -(expected[scope] or 0))
+        )
+
+    # each unit is pushed by one rsync session (or one per size limit)
+    if args.combine and not args.dry_run:
+        units = get_combined_units(cfg, scopes, args.rsync_opts)
+    else:
+        units = [(scope,) for scope in scopes]
+
+    def get_prefix(unit):
+        if args.jobs <= 1:
+            return None
+        return "[{}] ".format(", ".join(format_scope(*scope)
+                                        for scope in unit))
+
+    async def push(unit):
+        if len(unit) > 1:
+            if args.verbosity > 0 and args.jobs <= 1:
+                print("pushing targets {} together".format(
+                    ", ".join(repr(format_scope(*scope))
+                              for scope in unit)))
+            await push_combined_async(
+                cfg, [t for t, _ in unit],
+                additional_args=args.rsync_opts,
+                verbosity=args.verbosity,
+                prefix=get_prefix(unit),
+            )
+            return
+
+        (t, relpath), = unit
+        if args.jobs <= 1 and args.verbosity > 0:
+            print("pushing {} {!r}".format(
+                "subtree" if relpath else "target",
+                format_scope(t, relpath)))
+        await (push_mirrors_async if args.mirrors else rsync_target_async)(
+            cfg, t,
+            additional_args=args.rsync_opts,
+            dry_run=args.dry_run,
+            revert=False,
+            verbosity=args.verbosity,
+            prefix=get_prefix(unit),
+            relpath=relpath,
+        )
+
+    def on_failure(unit, exc, delay):
+        if delay is None:
+            print("{}error: {}".format(get_prefix(unit) or "",
+                                       format_error(exc)),
+                  file=sys.stderr)
+        else:
+            print("{}error: {}, retrying in {}".format(
+                      get_prefix(unit) or "", format_error(exc),
+                      format_duration(delay)),
+                  file=sys.stderr)
 
-    for t in matched_targets:
-        if args.verbosity > 0:
-            print("pushing target {!r}".format(str(t.dest)))
-        rsync_target(cfg, t,
-                     additional_args=args.rsync_opts,
-                     dry_run=args.dry_run,
-                     revert=False,
-                     verbosity=args.verbosity)
+    retries = cfg.push_retries if args.retries is None else args.retries
+    unit_results = asyncio.run(retry.run_all(
+        units, push,
+        jobs=max(args.jobs, 1),
+        attempts=retries + 1,
+        base_delay=cfg.retry_delay,
+        on_failure=on_failure,
+    ))
+    scopes, results = [], []
+    for unit, result in zip(units, unit_results):
+        scopes.extend(unit)
+        results.extend([result] * len(unit))
+
+    if len(scopes) > 1 and any(result.status != retry.OK
+                               for result in results):
+        print("summary:", file=sys.stderr)
+        for scope, result in sorted(zip(scopes, results),
+                                    key=lambda x: format_scope(*x[0])):
+            line = "  {:<9} {}".format(result.status, format_scope(*scope))
+            if result.error is not None:
+                line += ": {}".format(format_error(result.error))
+            if result.attempts > 1:
+                line += " ({} attempts)".format(result.attempts)
+            print(line, file=sys.stderr)
+
+    # transient failures get an exit status of their own, so that wrappers
+    # can tell that trying again later may help
+    statuses = {result.status for result in results}
+    if retry.FAILED in statuses:
+        return 1
+    if retry.TRANSIENT in statuses:
+        return os.EX_TEMPFAIL
 
 
 def cmdfunc_revert(args, cfg, targets):
-    selection = {pathlib.Path(path).resolve() for path in args.targets}
+    scopes = select_scopes(targets, args.targets)
 
-    if not selection and not args.map_none_to_all:
+    if not scopes and not args.map_none_to_all:
         print("error: no target selected (did you mean --all?)",
               file=sys.stderr)
         sys.exit(1)
-    elif not selection:
-        matched_targets = list(targets)
-    else:
-        matched_targets = []
-        for t in targets:
-            target_dest = t.dest.resolve()
-            if target_dest in selection:
-                matched_targets.append(t)
-                selection.remove(target_dest)
-
-        if selection:
-            for path in selection:
-                print("error: no matching target for paths:", file=sys.stderr)
-                print("  {}".format(path), file=sys.stderr)
-                sys.exit(1)
+    elif not scopes:
+        scopes = [(t, "") for t in targets]
 
-    for t in matched_targets:
+    for t, relpath in scopes:
         rsync_target(cfg, t,
                      additional_args=args.rsync_opts,
                      dry_run=args.dry_run,
                      revert=True,
-                     verbosity=args.verbosity)
+                     verbosity=args.verbosity,
+                     relpath=relpath)
+
+
+def format_selection(selection):
+    parts = list(selection.patterns)
+    if selection.max_size is not None:
+        parts.append("max-size={}".format(selection.max_size))
+    return " ".join(parts)
 
 
 def cmdfunc_list(args, cfg, targets):
@@ -335,9 +1366,698 @@ def cmdfunc_list(args, cfg, targets):
         if dest_path.is_dir():
             dest_path = str(dest_path) + "/"
         print("{} => {}".format(target.src, dest_path))
+        for mirror in target.mirrors:
+            print("  mirror {}".format(mirror))
+        if target.transport is not None and \
+                not target.transport.is_default():
+            print("  transport {}".format(format_profile(target.transport)))
+        if target.schedule is not None:
+            print("  schedule {}".format(format_schedule(target.schedule)))
+        for selection, path in target.iter_selections():
+            print("  select /{} {}".format(path, format_selection(selection)))
         for state, path in target.iter_filter_rules():
             print("  {} {}".format(state, path))
 
+        if args.sizes:
+            print("  sizes:")
+            for state, path, size in get_node_sizes(target):
+                print("    {:>14} {} /{}".format(size, state.value, path))
+
+
+def get_node_sizes(t):
+    cache_path = usage.get_cache_path(
+        xdg.BaseDirectory.save_cache_path("offlinecopy"),
+        t
+    )
+    records = usage.walk(t.dest, usage.load_cache(cache_path),
+                         get_selection=t.get_selection)
+    usage.save_cache(cache_path, records)
+    dir_totals = usage.totals(records)
+
+    return [
+        (state, path, usage.path_usage(t.dest, dir_totals, path))
+        for state, path in t.iter_flat_nodes()
+    ]
+
+
+def select_targets(targets, paths):
+    selection = {pathlib.Path(path).resolve() for path in paths}
+
+    matched_targets = []
+    for t in targets:
+        if not selection or t.dest.resolve() in selection:
+            matched_targets.append(t)
+            selection.discard(t.dest.resolve())
+
+    if selection:
+        for path in selection:
+            print("error: no matching target for paths:", file=sys.stderr)
+            print("  {!r}".format(str(path)), file=sys.stderr)
+            sys.exit(1)
+
+    return matched_targets
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    return "{:.1f}s".format(seconds)
+
+
+def cmdfunc_stats(args, cfg, targets):
+    matched_targets = select_targets(targets, args.targets)
+    records = history.read(get_history_path())
+
+    for t in sorted(matched_targets, key=lambda target: target.dest):
+        target_records = [record for record in records
+                          if record.get("target") == str(t.dest)]
+        if args.last:
+            target_records = target_records[-args.last:]
+
+        print(t.dest)
+        if not target_records:
+            print("  no transfers recorded")
+            continue
+
+        for direction, direction_records in \
+                history.group_by_direction(target_records).items():
+            durations = [record["duration"]
+                         for record in direction_records
+                         if record.get("status") == 0]
+            sizes = [record.get("size", 0)
+                     for record in direction_records
+                     if record.get("status") == 0]
+            failed = sum(1 for record in direction_records
+                         if record.get("status") != 0)
+            trend = history.trend([record for record in direction_records
+                                   if record.get("status") == 0])
+
+            print("  {}: {} runs, {} failed, last {}".format(
+                direction,
+                len(direction_records),
+                failed,
+                time.strftime(
+                    "%Y-%m-%d %H:%M",
+                    time.localtime(direction_records[-1]["time"])
+                ),
+            ))
+            print("    duration p50 {} p90 {} max {}, trend {}".format(
+                format_duration(history.percentile(durations, 50)),
+                format_duration(history.percentile(durations, 90)),
+                format_duration(max(durations, default=None)),
+                "-" if trend is None else "{:+.1f}s/day".format(trend),
+            ))
+            print("    transferred p50 {} p90 {} bytes".format(
+                history.percentile(sizes, 50) or 0,
+                history.percentile(sizes, 90) or 0,
+            ))
+
+
+def hash_tree(root, files, relpath="", jobs=None):
+    cache_path = verify.get_cache_path(
+        xdg.BaseDirectory.save_cache_path("offlinecopy"),
+        root
+    )
+    old_cache = verify.load_cache(cache_path)
+    manifest, cache = verify.build_manifest(root, files, old_cache,
+                                            jobs=jobs)
+
+    # entries outside of the subtree which was hashed stay valid
+    prefix = "".join("/" + part for part in target.path_split(relpath))
+    if prefix:
+        for path, entry in old_cache.items():
+            if not (path == prefix or path.startswith(prefix + "/")):
+                cache.setdefault(path, entry)
+
+    verify.save_cache(cache_path, cache)
+    return manifest
+
+
+def get_source_manifest(t, relpath, manifest_path, jobs=None):
+    if manifest_path is not None:
+        with open(manifest_path) as f:
+            manifest = verify.read_manifest(f)
+        prefix = "".join("/" + part for part in target.path_split(relpath))
+
+        def wanted(path):
+            if not (path == prefix or path.startswith(prefix + "/")):
+                return False
+            selection = t.get_entry_selection(path)
+            if selection is None or selection.max_size is None:
+                return t.get_entry_state(path) == target.State.INCLUDED
+            # manifests do not record sizes; a file which is missing
+            # locally may just be above the limit and is not reported
+            try:
+                st = os.lstat(str(t.dest / path[1:]))
+            except OSError:
+                return False
+            return t.get_entry_state(path, st) == target.State.INCLUDED
+
+        return {
+            path: digest
+            for path, digest in manifest.items()
+            if wanted(path)
+        }
+
+    # a local source is hashed the same way as the local copy; the target
+    # is pointed at it to scan it with the same rules
+    root = t.src.rstrip("/") or "/"
+    stand_in = target.Target(t.src, root)
+    stand_in.rules = t.rules
+    return hash_tree(root, scan.iter_included_files(stand_in, relpath),
+                     relpath=relpath, jobs=jobs)
+
+
+def cmdfunc_verify(args, cfg, targets):
+    scopes = select_scopes(targets, args.targets)
+    if not scopes:
+        scopes = [(t, "") for t in sorted(targets, key=lambda t: t.dest)]
+
+    if args.manifest is not None and len(scopes) > 1:
+        print("error: --manifest can only be used with a single target",
+              file=sys.stderr)
+        sys.exit(1)
+
+    for t, _ in scopes:
+        if args.manifest is None and not localcopy.is_local_source(t.src):
+            print("error: the source of {!r} is remote; create a manifest on"
+                  " the source host with `offlinecopy manifest DIR' and pass"
+                  " it with --manifest".format(str(t.dest)),
+                  file=sys.stderr)
+            sys.exit(1)
+
+    differences = 0
+    for t, relpath in scopes:
+        local = hash_tree(t.dest, scan.iter_included_files(t, relpath),
+                          relpath=relpath, jobs=args.jobs)
+        remote = get_source_manifest(t, relpath, args.manifest,
+                                     jobs=args.jobs)
+        result = verify.compare(local, remote)
+
+        print("{}: {} files, {} differ, {} only local, {} only on the"
+              " source".format(format_scope(t, relpath), len(local),
+                               len(result.differ), len(result.local_only),
+                               len(result.remote_only)))
+        for label, paths in [("differs", result.differ),
+                             ("only local", result.local_only),
+                             ("only on the source", result.remote_only)]:
+            for path in paths:
+                print("  {}: {}".format(label, path))
+                differences += 1
+
+    if differences:
+        return 1
+
+
+def cmdfunc_manifest(args, cfg, targets):
+    root = os.path.abspath(args.directory)
+    verify.write_manifest(
+        sys.stdout,
+        hash_tree(root, verify.iter_files(root), jobs=args.jobs),
+    )
+
+
+def cmdfunc_classify(args, cfg, targets):
+    # millions of paths may be classified, so the paths are only normalized
+    # lexically instead of being resolved on the file system
+    cwd = os.getcwd()
+    roots = sorted(
+        ((str(t.dest.resolve()), filters.Matcher.from_target(t))
+         for t in targets),
+        key=lambda item: len(item[0]),
+        reverse=True,
+    )
+    separator = "\0" if args.null else "\n"
+
+    def find_root(path):
+        for root, matcher in roots:
+            if path == root or path.startswith(root + "/"):
+                return root, matcher
+        return None, None
+
+    labels = {state: state.value + "\t" for state in target.State}
+    failed = False
+    root, matcher = None, None
+    data = sys.stdin.read(65536)
+    buf = ""
+    while True:
+        lines = (buf + data).split(separator)
+        buf = lines.pop() if data else ""
+        output = []
+        for line in lines:
+            if not line:
+                continue
+            if line.startswith("/"):
+                path = line
+            else:
+                path = os.path.join(cwd, line)
+            if "/." in path or "//" in path or path.endswith("/"):
+                path = os.path.normpath(path)
+
+            if root is None or not (path == root or
+                                    path.startswith(root + "/")):
+                root, matcher = find_root(path)
+                if root is None:
+                    print("error: {!r} is not in any target".format(line),
+                          file=sys.stderr)
+                    failed = True
+                    continue
+
+            rest = path[len(root)+1:]
+            state = matcher.classify_parts(
+                tuple(rest.split("/")) if rest else ()
+            )
+            output.append(labels[state])
+            output.append(line)
+            output.append(separator)
+        sys.stdout.write("".join(output))
+        if not data:
+            break
+        data = sys.stdin.read(65536)
+
+    if failed:
+        return 1
+
+
+def cmdfunc_plan(args, cfg, targets):
+    matched_targets = select_targets(targets, args.targets)
+
+    for t in matched_targets:
+        current = plan.take_snapshot(t)
+        snapshot = plan.load_snapshot(get_snapshot_path(t), t)
+
+        if args.revert:
+            result = plan.plan_revert(t, current, snapshot)
+            verbs = "fetch", "delete locally"
+        else:
+            result = plan.plan_push(t, current, snapshot)
+            verbs = "send", "delete remotely"
+
+        if result is None:
+            print("{}: unknown (no record of a previous sync)".format(
+                t.dest))
+            continue
+
+        print("{}: {} {} files ({} bytes), {} {} files ({} bytes){}".format(
+            t.dest,
+            verbs[0], result.transfer_files, result.transfer_bytes,
+            verbs[1], result.delete_files, result.delete_bytes,
+            "" if snapshot is not None else
+            " (no record of a previous sync)",
+        ))
+
+
+def cmdfunc_cache(args, cfg, targets):
+    matched_targets = select_targets(targets, args.targets)
+
+    global_budget = args.budget
+    if global_budget is None:
+        global_budget = cfg.cache_budget
+
+    evictions = []
+    global_candidates = []
+    for t in matched_targets:
+        candidates = list(cache.iter_candidates(t))
+        if t.budget is not None:
+            evictions.extend(cache.select_evictions(candidates, t.budget))
+        else:
+            global_candidates.extend(candidates)
+
+    if global_budget is not None:
+        evictions.extend(cache.select_evictions(global_candidates,
+                                                global_budget))
+
+    if not evictions:
+        if args.verbosity > 0:
+            print("all targets are within their budget")
+        return
+
+    if args.dry_run or args.verbosity > 0:
+        print("evicting {} subtrees, freeing {} bytes:".format(
+            len(evictions),
+            sum(candidate.size for candidate in evictions)))
+        for candidate in evictions:
+            print("  {} {}".format(
+                candidate.size,
+                candidate.target.dest / candidate.relpath[1:]))
+
+    evicted_targets = sorted({candidate.target for candidate in evictions},
+                             key=lambda target: target.dest)
+    for t in evicted_targets:
+        if args.verbosity > 0:
+            print("pushing target {!r}".format(str(t.dest)))
+        rsync_target(cfg, t,
+                     additional_args=args.rsync_opts,
+                     dry_run=args.dry_run,
+                     revert=False,
+                     verbosity=args.verbosity)
+
+    if args.dry_run:
+        return
+
+    for candidate in evictions:
+        candidate.target.evict(candidate.relpath)
+
+    write_targets(get_targets_path(), targets)
+
+    evict_local(targets,
+                [candidate.target.dest / candidate.relpath[1:]
+                 for candidate in evictions])
+
+
+def cmdfunc_import(args, cfg, targets):
+    path = pathlib.Path(args.target).resolve()
+    t = get_target_by_path(targets, path)
+    if not t:
+        print("error: {!r} is not a target".format(str(path)),
+              file=sys.stderr)
+        return 1
+
+    if args.file == "-":
+        f = contextlib.nullcontext(sys.stdin)
+    else:
+        f = open(args.file, "r")
+
+    with f as f:
+        if args.format == "list":
+            flat_nodes = list(filters.flat_nodes_from_path_list(f))
+        else:
+            try:
+                flat_nodes = list(filters.flat_nodes_from_filter_rules(
+                    filters.parse_filter_rules(f)
+                ))
+            except ValueError as exc:
+                print("error: {}: {}".format(args.file, exc),
+                      file=sys.stderr)
+                return 1
+
+    t.from_flat_nodes(flat_nodes)
+
+    if args.dry_run:
+        for state, path in t.iter_filter_rules():
+            print("{} /{}".format(state, path))
+        return
+
+    write_targets(get_targets_path(), targets)
+
+
+def cmdfunc_queue(args, cfg, targets):
+    path = get_queue_path()
+
+    if args.work:
+        if not asyncio.run(work_queue(cfg, args.jobs or cfg.summon_jobs)):
+            print("error: the queue is already processed by another worker",
+                  file=sys.stderr)
+            return 1
+        return
+
+    if args.cancel or args.priority is not None:
+        with summonqueue.modify(path) as queue:
+            for id_ in args.ids:
+                entry = summonqueue.find(queue, id_)
+                if entry is None:
+                    print("error: no queue entry #{}".format(id_),
+                          file=sys.stderr)
+                elif args.cancel:
+                    if entry["state"] == summonqueue.RUNNING:
+                        # the worker stops the transfer and removes it
+                        entry["cancel"] = True
+                    else:
+                        queue["entries"].remove(entry)
+                else:
+                    entry["priority"] = args.priority
+        return
+
+    queue = summonqueue.load(path)
+    if not queue["entries"]:
+        if args.verbosity > 0:
+            print("the summon queue is empty")
+        return
+
+    now = time.time()
+    for entry in summonqueue.ordered(queue):
+        line = "#{:<4} {:>4} {:<8} {}".format(
+            entry["id"], entry["priority"], entry["state"],
+            entry["target"] + entry["relpath"])
+        if entry["state"] == summonqueue.RUNNING:
+            dest = os.path.join(entry["target"], entry["relpath"][1:])
+            try:
+                size, _ = cache.scan_subtree(dest)
+            except FileNotFoundError:
+                size = 0
+            line += " ({} bytes after {}{})".format(
+                size,
+                format_duration(now - entry["started"]),
+                ", cancelling" if entry.get("cancel") else "")
+        elif entry["state"] == summonqueue.FAILED:
+            line += " ({})".format(entry.get("error"))
+        print(line)
+
+    worker_lock = locking.FileLock(path + ".worker")
+    if worker_lock.acquire(blocking=False):
+        worker_lock.release()
+        if any(entry["state"] != summonqueue.FAILED
+               for entry in queue["entries"]):
+            print("note: no worker is running, see queue --work",
+                  file=sys.stderr)
+
+
+def cmdfunc_trash(args, cfg, targets):
+    if args.drain:
+        # retained data is measured here instead of while evicting it, so
+        # the budget can only be enforced afterwards
+        for retention_dir in trash.read_registry(
+                get_retention_registry_path()):
+            retention.measure(retention_dir)
+        if cfg.retain_budget is not None:
+            expire_retained(targets, cfg.retain_budget)
+
+        for trash_dir in trash.read_registry(get_trash_registry_path()):
+            if args.verbosity > 0:
+                print("draining {!r}".format(trash_dir))
+            trash.drain(trash_dir, jobs=args.jobs, block=True)
+        return
+
+    trash_dirs = trash.read_registry(get_trash_registry_path())
+
+    def format_timestamp(timestamp):
+        if timestamp is None:
+            return "(unknown)"
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+    any_pending = False
+    for trash_dir in trash_dirs:
+        entries = list(trash.iter_entries(trash_dir))
+        if not entries:
+            continue
+        any_pending = True
+        print("{}:".format(trash_dir))
+        for entry in entries:
+            print("  {} {}".format(
+                format_timestamp(entry.timestamp),
+                entry.original_path or entry.path))
+
+    if not any_pending and args.verbosity > 0:
+        print("no pending deletions")
+
+    for retention_dir in trash.read_registry(get_retention_registry_path()):
+        entries = list(retention.iter_entries(retention_dir))
+        if not entries:
+            continue
+        print("{} (retained):".format(retention_dir))
+        for entry in entries:
+            print("  {} {:>14} {}".format(
+                format_timestamp(entry.timestamp),
+                "-" if entry.size is None else entry.size,
+                entry.original_path or entry.path))
+
+
+def cmdfunc_set_budget(args, cfg, targets):
+    path = pathlib.Path(args.target).resolve()
+    target = get_target_by_path(targets, path)
+    if not target:
+        print("error: {!r} is not a target".format(str(path)),
+              file=sys.stderr)
+        return 1
+
+    if args.budget is None:
+        target.budget = None
+    else:
+        target.budget = config.Config.parse_size(args.budget)
+
+    write_targets(get_targets_path(), targets)
+
+
+def format_schedule(sched):
+    return " ".join(
+        ["every {}".format(schedule.format_interval(sched.interval))] +
+        [schedule.format_window(window) for window in sched.windows]
+    )
+
+
+def cmdfunc_set_schedule(args, cfg, targets):
+    path = pathlib.Path(args.target).resolve()
+    target = get_target_by_path(targets, path)
+    if not target:
+        print("error: {!r} is not a target".format(str(path)),
+              file=sys.stderr)
+        return 1
+
+    if args.interval is None:
+        if args.windows:
+            print("error: --window requires an interval", file=sys.stderr)
+            return 1
+        target.schedule = None
+    else:
+        target.schedule = schedule.Schedule(args.interval, args.windows)
+
+    write_targets(get_targets_path(), targets)
+
+
+async def run_scheduled(cfg, t, verbosity=0):
+    prefix = "[{}] ".format(t.dest)
+    if verbosity > 0:
+        print("{}starting scheduled push".format(prefix))
+    try:
+        await rsync_target_async(cfg, t,
+                                 prefix=prefix,
+                                 wait=False,
+                                 verbosity=verbosity)
+    except locking.BusyError as exc:
+        # the next run is scheduled as if this one had happened
+        print("{}note: skipped, {}".format(prefix, exc), file=sys.stderr)
+    except subprocess.CalledProcessError as exc:
+        print("{}error: rsync exited with status {}".format(
+                  prefix, exc.returncode),
+              file=sys.stderr)
+    except subprocess.TimeoutExpired as exc:
+        print("{}error: {}".format(prefix, exc), file=sys.stderr)
+
+
+def cmdfunc_schedule(args, cfg, targets):
+    # the last runs are taken from the history, so that neither a restart
+    # nor pushes made by hand cause targets to be pushed again early
+    last_run = schedule.last_runs(history.read(get_history_path()))
+
+    if args.once:
+        due = schedule.due_targets(targets, last_run, time.time())
+        if not due and args.verbosity > 0:
+            print("no targets due")
+        asyncio.run(engine.gather_limited(
+            [run_scheduled(cfg, t, verbosity=args.verbosity) for t in due],
+            args.jobs,
+        ))
+        return
+
+    if not any(t.schedule is not None for t in targets):
+        print("note: no target has a schedule yet, see set-schedule",
+              file=sys.stderr)
+
+    async def run():
+        task = asyncio.ensure_future(schedule.run(
+            lambda: read_targets(get_targets_path()),
+            lambda t: run_scheduled(cfg, t, verbosity=args.verbosity),
+            last_run,
+            jobs=args.jobs,
+        ))
+        # as a service, the scheduler is stopped with SIGTERM; running
+        # transfers are terminated instead of being left behind
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM,
+                                                    task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def cmdfunc_add_mirror(args, cfg, targets):
+    path = pathlib.Path(args.target).resolve()
+    target = get_target_by_path(targets, path)
+    if not target:
+        print("error: {!r} is not a target".format(str(path)),
+              file=sys.stderr)
+        return 1
+
+    if args.source == target.src or args.source in target.mirrors:
+        print("error: {!r} is already a source of the target".format(
+                  args.source),
+              file=sys.stderr)
+        return 1
+
+    target.mirrors.append(args.source)
+
+    write_targets(get_targets_path(), targets)
+
+
+def cmdfunc_remove_mirror(args, cfg, targets):
+    path = pathlib.Path(args.target).resolve()
+    target = get_target_by_path(targets, path)
+    if not target:
+        print("error: {!r} is not a target".format(str(path)),
+              file=sys.stderr)
+        return 1
+
+    try:
+        target.mirrors.remove(args.source)
+    except ValueError:
+        print("error: {!r} is not a mirror of the target".format(
+                  args.source),
+              file=sys.stderr)
+        return 1
+
+    write_targets(get_targets_path(), targets)
+
+
+def format_profile(profile):
+    items = [
+        "{}={}".format(name.replace("_", "-"), value.value)
+        for name, value in profile.iter_settings()
+    ]
+    if profile.checksum_choice is not None:
+        items.append("checksum-choice={}".format(profile.checksum_choice))
+    return " ".join(items)
+
+
+def cmdfunc_set_transport(args, cfg, targets):
+    path = pathlib.Path(args.target).resolve()
+    target = get_target_by_path(targets, path)
+    if not target:
+        print("error: {!r} is not a target".format(str(path)),
+              file=sys.stderr)
+        return 1
+
+    profile = target.transport or transport.Profile()
+    if args.reset:
+        profile = transport.Profile()
+    if args.auto:
+        profile.compress = transport.Setting.AUTO
+        profile.whole_file = transport.Setting.AUTO
+
+    for name, _ in profile.iter_settings():
+        value = getattr(args, name)
+        if value is not None:
+            setattr(profile, name, value)
+
+    if args.checksum_choice is not None:
+        profile.checksum_choice = args.checksum_choice or None
+
+    target.transport = None if profile.is_default() else profile
+
+    if args.verbosity > 0 or args.show:
+        print(format_profile(profile))
+        if args.show:
+            print("effective: {}".format(
+                " ".join(transport.flags(get_transport_profile(target)))
+            ))
+            return
+
+    write_targets(get_targets_path(), targets)
+
 
 def cmdfunc_set_source(args, cfg, targets):
     path = pathlib.Path(args.target).resolve()
@@ -392,6 +2112,40 @@ def rsync_opts_argument(parser):
     )
 
 
+def parse_pattern(s):
+    if not s or "/" in s:
+        raise ValueError(s)
+    return s
+
+
+def selection_arguments(parser):
+    parser.add_argument(
+        "--pattern",
+        dest="patterns",
+        action="append",
+        type=parse_pattern,
+        default=[],
+        metavar="GLOB",
+        help="Only include files whose name matches GLOB (an rsync wildcard"
+        " pattern without slashes) below the path. May be given multiple"
+        " times."
+    )
+    parser.add_argument(
+        "--max-size",
+        type=config.Config.parse_size,
+        default=None,
+        metavar="SIZE",
+        help="Only include files of at most SIZE bytes (optionally with a K,"
+        " M, G or T suffix) below the path."
+    )
+
+
+def get_selection(args):
+    if not args.patterns and args.max_size is None:
+        return None
+    return target.Selection(tuple(args.patterns), args.max_size)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="""\
@@ -468,7 +2222,9 @@ any of its contents) from synchronisation."""
         "--evict", "--delete",
         action="store_true",
         default=False,
-        help="Delete the file or directory after evicting"
+        help="Delete the file or directory after evicting. The data is moved"
+        " to a trash directory and deleted in the background (see the trash"
+        " subcommand)."
     )
     cmd_exclude.set_defaults(cmd=cmdfunc_exclude)
 
@@ -487,9 +2243,10 @@ any of its contents) from synchronisation."""
         metavar="PATH",
         help="Path to the node to include"
     )
+    selection_arguments(cmd_include)
     dry_run_argument(cmd_include)
     rsync_opts_argument(cmd_include)
-    cmd_include.set_defaults(cmd=cmdfunc_include, summon=False)
+    cmd_include.set_defaults(cmd=cmdfunc_include, summon=False, split=False)
 
     cmd_summon = subparsers.add_parser(
         "summon",
@@ -507,6 +2264,31 @@ any of its contents) from synchronisation."""
         metavar="PATH",
         help="Path to the node to include"
     )
+    cmd_summon.add_argument(
+        "--split",
+        action="store_true",
+        default=False,
+        help="If the target has mirrors, distribute the top-level entries of"
+        " the directory over all responding sources and fetch them in"
+        " parallel."
+    )
+    cmd_summon.add_argument(
+        "--background",
+        action="store_true",
+        default=False,
+        help="Add the path to the summon queue and return immediately. The"
+        " queue is processed by a background worker; the path is included"
+        " once its transfer completed. See the queue subcommand."
+    )
+    cmd_summon.add_argument(
+        "--priority",
+        type=int,
+        default=0,
+        metavar="N",
+        help="With --background, the priority of the summon; entries with"
+        " a higher priority are transferred first (default: 0)."
+    )
+    selection_arguments(cmd_summon)
     dry_run_argument(cmd_summon)
     rsync_opts_argument(cmd_summon)
     cmd_summon.set_defaults(cmd=cmdfunc_include, summon=True)
@@ -540,8 +2322,46 @@ any of its contents) from synchronisation."""
         "targets",
         metavar="PATH",
         nargs="*",
-        help="Zero or more target destination directiories. If none is given, "
-        "all targets are synced back"
+        help="Zero or more target destination directiories, or paths inside"
+        " them to only push that subtree. If none is given, all targets are"
+        " synced back"
+    )
+    cmd_push.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Push up to N targets in parallel. Targets which took longest"
+        " in previous pushes are started first."
+    )
+    cmd_push.add_argument(
+        "--combine",
+        action="store_true",
+        default=False,
+        help="Push targets whose sources are in the same directory and"
+        " whose destinations are in the same directory, under the same"
+        " names, in a single rsync session. Dry runs still show each target"
+        " on its own."
+    )
+    cmd_push.add_argument(
+        "--mirrors",
+        action="store_true",
+        default=False,
+        help="Push to the mirrors of the targets as well. The changes are"
+        " computed once, in the push to the source, and replayed to the"
+        " mirrors which were in step with the source from a batch file;"
+        " other mirrors get a normal push."
+    )
+    cmd_push.add_argument(
+        "--retries",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Retry targets which failed with a transient error (such as a"
+        " timeout or a partial transfer) up to N times, with increasing"
+        " delays (default: push-retries from the configuration). Failing"
+        " targets do not stop the others; the exit status is 1 if a target"
+        " failed permanently and 75 if targets only failed transiently."
     )
     dry_run_argument(cmd_push)
     rsync_opts_argument(cmd_push)
@@ -569,7 +2389,8 @@ any of its contents) from synchronisation."""
         "targets",
         metavar="PATH",
         nargs="*",
-        help="One or more target destination directories."
+        help="One or more target destination directories, or paths inside"
+        " them to only revert that subtree."
     )
     dry_run_argument(cmd_revert)
     rsync_opts_argument(cmd_revert)
@@ -595,11 +2416,475 @@ any of its contents) from synchronisation."""
     )
     cmd_set_source.set_defaults(cmd=cmdfunc_set_source)
 
+    cmd_add_mirror = subparsers.add_parser(
+        "add-mirror",
+        help="Add an equivalent source to a target",
+        description="""\
+        Add a mirror to a target. Mirrors must hold the same data as the
+        source of the target. Summon and revert probe all sources
+        concurrently and fetch from the one which responds fastest; push
+        always goes to the source of the target."""
+    )
+    cmd_add_mirror.add_argument(
+        "target",
+        metavar="PATH",
+        help="Path identifying the target locally."
+    )
+    cmd_add_mirror.add_argument(
+        "source",
+        metavar="SOURCE",
+        help="URL of the mirror. The same rules as for the add subcommand"
+        " apply."
+    )
+    cmd_add_mirror.set_defaults(cmd=cmdfunc_add_mirror)
+
+    cmd_remove_mirror = subparsers.add_parser(
+        "remove-mirror",
+        help="Remove a mirror from a target",
+    )
+    cmd_remove_mirror.add_argument(
+        "target",
+        metavar="PATH",
+        help="Path identifying the target locally."
+    )
+    cmd_remove_mirror.add_argument(
+        "source",
+        metavar="SOURCE",
+        help="URL of the mirror to remove."
+    )
+    cmd_remove_mirror.set_defaults(cmd=cmdfunc_remove_mirror)
+
+    cmd_set_transport = subparsers.add_parser(
+        "set-transport",
+        help="Change the rsync transport profile of a target",
+        description="""\
+        Configure how rsync transfers the data of a target. By default,
+        data is not compressed, the delta-transfer algorithm is used and
+        sparse files, ACLs and extended attributes are preserved. Settings
+        which are `auto' are chosen before each transfer based on the
+        throughput and compressibility measured in previous transfers of
+        the target: compression is used on slow links with compressible
+        data and whole-file transfers on fast links."""
+    )
+    cmd_set_transport.add_argument(
+        "target",
+        metavar="PATH",
+        help="Path identifying the target locally."
+    )
+    cmd_set_transport.add_argument(
+        "--auto",
+        action="store_true",
+        default=False,
+        help="Set all settings which can be learned (compress and whole-file)"
+        " to auto."
+    )
+    cmd_set_transport.add_argument(
+        "--reset",
+        action="store_true",
+        default=False,
+        help="Reset all settings to the defaults before applying the other"
+        " options."
+    )
+    cmd_set_transport.add_argument(
+        "--show",
+        action="store_true",
+        default=False,
+        help="Only show the profile and the rsync flags it currently results"
+        " in; do not save any changes."
+    )
+    for name, help_ in [
+            ("compress", "Compress data during the transfer (-z)."),
+            ("whole_file", "Transfer changed files as a whole instead of"
+             " using the delta-transfer algorithm (--whole-file)."),
+            ("sparse", "Handle sparse files efficiently (-S)."),
+            ("acls", "Preserve ACLs (-A)."),
+            ("xattrs", "Preserve extended attributes (-X).")]:
+        if name in transport.Profile.AUTO_SETTINGS:
+            choices = list(transport.Setting)
+        else:
+            choices = [transport.Setting.YES, transport.Setting.NO]
+        cmd_set_transport.add_argument(
+            "--" + name.replace("_", "-"),
+            type=transport.Setting,
+            choices=choices,
+            default=None,
+            metavar="|".join(choice.value for choice in choices),
+            help=help_,
+        )
+    cmd_set_transport.add_argument(
+        "--checksum-choice",
+        default=None,
+        metavar="ALGORITHM",
+        help="Passed to rsync as --checksum-choice. An empty value removes"
+        " the setting."
+    )
+    cmd_set_transport.set_defaults(cmd=cmdfunc_set_transport)
+
+    cmd_set_budget = subparsers.add_parser(
+        "set-budget",
+        help="Change the disk budget of a target",
+        description="""\
+        Set the disk budget of a target, which is used by the cache
+        subcommand. Without a budget, the target is accounted against the
+        global cache-budget from the configuration."""
+    )
+    cmd_set_budget.add_argument(
+        "target",
+        metavar="PATH",
+        help="Path identifying the target locally."
+    )
+    cmd_set_budget.add_argument(
+        "budget",
+        metavar="SIZE",
+        nargs="?",
+        default=None,
+        help="New budget for the target in bytes, optionally with a K, M, G"
+        " or T suffix. If omitted, the budget of the target is removed."
+    )
+    cmd_set_budget.set_defaults(cmd=cmdfunc_set_budget)
+
+    cmd_set_schedule = subparsers.add_parser(
+        "set-schedule",
+        help="Change how often the schedule subcommand pushes a target",
+        description="""\
+        Set the interval at which the schedule subcommand pushes a target and
+        optionally the times of day at which such pushes may be started.
+        Without an interval, the target is not pushed by the scheduler."""
+    )
+    cmd_set_schedule.add_argument(
+        "target",
+        metavar="PATH",
+        help="Path identifying the target locally."
+    )
+    cmd_set_schedule.add_argument(
+        "interval",
+        metavar="INTERVAL",
+        nargs="?",
+        default=None,
+        type=schedule.parse_interval,
+        help="Time between pushes in seconds or with units, e.g. 30m, 1h30m"
+        " or 2d. If omitted, the schedule of the target is removed."
+    )
+    cmd_set_schedule.add_argument(
+        "-w", "--window",
+        dest="windows",
+        metavar="HH:MM-HH:MM",
+        action="append",
+        default=[],
+        type=schedule.parse_window,
+        help="Only start pushes between these local times; may be given"
+        " multiple times. A window may span midnight, e.g. 22:00-06:00."
+    )
+    cmd_set_schedule.set_defaults(cmd=cmdfunc_set_schedule)
+
+    cmd_schedule = subparsers.add_parser(
+        "schedule",
+        help="Push targets periodically according to their schedules",
+        description="""\
+        Keep running and push each target with a schedule (see set-schedule)
+        when it is due. Pushes of the same target never overlap; if another
+        offlinecopy process uses a target, its scheduled push is skipped.
+        The time of the last push is taken from the transfer history, so
+        restarting the scheduler does not push all targets at once."""
+    )
+    cmd_schedule.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Run up to N pushes at the same time (default: 1)."
+    )
+    cmd_schedule.add_argument(
+        "--once",
+        action="store_true",
+        default=False,
+        help="Push the targets which are due now and exit, e.g. to run the"
+        " scheduler from cron."
+    )
+    cmd_schedule.set_defaults(cmd=cmdfunc_schedule)
+
+    cmd_import = subparsers.add_parser(
+        "import",
+        help="Replace the include/exclude state of a target from a file",
+        description="""\
+        Build the include/exclude state of a target from an existing rsync
+        filter file or from a list of paths to include. The previous state
+        of the target is discarded. No files are transferred or deleted.
+        Filter files may only contain anchored +/- rules (relative to the
+        target root) without wildcards, except for a trailing `/*'; this is
+        the format offlinecopy itself generates. Path lists contain one path
+        relative to the target root per line; everything not listed is
+        excluded."""
+    )
+    cmd_import.add_argument(
+        "--format",
+        choices=["filter", "list"],
+        default="filter",
+        help="Format of the input file (default: filter)."
+    )
+    cmd_import.add_argument(
+        "-n", "--dry-run",
+        action="store_true",
+        default=False,
+        help="Print the resulting filter rules instead of saving them."
+    )
+    cmd_import.add_argument(
+        "target",
+        metavar="PATH",
+        help="Path identifying the target locally."
+    )
+    cmd_import.add_argument(
+        "file",
+        metavar="FILE",
+        help="File to import from, or `-' for standard input."
+    )
+    cmd_import.set_defaults(cmd=cmdfunc_import)
+
+    cmd_queue = subparsers.add_parser(
+        "queue",
+        help="Show or edit the queue of background summons",
+        description="""\
+        Without options, list the entries of the summon queue in the order in
+        which they are processed, with the progress of running ones. Entries
+        can be cancelled or given another priority; running summons are
+        stopped by the worker when they are cancelled. The worker writes its
+        output to summon-queue.log in the data directory.""",
+    )
+    cmd_queue.add_argument(
+        "--cancel",
+        action="store_true",
+        default=False,
+        help="Remove the given entries from the queue."
+    )
+    cmd_queue.add_argument(
+        "--priority",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Set the priority of the given entries."
+    )
+    cmd_queue.add_argument(
+        "--work",
+        action="store_true",
+        default=False,
+        help="Process the queue in the foreground until it is empty, e.g."
+        " after the background worker was stopped."
+    )
+    cmd_queue.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        metavar="N",
+        help="With --work, run up to N summons at the same time (default:"
+        " summon-jobs from the configuration)."
+    )
+    cmd_queue.add_argument(
+        "ids",
+        metavar="ID",
+        type=int,
+        nargs="*",
+        help="Queue entries to cancel or reprioritize."
+    )
+    cmd_queue.set_defaults(cmd=cmdfunc_queue)
+
+    cmd_trash = subparsers.add_parser(
+        "trash",
+        help="Show or drain pending deletions of evicted files",
+        description="""\
+        Evicted files and directories are moved into a trash directory on the
+        same file system and deleted by a background worker. This command
+        lists the entries which have not been deleted yet (for example
+        because the worker is still running or was interrupted) or, with
+        --drain, deletes them in the foreground."""
+    )
+    cmd_trash.add_argument(
+        "--drain",
+        action="store_true",
+        default=False,
+        help="Delete all pending entries and wait for running workers."
+    )
+    cmd_trash.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=trash.DEFAULT_JOBS,
+        metavar="N",
+        help="Number of threads to use for deletion (default: {}).".format(
+            trash.DEFAULT_JOBS
+        )
+    )
+    cmd_trash.set_defaults(cmd=cmdfunc_trash)
+
+    cmd_stats = subparsers.add_parser(
+        "stats",
+        help="Show statistics of previous transfers",
+        description="""\
+        Every push, revert and summon is recorded with its duration, the
+        number of files and bytes transferred and its exit status. This
+        command summarizes the records per target and direction with
+        percentiles and the trend of the duration over time."""
+    )
+    cmd_stats.add_argument(
+        "--last",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Only consider the last N records of each target."
+    )
+    cmd_stats.add_argument(
+        "targets",
+        metavar="PATH",
+        nargs="*",
+        help="Zero or more target destination directories. If none is given,"
+        " all targets are considered."
+    )
+    cmd_stats.set_defaults(cmd=cmdfunc_stats)
+
+    cmd_verify = subparsers.add_parser(
+        "verify",
+        help="Compare the content of the local copy with the source",
+        description="""\
+        Hash all included files of the matching targets (or subtrees) and
+        compare them with the source. Hashes are computed in parallel and
+        cached; files whose inode, size and modification time did not change
+        are not hashed again. Local sources are hashed directly. For remote
+        sources, create a manifest on the source host with `offlinecopy
+        manifest' (or sha256sum) and pass it with --manifest. The exit
+        status is 1 if any difference was found."""
+    )
+    cmd_verify.add_argument(
+        "--manifest",
+        metavar="FILE",
+        default=None,
+        help="Manifest of the source directory of the target, in the format"
+        " of sha256sum with paths relative to the source directory."
+    )
+    cmd_verify.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Number of hashing processes (default: number of CPUs)."
+    )
+    cmd_verify.add_argument(
+        "targets",
+        metavar="PATH",
+        nargs="*",
+        help="Zero or more target directories or paths inside them. If none"
+        " is given, all targets are verified."
+    )
+    cmd_verify.set_defaults(cmd=cmdfunc_verify)
+
+    cmd_manifest = subparsers.add_parser(
+        "manifest",
+        help="Print the hashes of all files below a directory",
+        description="""\
+        Print the SHA-256 hashes of all regular files below DIRECTORY in the
+        format of sha256sum, for use with `offlinecopy verify --manifest'.
+        Hashes are cached like those of verify."""
+    )
+    cmd_manifest.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Number of hashing processes (default: number of CPUs)."
+    )
+    cmd_manifest.add_argument(
+        "directory",
+        metavar="DIRECTORY",
+    )
+    cmd_manifest.set_defaults(cmd=cmdfunc_manifest)
+
+    cmd_classify = subparsers.add_parser(
+        "classify",
+        help="Tell for each path read from stdin whether it is synchronized",
+        description="""\
+        Read paths (relative to the current directory or absolute) from
+        standard input and print for each of them whether rsync transfers it
+        (`included') or not (`evicted') under the current rules of its
+        target, followed by a tab and the path. Directories which are only
+        traversed to reach included paths below them count as included.
+        Sorted input, such as the output of find, is classified fastest."""
+    )
+    cmd_classify.add_argument(
+        "-0", "--null",
+        action="store_true",
+        default=False,
+        help="Paths are separated by NUL characters instead of newlines, as"
+        " printed by find -print0. The output is NUL-separated as well."
+    )
+    cmd_classify.set_defaults(cmd=cmdfunc_classify)
+
+    cmd_plan = subparsers.add_parser(
+        "plan",
+        help="Estimate the work of a push or revert without transferring",
+        description="""\
+        Estimate how many files and bytes a push (or, with --revert, a
+        revert) of the matching targets would transfer and delete. The
+        estimate is computed from the local files and a record of the local
+        state taken after the last successful push, revert or summon; the
+        remote is not contacted. Changes made on the remote since then are
+        not accounted for."""
+    )
+    cmd_plan.add_argument(
+        "--revert",
+        action="store_true",
+        default=False,
+        help="Estimate a revert instead of a push."
+    )
+    cmd_plan.add_argument(
+        "targets",
+        metavar="PATH",
+        nargs="*",
+        help="Zero or more target destination directories. If none is given,"
+        " all targets are considered."
+    )
+    cmd_plan.set_defaults(cmd=cmdfunc_plan)
+
+    cmd_cache = subparsers.add_parser(
+        "cache",
+        help="Evict least recently used subtrees to stay within budget",
+        description="""\
+        Enforce the disk budget of the matching targets. The disk usage and
+        last access time of the subtrees below each included node is
+        measured. If a target exceeds its budget (or if the targets without
+        own budget together exceed the global budget), the least recently
+        used subtrees are evicted until the budget is met. Affected targets
+        are pushed before anything is evicted, so that no local changes are
+        lost."""
+    )
+    cmd_cache.add_argument(
+        "--budget",
+        type=config.Config.parse_size,
+        default=None,
+        metavar="SIZE",
+        help="Override the global cache-budget from the configuration for"
+        " this run."
+    )
+    cmd_cache.add_argument(
+        "targets",
+        metavar="PATH",
+        nargs="*",
+        help="Zero or more target destination directories. If none is given,"
+        " all targets are considered."
+    )
+    dry_run_argument(cmd_cache)
+    rsync_opts_argument(cmd_cache)
+    cmd_cache.set_defaults(cmd=cmdfunc_cache)
+
     cmd_status = subparsers.add_parser(
         "status",
         aliases=["list"],
         help="Show the target configuration"
     )
+    cmd_status.add_argument(
+        "--sizes",
+        action="store_true",
+        default=False,
+        help="Show the local disk usage below each node of the rule tree,"
+        " which is also the space freed by evicting it. Directories which did"
+        " not change since the last run are not scanned again."
+    )
     cmd_status.set_defaults(cmd=cmdfunc_list)
 
     args = parser.parse_args()
@@ -613,6 +2898,9 @@ any of its contents) from synchronisation."""
 
     try:
         sys.exit(args.cmd(args, cfg, targets) or 0)
+    except subprocess.TimeoutExpired as exc:
+        print("error: {}".format(exc), file=sys.stderr)
+        sys.exit(1)
     except OSError as exc:
         print(exc)
         sys.exit(1)
@@ -0,0 +1,90 @@
+import concurrent.futures
+import re
+import subprocess
+import time
+
+
+DEFAULT_PROBE_TIMEOUT = 10
+
+_ESCAPE_RE = re.compile(r"\\#([0-7]{3})")
+
+
+def probe_invocation(source):
+    # list only the top-level directory of the source; this goes through the
+    # same transport (ssh, rsync daemon or local) as the real transfer
+    return ["rsync", "--list-only", "--dirs", "--protect-args", source]
+
+
+def probe(source, timeout=DEFAULT_PROBE_TIMEOUT):
+    t0 = time.monotonic()
+    try:
+        subprocess.run(probe_invocation(source),
+                       stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL,
+                       timeout=timeout,
+                       check=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return time.monotonic() - t0
+
+
+def rank_sources(sources, timeout=DEFAULT_PROBE_TIMEOUT, probe=probe):
+    # return the reachable sources ordered by latency, fastest first
+    sources = list(sources)
+    with concurrent.futures.ThreadPoolExecutor(len(sources)) as executor:
+        latencies = list(executor.map(
+            lambda source: probe(source, timeout),
+            sources
+        ))
+
+    return [
+        source
+        for latency, _, source in sorted(
+            (latency, i, source)
+            for i, (source, latency) in enumerate(zip(sources, latencies))
+            if latency is not None
+        )
+    ]
+
+
+def unescape_name(name):
+    # rsync prints unprintable bytes of names (and, without -8, non-ASCII
+    # ones) as \#ooo in octal
+    data = bytearray()
+    pos = 0
+    for match in _ESCAPE_RE.finditer(name):
+        data += name[pos:match.start()].encode("utf-8", "surrogateescape")
+        data.append(int(match.group(1), 8))
+        pos = match.end()
+    if not pos:
+        return name
+    data += name[pos:].encode("utf-8", "surrogateescape")
+    return data.decode("utf-8", "surrogateescape")
+
+
+def parse_list_only(lines):
+    for line in lines:
+        parts = line.rstrip("\n").split(None, 4)
+        if len(parts) < 5 or parts[4] == ".":
+            continue
+        name = parts[4]
+        if parts[0].startswith("l"):
+            # symlinks are listed as "name -> target"
+            name = name.partition(" -> ")[0]
+        yield unescape_name(name)
+
+
+def list_entries(source):
+    output = subprocess.check_output(
+        ["rsync", "--list-only", "--protect-args", source],
+        universal_newlines=True,
+    )
+    return sorted(parse_list_only(output.splitlines()))
+
+
+def split_entries(entries, nsources):
+    shares = [[] for _ in range(nsources)]
+    for i, entry in enumerate(entries):
+        shares[i % nsources].append(entry)
+    return shares
@@ -0,0 +1,62 @@
+import contextlib
+import json
+import os
+
+from . import locking
+
+
+# Every push to the source of a target starts a new generation of its
+# contents; a mirror is in step if it was last synced in the current
+# generation, i.e. it held the same data as the source before the next push.
+# Changes made to the source or the mirrors by other means are not noticed.
+
+
+def load(path):
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return {}
+
+    with f:
+        return json.load(f)
+
+
+def save(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def modify(path):
+    with locking.FileLock(path + ".lock"):
+        state = load(path)
+        yield state
+        save(path, state)
+
+
+def _get_entry(state, t):
+    # an entry recorded for another source says nothing about the current
+    # one
+    entry = state.get(str(t.dest))
+    if entry is None or entry["src"] != t.src:
+        entry = {"src": t.src, "generation": 0, "mirrors": {}}
+        state[str(t.dest)] = entry
+    return entry
+
+
+def in_step(state, t, mirror):
+    entry = state.get(str(t.dest))
+    return (entry is not None and
+            entry["src"] == t.src and
+            entry["mirrors"].get(mirror) == entry["generation"])
+
+
+def advance(state, t):
+    _get_entry(state, t)["generation"] += 1
+
+
+def mark_synced(state, t, mirror):
+    entry = _get_entry(state, t)
+    entry["mirrors"][mirror] = entry["generation"]
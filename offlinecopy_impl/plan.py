@@ -0,0 +1,107 @@
+import collections
+import hashlib
+import json
+import os
+
+from . import scan, target
+
+
+Plan = collections.namedtuple(
+    "Plan",
+    ["transfer_files", "transfer_bytes", "delete_files", "delete_bytes"]
+)
+
+
+def get_snapshot_path(cache_dir, t):
+    return os.path.join(
+        cache_dir,
+        hashlib.sha1(str(t.dest).encode("utf-8")).hexdigest() + ".json"
+    )
+
+
+def take_snapshot(t, relpath=""):
+    return {
+        path: (st.st_size, st.st_mtime_ns)
+        for path, st in scan.iter_included_files(t, relpath)
+    }
+
+
+def update_snapshot(files, t, relpath):
+    prefix = "".join("/" + part for part in target.path_split(relpath))
+    for path in list(files):
+        if path == prefix or path.startswith(prefix + "/"):
+            del files[path]
+    files.update(take_snapshot(t, relpath))
+
+
+def load_snapshot(path, t):
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return None
+
+    with f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            return None
+
+    # a snapshot of another source does not tell anything about the current
+    # one
+    if data.get("src") != t.src:
+        return None
+
+    return {
+        path: tuple(info)
+        for path, info in data["files"].items()
+    }
+
+
+def save_snapshot(path, t, files):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"src": t.src, "files": files}, f,
+                  separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _included_subset(t, snapshot):
+    # rules may have changed since the snapshot was taken; rsync does not
+    # touch excluded files
+    return {
+        path: info
+        for path, info in snapshot.items()
+        if t.get_state(path) == target.State.INCLUDED
+    }
+
+
+def plan_push(t, current, snapshot):
+    if snapshot is None:
+        return Plan(len(current),
+                    sum(size for size, _ in current.values()),
+                    0, 0)
+
+    snapshot = _included_subset(t, snapshot)
+
+    transfer = [info for path, info in current.items()
+                if snapshot.get(path) != info]
+    delete = [info for path, info in snapshot.items()
+              if path not in current]
+
+    return Plan(len(transfer), sum(size for size, _ in transfer),
+                len(delete), sum(size for size, _ in delete))
+
+
+def plan_revert(t, current, snapshot):
+    if snapshot is None:
+        return None
+
+    snapshot = _included_subset(t, snapshot)
+
+    transfer = [info for path, info in snapshot.items()
+                if current.get(path) != info]
+    delete = [info for path, info in current.items()
+              if path not in snapshot]
+
+    return Plan(len(transfer), sum(size for size, _ in transfer),
+                len(delete), sum(size for size, _ in delete))
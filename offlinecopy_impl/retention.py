@@ -0,0 +1,143 @@
+import collections
+import os
+import tempfile
+import time
+
+from . import trash
+
+
+# evicted data which is kept around so that summoning it again only has to
+# transfer what changed in the meantime; entries have the layout of trash
+# entries, with the disk usage of the data as an additional line of the info
+# file; that line is only added by measure(), which the drain worker calls, so
+# that evicting does not have to walk the data
+
+# rsync accepts at most 20 --link-dest directories
+MAX_BASES = 20
+
+
+Entry = collections.namedtuple(
+    "Entry",
+    ["path", "original_path", "timestamp", "size"]
+)
+
+
+def disk_usage(path):
+    total = os.lstat(path).st_blocks * 512
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def retain(path, retention_dir):
+    return trash.make_entry(path, retention_dir,
+                            [os.path.abspath(path), time.time()])
+
+
+def is_damaged(entry):
+    return entry.original_path is None or entry.timestamp is None
+
+
+def measure(retention_dir):
+    # record the size of the entries which have not been measured yet
+    for entry in iter_entries(retention_dir):
+        if entry.size is not None or is_damaged(entry):
+            continue
+        try:
+            size = disk_usage(os.path.join(entry.path, trash.DATA_NAME))
+            fd, tmp_path = tempfile.mkstemp(dir=entry.path)
+            with os.fdopen(fd, "w") as f:
+                print(entry.original_path, file=f)
+                print(entry.timestamp, file=f)
+                print(size, file=f)
+            os.replace(tmp_path, os.path.join(entry.path, trash.INFO_NAME))
+        except FileNotFoundError:
+            # the entry was dropped in the meantime
+            pass
+
+
+def iter_entries(retention_dir):
+    try:
+        names = sorted(os.listdir(retention_dir))
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        if name.startswith("."):
+            # entries which are still being built
+            continue
+        path = os.path.join(retention_dir, name)
+        original_path, timestamp, size = None, None, None
+        try:
+            with open(os.path.join(path, trash.INFO_NAME), "r") as f:
+                original_path = f.readline().rstrip("\n") or None
+                timestamp = float(f.readline())
+                line = f.readline()
+                if line.strip():
+                    size = int(line)
+        except (OSError, ValueError):
+            # a damaged entry is expired first, one with a broken size is
+            # measured again
+            pass
+        yield Entry(path, original_path, timestamp, size)
+
+
+def _iter_all(retention_dirs):
+    for retention_dir in retention_dirs:
+        yield from iter_entries(retention_dir)
+
+
+def expired(retention_dirs, budget):
+    # return the entries to drop, least recently retained first, so that
+    # the others fit into the budget; entries abandoned while being built
+    # are always dropped, those which have not been measured yet count as
+    # empty
+    entries = sorted(_iter_all(retention_dirs),
+                     key=lambda entry: (not is_damaged(entry),
+                                        entry.timestamp or 0))
+    total = sum(entry.size or 0 for entry in entries)
+    result = [Entry(path, None, None, None)
+              for retention_dir in retention_dirs
+              for path in trash.iter_stale(retention_dir)]
+    for entry in entries:
+        if total <= budget and not is_damaged(entry):
+            break
+        result.append(entry)
+        total -= entry.size or 0
+    return result
+
+
+def _is_within(path, parent):
+    return path == parent or path.startswith(parent.rstrip("/") + "/")
+
+
+def find_bases(retention_dirs, path):
+    # return the directories holding retained data of path, newest first:
+    # entries of path itself or of a directory containing it
+    path = os.path.abspath(path)
+    entries = sorted(
+        (entry for entry in _iter_all(retention_dirs)
+         if entry.original_path is not None and
+         _is_within(path, entry.original_path)),
+        key=lambda entry: -(entry.timestamp or 0),
+    )
+    result = []
+    for entry in entries:
+        base = os.path.join(entry.path, trash.DATA_NAME,
+                            os.path.relpath(path, entry.original_path))
+        if os.path.isdir(base):
+            result.append(os.path.normpath(base))
+    return result[:MAX_BASES]
+
+
+def superseded(retention_dirs, path):
+    # return the entries of path and of paths inside it, which are not
+    # needed anymore once path has been summoned
+    path = os.path.abspath(path)
+    return [entry for entry in _iter_all(retention_dirs)
+            if entry.original_path is not None and
+            _is_within(entry.original_path, path)]
@@ -0,0 +1,75 @@
+import asyncio
+import collections
+import random
+import subprocess
+
+
+OK = "ok"
+# the last attempt failed with an error which may go away by itself
+TRANSIENT = "transient"
+FAILED = "failed"
+
+# rsync exit codes caused by the network or by files changing during the
+# transfer, which a later attempt can get past: socket and protocol stream
+# errors (10, 12), partial transfers (23, 24), timeouts (30, 35) and ssh
+# failing to connect (255)
+TRANSIENT_EXIT_CODES = frozenset([10, 12, 23, 24, 30, 35, 255])
+
+# delays are capped, so that a long series of failures does not postpone
+# the next attempt forever
+MAX_DELAY = 600
+
+Result = collections.namedtuple("Result", ["status", "attempts", "error"])
+
+
+def is_transient(exc):
+    if isinstance(exc, subprocess.TimeoutExpired):
+        return True
+    if isinstance(exc, subprocess.CalledProcessError):
+        return exc.returncode in TRANSIENT_EXIT_CODES
+    return False
+
+
+def backoff_delay(attempt, base, max_delay=MAX_DELAY, rng=random):
+    # exponential backoff with jitter after the given (1-based) failed
+    # attempt: at least half of the exponential delay, so that concurrent
+    # retries neither hit the host all at once nor immediately
+    delay = min(max_delay, base * 2 ** (attempt - 1))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+async def run_all(items, run, jobs=1, attempts=1, base_delay=30,
+                  on_failure=None, rng=random, sleep=asyncio.sleep):
+    # call run(item) for each item with at most jobs calls at a time and
+    # return a Result per item. A failing item does not affect the others;
+    # after a transient error, it is tried again (up to attempts times in
+    # total) once its backoff delay has passed, without taking up one of the
+    # jobs while waiting. on_failure(item, exc, delay) is called after each
+    # failed attempt, with a delay of None if it is not retried.
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run_item(item):
+        attempt = 0
+        while True:
+            attempt += 1
+            async with semaphore:
+                try:
+                    await run(item)
+                except Exception as exc:
+                    error = exc
+                else:
+                    return Result(OK, attempt, None)
+
+            transient = is_transient(error)
+            if not transient or attempt >= attempts:
+                if on_failure is not None:
+                    on_failure(item, error, None)
+                return Result(TRANSIENT if transient else FAILED,
+                              attempt, error)
+
+            delay = backoff_delay(attempt, base_delay, rng=rng)
+            if on_failure is not None:
+                on_failure(item, error, delay)
+            await sleep(delay)
+
+    return await asyncio.gather(*(run_item(item) for item in items))
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import tempfile
+import time
+
+
+# bump when the format of the generated rules changes
+FORMAT_VERSION = 1
+
+# number of rule files kept in the cache; files which were used within
+# MIN_AGE seconds are never removed, as a transfer may be about to use them
+MAX_FILES = 256
+MIN_AGE = 3600
+
+
+def rules_key(t, relpath=""):
+    # the rules of a subtree only depend on its nodes and the state it
+    # inherits
+    node, subpath = t.rules.get_node(relpath)
+    h = hashlib.sha1()
+    h.update("{}\0{}\0{!r}\0".format(
+        FORMAT_VERSION,
+        node.get_state().value,
+        node.get_selection() and tuple(node.get_selection()),
+    ).encode("utf-8", "surrogateescape"))
+    if not subpath:
+        h.update(node.digest().encode("ascii"))
+    return h.hexdigest()
+
+
+def expire(cache_dir, max_files=MAX_FILES, min_age=MIN_AGE):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".rules"):
+            continue
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            continue
+
+    entries.sort(reverse=True)
+    now = time.time()
+    for mtime, path in entries[max_files:]:
+        if now - mtime < min_age:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_rule_file(cache_dir, t, relpath=""):
+    # return the path of a file with the filter rules of the target (or the
+    # subtree at relpath), generating it only if the rules changed since it
+    # was last generated
+    path = os.path.join(cache_dir, rules_key(t, relpath) + ".rules")
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            for mode, rule in t.subtarget(relpath).iter_filter_rules():
+                print("{} /{}".format(mode, rule), file=f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    expire(cache_dir)
+    return path
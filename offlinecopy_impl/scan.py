@@ -0,0 +1,64 @@
+import os
+
+from . import target
+
+
+def _walk(path, relpath, node, state, selection):
+    try:
+        it = os.scandir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    with it:
+        entries = sorted(it, key=lambda entry: entry.name)
+
+    for entry in entries:
+        child = node.childmap.get(entry.name) if node is not None else None
+        if child is not None:
+            child_state = child.get_state()
+        else:
+            child_state = state
+        child_relpath = relpath + "/" + entry.name
+
+        if entry.is_dir(follow_symlinks=False):
+            if child_state == target.State.EVICTED and (
+                    child is None or not child.childmap):
+                continue
+            yield from _walk(
+                entry.path, child_relpath, child, child_state,
+                child.get_selection() if child is not None else selection,
+            )
+        elif child_state == target.State.INCLUDED:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            # entries with a node of their own are not subject to the
+            # selection of their directory
+            if     ((child is None or child.state is None) and
+                    not target.is_selected(selection, entry.name, st)):
+                continue
+            yield child_relpath, st
+
+
+def iter_included_files(t, relpath=""):
+    # yield (relpath, stat) for all non-directory entries below relpath
+    # which are included according to the rule tree of the target
+    node, subpath = t.rules.get_node(relpath)
+    selection = node.get_selection()
+    if subpath:
+        node = None
+    state = t.get_state(relpath)
+
+    parts = target.path_split(relpath)
+    relpath = "".join("/" + part for part in parts)
+    path = t.dest.joinpath(*parts)
+
+    if not path.is_dir():
+        if path.exists():
+            st = os.lstat(str(path))
+            if t.get_entry_state(relpath, st) == target.State.INCLUDED:
+                yield relpath, st
+        return
+
+    yield from _walk(str(path), relpath, node, state, selection)
@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+import re
+import sys
+import time
+
+
+UNITS = [("w", 7 * 86400), ("d", 86400), ("h", 3600), ("m", 60), ("s", 1)]
+
+# seconds between checks of the targets file when nothing is due earlier
+POLL_INTERVAL = 60
+
+
+class Schedule:
+    # push a target every interval seconds; with windows, pushes are only
+    # started within them. Windows are (start, end) pairs in minutes after
+    # local midnight; a window whose end is not after its start spans
+    # midnight.
+
+    def __init__(self, interval, windows=()):
+        self.interval = interval
+        self.windows = list(windows)
+
+    def __eq__(self, other):
+        if not isinstance(other, Schedule):
+            return NotImplemented
+        return vars(self) == vars(other)
+
+
+def parse_interval(s):
+    # "3600", "30m", "1h30m", "2d"
+    s = s.strip().lower()
+    if s.isdigit():
+        value = int(s)
+    elif re.match(r"^(\d+[wdhms])+$", s):
+        units = dict(UNITS)
+        value = sum(int(number) * units[unit]
+                    for number, unit in re.findall(r"(\d+)([wdhms])", s))
+    else:
+        raise ValueError("invalid interval: {!r}".format(s))
+    if value <= 0:
+        raise ValueError("interval must be positive: {!r}".format(s))
+    return value
+
+
+def format_interval(seconds):
+    parts = []
+    for unit, size in UNITS:
+        if seconds >= size:
+            parts.append("{}{}".format(seconds // size, unit))
+            seconds %= size
+    return "".join(parts) or "0s"
+
+
+def parse_time(s):
+    match = re.match(r"^(\d{1,2}):(\d{2})$", s.strip())
+    if match is None or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError("invalid time of day: {!r}".format(s))
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def format_time(minutes):
+    return "{:02d}:{:02d}".format(*divmod(minutes, 60))
+
+
+def parse_window(s):
+    # "22:00-06:00"
+    start, sep, end = s.partition("-")
+    if not sep:
+        raise ValueError("invalid window: {!r}".format(s))
+    start, end = parse_time(start), parse_time(end)
+    if start == end:
+        raise ValueError("empty window: {!r}".format(s))
+    return start, end
+
+
+def format_window(window):
+    return "{}-{}".format(format_time(window[0]), format_time(window[1]))
+
+
+def in_window(windows, when):
+    minute = when.hour * 60 + when.minute
+    for start, end in windows:
+        if start < end:
+            if start <= minute < end:
+                return True
+        elif minute >= start or minute < end:
+            return True
+    return False
+
+
+def next_run(schedule, last_run, now):
+    # the earliest time, not before now, at which the target is due and a
+    # push may be started
+    due = now if last_run is None else max(now, last_run + schedule.interval)
+    if not schedule.windows:
+        return due
+
+    when = datetime.datetime.fromtimestamp(due)
+    if in_window(schedule.windows, when):
+        return due
+
+    midnight = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    return min(
+        start
+        for days in [0, 1]
+        for start in (midnight + datetime.timedelta(days=days, minutes=minute)
+                      for minute, _ in schedule.windows)
+        if start > when
+    ).timestamp()
+
+
+def last_runs(records):
+    # time of the last push of each target as a whole, from the history
+    result = {}
+    for record in records:
+        if record.get("direction") != "push" or record.get("relpath"):
+            continue
+        result[record["target"]] = max(result.get(record["target"], 0),
+                                       record["time"])
+    return result
+
+
+def due_targets(targets, last_run, now):
+    return [t for t in targets
+            if t.schedule is not None and
+            next_run(t.schedule, last_run.get(str(t.dest)), now) <= now]
+
+
+async def run(get_targets, run_target, last_run,
+              jobs=1,
+              poll_interval=POLL_INTERVAL,
+              clock=time.time):
+    # start the pushes of due targets, at most jobs at a time and never two
+    # of the same target; last_run is updated as pushes are started.
+    # get_targets is called on every check, so that changes to the targets
+    # are picked up without a restart.
+    running = {}
+    try:
+        while True:
+            now = clock()
+            wake = now + poll_interval
+            for t in get_targets():
+                key = str(t.dest)
+                if t.schedule is None or key in running:
+                    continue
+                when = next_run(t.schedule, last_run.get(key), now)
+                if when > now:
+                    wake = min(wake, when)
+                elif len(running) < jobs:
+                    last_run[key] = now
+                    running[key] = asyncio.ensure_future(run_target(t))
+
+            timeout = max(wake - clock(), 0)
+            if not running:
+                await asyncio.sleep(timeout)
+                continue
+
+            await asyncio.wait(list(running.values()),
+                               timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            for key, task in list(running.items()):
+                if not task.done():
+                    continue
+                del running[key]
+                if task.cancelled():
+                    continue
+                exc = task.exception()
+                if exc is not None:
+                    print("error: scheduled push of {!r} failed: {}".format(
+                              key, exc),
+                          file=sys.stderr)
+    finally:
+        for task in running.values():
+            task.cancel()
+        if running:
+            await asyncio.wait(list(running.values()))
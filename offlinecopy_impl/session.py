@@ -0,0 +1,196 @@
+import asyncio
+import collections
+import pathlib
+import subprocess
+
+from . import config, main, target
+
+
+class Error(Exception):
+    pass
+
+
+TargetStatus = collections.namedtuple(
+    "TargetStatus",
+    ["src", "dest", "mirrors", "rules"]
+)
+
+
+TransferResult = collections.namedtuple(
+    "TransferResult",
+    ["dest", "returncode"]
+)
+
+
+def _dry_run_mode(dry_run):
+    # dry_run=True lets rsync perform the dry run
+    if dry_run is True:
+        return main.DryRunMode.RSYNC
+    return dry_run
+
+
+class Session:
+    """
+    In-process interface to offlinecopy.
+
+    The configuration and the targets are read once when the session is
+    created. Changes to the include/exclude state are kept in memory until
+    :meth:`save` is called; local data of paths excluded with ``evict=True``
+    is only deleted after the new state has been saved.
+
+    Invalid requests raise :class:`Error`. A failed summon raises
+    :class:`subprocess.CalledProcessError`, while push and revert return the
+    exit status of each target. rsync writes its output to the standard
+    output of the process. ``dry_run`` is a bool or a ``main.DryRunMode``.
+
+    Transfers are available as coroutines (:meth:`summon_async`,
+    :meth:`push_async` and :meth:`revert_async`) for programs which run an
+    event loop; the plain methods run them in a loop of their own and cannot
+    be called from a running loop.
+    """
+
+    def __init__(self, config_path=None, targets_path=None):
+        self.config_path = config_path or main.get_config_path()
+        self.targets_path = targets_path or main.get_targets_path()
+        self.reload()
+
+    def reload(self):
+        self.cfg = config.Config(main.read_config(self.config_path))
+        self.targets = main.read_targets(self.targets_path)
+        self.dirty = False
+        self._pending_evictions = []
+        self._resolved = {
+            t: t.dest.resolve()
+            for t in self.targets
+        }
+
+    def _resolve_path(self, path):
+        path = pathlib.Path(path)
+        try:
+            return path.resolve()
+        except FileNotFoundError:
+            return path.absolute()
+
+    def find_target(self, path):
+        path = self._resolve_path(path)
+        for t, dest in self._resolved.items():
+            if dest == path or dest in path.parents:
+                return t, str(path)[len(str(dest)):]
+        raise Error("{!r} is not in any target".format(str(path)))
+
+    def _select_scopes(self, paths):
+        # paths may be target directories or paths inside them, which
+        # restricts the transfer to that subtree
+        if not paths:
+            return [(t, "") for t in sorted(self.targets,
+                                            key=lambda t: t.dest)]
+        return [self.find_target(path) for path in paths]
+
+    def get_state(self, path):
+        t, relpath = self.find_target(path)
+        return t.get_state(relpath)
+
+    def _check_included(self, t, relpath, selection):
+        if     (t.get_state(relpath) == target.State.INCLUDED and
+                t.get_selection(relpath) == selection):
+            raise Error("{!r} is already included".format(relpath))
+
+    def include(self, path, selection=None):
+        t, relpath = self.find_target(path)
+        self._check_included(t, relpath, selection)
+        t.include(relpath, selection)
+        self.dirty = True
+
+    def exclude(self, path, evict=False):
+        t, relpath = self.find_target(path)
+        if t.get_state(relpath) == target.State.EVICTED:
+            raise Error("already excluded: {!r}".format(relpath))
+        t.evict(relpath)
+        self.dirty = True
+        if evict:
+            self._pending_evictions.append(self._resolve_path(path))
+
+    async def summon_async(self, path, dry_run=False, rsync_opts=(),
+                           split=False, selection=None):
+        t, relpath = self.find_target(path)
+
+        # the rules of the target are changed while the lock is held, so
+        # that a failed summon does not undo a concurrent one
+        async with main.target_lock(t):
+            self._check_included(t, relpath, selection)
+
+            # the path has to be included during the transfer so that the
+            # snapshot of the target covers it
+            previous = (list(t.iter_flat_nodes()),
+                        list(t.iter_selections()))
+            t.include(relpath, selection)
+            try:
+                await main._summon_async(self.cfg, t, relpath,
+                                         additional_args=list(rsync_opts),
+                                         dry_run=_dry_run_mode(dry_run),
+                                         split=split)
+            except BaseException:
+                t.from_flat_nodes(*previous)
+                raise
+
+            if dry_run:
+                t.from_flat_nodes(*previous)
+            else:
+                self.dirty = True
+
+    def summon(self, path, **kwargs):
+        return asyncio.run(self.summon_async(path, **kwargs))
+
+    async def _transfer_async(self, paths, revert, dry_run, rsync_opts):
+        results = []
+        for t, relpath in self._select_scopes(paths):
+            dest = t.dest.joinpath(*target.path_split(relpath))
+            try:
+                await main.rsync_target_async(
+                    self.cfg, t,
+                    additional_args=list(rsync_opts),
+                    dry_run=_dry_run_mode(dry_run),
+                    revert=revert,
+                    relpath=relpath,
+                )
+            except subprocess.CalledProcessError as exc:
+                results.append(TransferResult(dest, exc.returncode))
+            else:
+                results.append(TransferResult(dest, 0))
+        return results
+
+    async def push_async(self, paths=(), dry_run=False, rsync_opts=()):
+        return await self._transfer_async(paths, False, dry_run, rsync_opts)
+
+    def push(self, paths=(), **kwargs):
+        return asyncio.run(self.push_async(paths, **kwargs))
+
+    async def revert_async(self, paths, dry_run=False, rsync_opts=()):
+        if not paths:
+            raise Error("no target selected")
+        return await self._transfer_async(paths, True, dry_run, rsync_opts)
+
+    def revert(self, paths, **kwargs):
+        return asyncio.run(self.revert_async(paths, **kwargs))
+
+    def status(self):
+        return [
+            TargetStatus(t.src, t.dest, list(t.mirrors),
+                         list(t.iter_filter_rules()))
+            for t in self.targets
+        ]
+
+    def save(self):
+        if self.dirty:
+            # changes saved by other processes in the meantime are merged in
+            main.write_targets(self.targets_path, self.targets)
+            self.dirty = False
+            self._resolved = {
+                t: self._resolved.get(t) or t.dest.resolve()
+                for t in self.targets
+            }
+
+        evictions, self._pending_evictions = self._pending_evictions, []
+        if evictions:
+            main.evict_local(self.targets, evictions,
+                             retain_budget=self.cfg.retain_budget)
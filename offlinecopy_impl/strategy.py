@@ -0,0 +1,47 @@
+from . import target
+
+
+FILTER = "filter"
+LIST = "list"
+
+MODES = ("auto", FILTER, LIST)
+
+# with more included roots than this, the file list sent to rsync costs
+# more than walking the evicted directories
+MAX_LIST_ROOTS = 1000
+
+
+def iter_included_roots(node, relpath=""):
+    # yield the relpaths of the included nodes which have no included
+    # ancestor; everything transferred is below one of them
+    if node.state == target.State.INCLUDED or (
+            node.parent is None and node.get_state() == target.State.INCLUDED):
+        yield relpath
+        return
+    for segment, child in sorted(node.childmap.items(),
+                                 key=lambda x: x[0]):
+        yield from iter_included_roots(child, relpath + "/" + segment)
+
+
+def choose(t, mode="auto"):
+    # return (strategy, roots); roots is the list of included roots for the
+    # list strategy and None for the filter strategy
+    if mode == FILTER or not t.dest.is_dir():
+        return FILTER, None
+
+    roots = list(iter_included_roots(t.rules))
+    if "" in roots or any("\n" in root for root in roots):
+        # the whole tree is included anyway, or a path cannot be written to
+        # a newline-separated list
+        return FILTER, None
+
+    if mode == LIST:
+        return LIST, roots
+
+    # a sparse tree: the root is evicted and only a few subtrees are
+    # included, so walking the evicted directories on the way to them (and
+    # rejecting all their other entries) is wasted effort
+    if roots and len(roots) <= MAX_LIST_ROOTS:
+        return LIST, roots
+
+    return FILTER, None
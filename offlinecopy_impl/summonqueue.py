@@ -0,0 +1,142 @@
+import contextlib
+import json
+import os
+import sys
+import time
+import traceback
+
+from . import locking
+
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+
+
+def load(path):
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return {"next_id": 1, "entries": []}
+
+    with f:
+        return json.load(f)
+
+
+def save(path, queue):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(queue, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def modify(path):
+    # the queue is shared by the worker and the processes adding to or
+    # editing it; changes made within the block are saved when it is left
+    # without an exception
+    with locking.FileLock(path + ".lock"):
+        queue = load(path)
+        yield queue
+        save(path, queue)
+
+
+def add(queue, target, relpath, priority=0, **options):
+    # a queued or running summon of the same path is reused, so that adding
+    # it again only changes its priority; failed ones are replaced
+    for entry in list(queue["entries"]):
+        if entry["target"] != target or entry["relpath"] != relpath:
+            continue
+        if entry["state"] == FAILED:
+            queue["entries"].remove(entry)
+            continue
+        if entry["state"] == QUEUED:
+            entry["priority"] = priority
+        return entry
+
+    entry = {
+        "id": queue["next_id"],
+        "target": target,
+        "relpath": relpath,
+        "priority": priority,
+        "state": QUEUED,
+        "added": time.time(),
+        "options": options,
+    }
+    queue["next_id"] += 1
+    queue["entries"].append(entry)
+    return entry
+
+
+def find(queue, id_):
+    for entry in queue["entries"]:
+        if entry["id"] == id_:
+            return entry
+    return None
+
+
+def ordered(queue):
+    # the order in which the entries are processed: running ones first, then
+    # by descending priority and in the order they were added
+    return sorted(queue["entries"],
+                  key=lambda entry: (entry["state"] != RUNNING,
+                                     entry["state"] == FAILED,
+                                     -entry["priority"],
+                                     entry["id"]))
+
+
+def next_entries(queue, count):
+    # entries to start next; summons of a target which is already being
+    # transferred would only wait for the lock of the target
+    busy = {entry["target"] for entry in queue["entries"]
+            if entry["state"] == RUNNING}
+    result = []
+    for entry in ordered(queue):
+        if len(result) >= count:
+            break
+        if entry["state"] != QUEUED or entry["target"] in busy:
+            continue
+        busy.add(entry["target"])
+        result.append(entry)
+    return result
+
+
+def reset_running(queue):
+    # entries left running by a worker which died are queued again, unless
+    # they were cancelled
+    for entry in list(queue["entries"]):
+        if entry["state"] != RUNNING:
+            continue
+        if entry.get("cancel"):
+            queue["entries"].remove(entry)
+        else:
+            entry["state"] = QUEUED
+            entry.pop("started", None)
+
+
+def spawn_worker(work, log_path):
+    # run work() in a detached process whose output goes to log_path
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    if os.fork() != 0:
+        return
+
+    try:
+        os.setsid()
+        fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        work()
+    except BaseException:
+        traceback.print_exc()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(0)
@@ -1,6 +1,10 @@
+import collections
+import fnmatch
+import hashlib
 import itertools
 import os.path
 import pathlib
+import stat
 
 from enum import Enum
 
@@ -15,13 +19,7 @@ def rebase_rules(prefix, rules):
 
 
 def path_split(path):
-    parts = list(os.path.split(path))
-    prev_lhs = None
-    while parts[0] != prev_lhs:
-        prev_lhs = parts[0]
-        parts[:1] = os.path.split(parts[0])
-    parts[0] = parts[0].rstrip("/")
-    return tuple(part for part in parts if part)
+    return tuple(part for part in path.split(os.path.sep) if part)
 
 
 class State(Enum):
@@ -29,12 +27,74 @@ class State(Enum):
     EVICTED = "evicted"
 
 
+# restricts an included node to the files whose name matches one of the
+# patterns (rsync wildcards, without slashes) and which are at most max_size
+# bytes large; either may be empty or None
+Selection = collections.namedtuple("Selection", ["patterns", "max_size"])
+
+
+def is_selected(selection, name, st=None):
+    # whether rsync transfers the non-directory entry with the given name
+    # and stat result below a node with the selection; --max-size only
+    # applies to regular files, and the size is not checked without st
+    if selection is None:
+        return True
+    if selection.patterns and not any(
+            fnmatch.fnmatchcase(name, pattern)
+            for pattern in selection.patterns):
+        return False
+    if     (selection.max_size is not None and
+            st is not None and
+            stat.S_ISREG(st.st_mode) and
+            st.st_size > selection.max_size):
+        return False
+    return True
+
+
 class Node:
     def __init__(self, parent=None):
         self.parent = parent
         self.childmap = {}
+        self._digest = None
+        self.selection = None
         self.state = None
 
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, value):
+        self._state = value
+        self.invalidate()
+
+    def invalidate(self):
+        # a cached digest implies cached digests of all descendants, so the
+        # walk can stop at the first node without one
+        node = self
+        while node is not None and node._digest is not None:
+            node._digest = None
+            node = node.parent
+
+    def digest(self):
+        # hash of the states in this subtree, updated on mutation; equal
+        # subtrees have equal digests
+        if self._digest is None:
+            h = hashlib.sha1()
+            h.update(b"-" if self._state is None
+                     else self._state.value.encode("ascii"))
+            if self.selection is not None:
+                h.update(repr(tuple(self.selection)).encode(
+                    "utf-8", "surrogateescape"))
+            for segment, child in sorted(self.childmap.items(),
+                                         key=lambda x: x[0]):
+                h.update(b"\0")
+                h.update(segment.encode("utf-8", "surrogateescape"))
+                h.update(b"\0")
+                h.update(child.digest().encode("ascii"))
+            self._digest = h.hexdigest()
+        return self._digest
+
     def get_state(self):
         if self.state is not None:
             return self.state
@@ -42,6 +102,26 @@ class Node:
             return self.parent.get_state()
         return State.INCLUDED
 
+    def get_selection(self):
+        if self.state is not None:
+            return self.selection if self.state == State.INCLUDED else None
+        if self.parent is not None:
+            return self.parent.get_selection()
+        return None
+
+    def _get_effective(self):
+        return self.get_state(), self.get_selection()
+
+    def _below_selection(self):
+        node = self.parent
+        while node is not None:
+            if     (node.state == State.INCLUDED and
+                    node.selection is not None and
+                    node.selection.patterns):
+                return True
+            node = node.parent
+        return False
+
     def get_node(self, path):
         parts = path_split(path)
         node = self
@@ -55,23 +135,70 @@ class Node:
     def ensure_node(self, path):
         node, subpath = self.get_node(path)
         for part in subpath:
+            node.invalidate()
             node = node.childmap.setdefault(
                 part,
                 Node(parent=node)
             )
         return node
 
-    def _iter_rules(self, parent_state):
+    def build(self, flat_nodes):
+        # the nodes of the previous path are kept on a stack so that the
+        # common prefix with the next path does not have to be walked again;
+        # this is most effective if flat_nodes is sorted
+        prev_parts = ()
+        stack = [self]
+        for state, path in flat_nodes:
+            parts = path_split(path)
+
+            common = 0
+            for prev_part, part in zip(prev_parts, parts):
+                if prev_part != part:
+                    break
+                common += 1
+            del stack[common+1:]
+
+            node = stack[-1]
+            for part in parts[common:]:
+                child = node.childmap.get(part)
+                if child is None:
+                    node.invalidate()
+                    child = Node(parent=node)
+                    node.childmap[part] = child
+                node = child
+                stack.append(node)
+
+            node.state = state
+            prev_parts = parts
+
+    def _iter_selection_rules(self):
+        # the directories below the node are traversed, matching files are
+        # transferred and everything else is excluded
+        if self.selection.patterns:
+            yield ("+", "**/")
+            for pattern in self.selection.patterns:
+                yield ("+", pattern)
+                yield ("+", "**/" + pattern)
+            yield ("-", "**")
+
+    def _iter_rules(self, parent_state, selections=True):
         for segment, child in sorted(self.childmap.items(),
                                      key=lambda x: x[0]):
             yield from rebase_rules(
                 segment,
-                child._iter_rules(self.get_state())
+                child._iter_rules(self.get_state(), selections)
             )
 
         if self.state == State.INCLUDED:
+            if selections and self.selection is not None:
+                yield from self._iter_selection_rules()
             if self.parent is not None:
-                yield ("+", None)
+                if selections and self._below_selection():
+                    # the node itself and everything below it, which
+                    # would otherwise be subject to the selection above
+                    yield ("+", "***")
+                else:
+                    yield ("+", None)
         elif self.childmap and self.get_state() == State.EVICTED:
             yield ("-", "*")
             if     (self.parent is not None and
@@ -83,8 +210,10 @@ class Node:
             else:
                 yield ("-", None)
 
-    def iter_rules(self):
-        yield from self._iter_rules(State.INCLUDED)
+    def iter_rules(self, selections=True):
+        # without selections, selective nodes are treated as including
+        # their whole subtree
+        yield from self._iter_rules(State.INCLUDED, selections)
 
     def iter_nodes(self):
         if self.state is not None:
@@ -96,21 +225,72 @@ class Node:
                 child.iter_nodes()
             )
 
+    def iter_selections(self):
+        if self.state == State.INCLUDED and self.selection is not None:
+            yield (self.selection, None if self.parent is not None else "")
+        for segment, child in sorted(self.childmap.items(),
+                                     key=lambda x: x[0]):
+            yield from rebase_rules(
+                segment,
+                child.iter_selections()
+            )
+
+    def _is_redundant(self):
+        # a leaf which does not change the effective state (or has no state
+        # at all) can be dropped without changing the rules
+        return (not self.childmap and
+                (self.state is None or
+                 self._get_effective() == self.parent._get_effective()))
+
     def prune(self):
         for segment, child in list(self.childmap.items()):
             child.prune()
-            if child.state == self.get_state() and not child.childmap:
+            if child._is_redundant():
+                del self.childmap[segment]
+                self.invalidate()
+
+    def _prune_redundant(self, effective):
+        for segment, child in list(self.childmap.items()):
+            if child.state is None:
+                child._prune_redundant(effective)
+                if not child.childmap:
+                    # an intermediate node whose leaves were all dropped
+                    del self.childmap[segment]
+                    self.invalidate()
+            elif child._get_effective() == effective and not child.childmap:
                 del self.childmap[segment]
+                self.invalidate()
+
+    def normalize(self):
+        # restore the result of a full prune() on a previously pruned tree
+        # after the state of this node has been changed
+        self._prune_redundant(self._get_effective())
+
+        node = self
+        while node.parent is not None and node._is_redundant():
+            parent = node.parent
+            for segment, child in parent.childmap.items():
+                if child is node:
+                    del parent.childmap[segment]
+                    parent.invalidate()
+                    break
+            node = parent
 
     def clear(self):
         self.childmap.clear()
+        self.selection = None
         self.state = None
+        self.invalidate()
 
 
 class Target:
     def __init__(self, src, dest):
         self.src = src
         self.dest = pathlib.Path(dest)
+        self.budget = None
+        self.mirrors = []
+        self.transport = None
+        self.schedule = None
 
         self.rules = Node()
         self.rules.state = State.EVICTED
@@ -121,26 +301,148 @@ class Target:
     def iter_flat_nodes(self):
         return self.rules.iter_nodes()
 
+    def iter_selections(self):
+        return self.rules.iter_selections()
+
+    def has_selections(self):
+        return any(True for _ in self.iter_selections())
+
+    def iter_size_limits(self):
+        # yield (relpath, max_size) of the size-limited nodes
+        for selection, path in self.iter_selections():
+            if selection.max_size is not None:
+                yield "/" + path if path else "", selection.max_size
+
     def get_state(self, path):
         return self.rules.get_node(path)[0].get_state()
 
+    def get_selection(self, path):
+        return self.rules.get_node(path)[0].get_selection()
+
+    def get_entry_selection(self, path):
+        # the selection which decides whether the entry at path is
+        # transferred, or None if its state alone decides that
+        node, subpath = self.rules.get_node(path)
+        if not subpath:
+            return None
+        return node.get_selection()
+
+    def get_entry_state(self, path, st=None):
+        # like get_state, but with the selections applied to the entry at
+        # path; directories are traversed and count as included, and
+        # without st the entry is taken as a file of unknown size
+        state = self.get_state(path)
+        if     (state == State.INCLUDED and
+                (st is None or not stat.S_ISDIR(st.st_mode))):
+            parts = path_split(path)
+            if parts and not is_selected(self.get_entry_selection(path),
+                                         parts[-1], st):
+                return State.EVICTED
+        return state
+
     def evict(self, path):
         if self.get_state(path) == State.EVICTED:
             return
         node = self.rules.ensure_node(path)
+        node.selection = None
         node.state = State.EVICTED
+        node.normalize()
 
-    def include(self, path):
-        if self.get_state(path) == State.INCLUDED:
+    def include(self, path, selection=None):
+        if     (self.get_state(path) == State.INCLUDED and
+                self.get_selection(path) == selection):
             return
         node = self.rules.ensure_node(path)
+        node.selection = selection
         node.state = State.INCLUDED
+        node.normalize()
 
-    def from_flat_nodes(self, flat_nodes):
+    def from_flat_nodes(self, flat_nodes, selections=()):
         self.rules.clear()
-        for state, path in flat_nodes:
-            node = self.rules.ensure_node(path)
-            node.state = state
+        self.rules.build(flat_nodes)
+        for selection, path in selections:
+            node, subpath = self.rules.get_node(path)
+            if not subpath and node.state == State.INCLUDED:
+                node.selection = selection
+                node.invalidate()
+        self.rules.prune()
+
+    def copy(self):
+        result = Target(self.src, self.dest)
+        result.budget = self.budget
+        result.mirrors = list(self.mirrors)
+        result.transport = self.transport
+        result.schedule = self.schedule
+        result.from_flat_nodes(self.iter_flat_nodes(), self.iter_selections())
+        return result
 
     def prune(self):
         self.rules.prune()
+
+    def split_size_limits(self, path=""):
+        # rsync only has a global --max-size, so a transfer of the subtree
+        # at path is split into transfers with at most one size limit each;
+        # yield (target, relpath, max_size) where every size-limited subtree
+        # is evicted in all targets but its own
+        relpath = "".join("/" + part for part in path_split(path))
+        limits = [(relpath + subpath, max_size)
+                  for subpath, max_size
+                  in self.subtarget(relpath).iter_size_limits()]
+        if not limits:
+            yield self, relpath, None
+            return
+
+        rest = self.copy()
+        for limited, _ in limits:
+            rest.evict(limited)
+        scope = rest.subtarget(relpath)
+        if scope.rules.get_state() == State.INCLUDED or scope.rules.childmap:
+            yield rest, relpath, None
+
+        for limited, max_size in limits:
+            part = self.copy()
+            for other, _ in limits:
+                if other.startswith(limited + "/"):
+                    part.evict(other)
+            yield part, limited, max_size
+
+    def subtarget(self, path):
+        # return a target for the subtree at path, whose rules are those of
+        # the subtree rebased to its root; transfers of it only touch (and
+        # delete within) the subtree
+        parts = path_split(path)
+        if not parts:
+            return self
+
+        def join(src):
+            trailing = "/" if src.endswith("/") else ""
+            return src.rstrip("/") + "/" + "/".join(parts) + trailing
+
+        result = Target(join(self.src), self.dest.joinpath(*parts))
+        result.mirrors = [join(mirror) for mirror in self.mirrors]
+        result.transport = self.transport
+        result.schedule = self.schedule
+
+        node, subpath = self.rules.get_node(path)
+        result.rules.selection = node.get_selection()
+        result.rules.state = node.get_state()
+        if not subpath:
+            children = sorted(node.childmap.items(), key=lambda x: x[0])
+            result.from_flat_nodes(
+                itertools.chain(
+                    [(result.rules.state, "")],
+                    ((state, relpath)
+                     for segment, child in children
+                     for state, relpath in rebase_rules(segment,
+                                                        child.iter_nodes())),
+                ),
+                itertools.chain(
+                    [(result.rules.selection, "")]
+                    if result.rules.selection is not None else [],
+                    ((selection, relpath)
+                     for segment, child in children
+                     for selection, relpath in rebase_rules(
+                         segment, child.iter_selections())),
+                ),
+            )
+        return result
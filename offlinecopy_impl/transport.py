@@ -0,0 +1,156 @@
+import re
+import statistics
+
+from enum import Enum
+
+
+# transfers faster than this (in bytes per second) are considered to run on
+# a local network, where compression and the delta algorithm cost more CPU
+# time than they save
+FAST_THROUGHPUT = 30 * 1024**2
+
+# compression is only worth it if it shrinks the data at least by this factor
+MIN_COMPRESSION_RATIO = 1.2
+
+# transfers smaller than this are dominated by latency and file list
+# building and say little about throughput or compressibility
+MIN_SAMPLE_BYTES = 1024**2
+
+MAX_SAMPLES = 10
+
+
+class Setting(Enum):
+    YES = "yes"
+    NO = "no"
+    AUTO = "auto"
+
+
+class Profile:
+    AUTO_SETTINGS = ("compress", "whole_file")
+    FIXED_SETTINGS = ("sparse", "acls", "xattrs")
+
+    def __init__(self,
+                 compress=Setting.NO,
+                 whole_file=Setting.NO,
+                 sparse=Setting.YES,
+                 acls=Setting.YES,
+                 xattrs=Setting.YES,
+                 checksum_choice=None):
+        self.compress = compress
+        self.whole_file = whole_file
+        self.sparse = sparse
+        self.acls = acls
+        self.xattrs = xattrs
+        self.checksum_choice = checksum_choice
+
+    def __eq__(self, other):
+        if not isinstance(other, Profile):
+            return NotImplemented
+        return vars(self) == vars(other)
+
+    def is_default(self):
+        return self == Profile()
+
+    def iter_settings(self):
+        for name in self.AUTO_SETTINGS + self.FIXED_SETTINGS:
+            yield name, getattr(self, name)
+
+
+STATS_FIELDS = {
+    "number_of_regular_files_transferred": "files",
+    "number_of_files_transferred": "files",
+    "total_transferred_file_size": "size",
+    "literal_data": "literal",
+    "matched_data": "matched",
+    "total_bytes_sent": "bytes_sent",
+    "total_bytes_received": "bytes_received",
+}
+
+
+def parse_stats(text):
+    # parse the output of rsync --stats; values printed with
+    # --human-readable are skipped
+    stats = {}
+    for line in text.splitlines():
+        match = re.match(r"^([A-Za-z ]+): ([\d,]+)(?:\s|$)", line.strip())
+        if match is None:
+            continue
+        key = match.group(1).lower().replace(" ", "_")
+        if key in STATS_FIELDS:
+            stats[STATS_FIELDS[key]] = int(match.group(2).replace(",", ""))
+    return stats
+
+
+def measure(records):
+    # return (throughput, compression ratio) estimated from the most recent
+    # history records of a target; either may be None if unknown
+    throughputs = []
+    ratios = []
+    for record in reversed(records):
+        if record.get("status") != 0:
+            continue
+        wire_bytes = record.get("bytes_sent", 0) + \
+            record.get("bytes_received", 0)
+        literal = record.get("literal", 0)
+        # the throughput is measured on the file data, not on the bytes on
+        # the wire: with compression on, a fast link would otherwise never
+        # look fast enough to turn it off again
+        data = literal + record.get("matched", 0)
+
+        if data >= MIN_SAMPLE_BYTES and record.get("duration"):
+            throughputs.append(data / record["duration"])
+
+        if record.get("compress") and literal >= MIN_SAMPLE_BYTES and \
+                wire_bytes:
+            ratios.append(literal / wire_bytes)
+
+    throughput = None
+    if throughputs:
+        throughput = statistics.median(throughputs[:MAX_SAMPLES])
+
+    ratio = None
+    if ratios:
+        ratio = statistics.median(ratios[:MAX_SAMPLES])
+
+    return throughput, ratio
+
+
+def resolve(profile, records):
+    # replace all AUTO settings of the profile by YES or NO based on the
+    # history records of the target
+    throughput, ratio = measure(records)
+    fast = throughput is not None and throughput >= FAST_THROUGHPUT
+
+    result = Profile(**vars(profile))
+
+    if result.compress == Setting.AUTO:
+        # without any measurement, compress so that the compressibility of
+        # the data can be learned
+        if fast or (ratio is not None and ratio < MIN_COMPRESSION_RATIO):
+            result.compress = Setting.NO
+        else:
+            result.compress = Setting.YES
+
+    if result.whole_file == Setting.AUTO:
+        result.whole_file = Setting.YES if fast else Setting.NO
+
+    return result
+
+
+def flags(profile):
+    short = "-raHE"
+    if profile.acls == Setting.YES:
+        short += "A"
+    if profile.xattrs == Setting.YES:
+        short += "X"
+    if profile.sparse == Setting.YES:
+        short += "S"
+    if profile.compress == Setting.YES:
+        short += "z"
+
+    result = [short]
+    if profile.whole_file == Setting.YES:
+        result.append("--whole-file")
+    if profile.checksum_choice is not None:
+        result.append("--checksum-choice={}".format(profile.checksum_choice))
+    return result
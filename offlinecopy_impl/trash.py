@@ -0,0 +1,220 @@
+import collections
+import concurrent.futures
+import contextlib
+import errno
+import fcntl
+import os
+import pathlib
+import tempfile
+import time
+
+
+DEFAULT_JOBS = 8
+
+INFO_NAME = "info"
+DATA_NAME = "data"
+LOCK_NAME = ".lock"
+# entries are built under a hidden name; those left behind by a crash are
+# deleted once they are older than STALE_AGE seconds
+PENDING_PREFIX = ".tmp"
+STALE_AGE = 24 * 3600
+
+
+Entry = collections.namedtuple(
+    "Entry",
+    ["path", "original_path", "timestamp"]
+)
+
+
+def find_mount_top(path):
+    dev = os.lstat(path).st_dev
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path or os.lstat(parent).st_dev != dev:
+            return path
+        path = parent
+
+
+def find_trash_dir(path, default_dir, forbidden=(), name="trash"):
+    # the trash directory must be on the same file system as path so that
+    # moving to the trash is an atomic rename, and it must not be inside any
+    # of the forbidden directories (the targets), so that it is never
+    # synchronized
+    path = os.path.abspath(path)
+    dev = os.lstat(path).st_dev
+    forbidden = [pathlib.Path(item) for item in forbidden]
+
+    candidates = [
+        default_dir,
+        os.path.join(find_mount_top(os.path.dirname(path)),
+                     ".offlinecopy-{}-{}".format(name, os.getuid())),
+    ]
+
+    for candidate in candidates:
+        candidate_path = pathlib.Path(candidate)
+        if any(item == candidate_path or item in candidate_path.parents
+               for item in forbidden):
+            continue
+        try:
+            os.makedirs(candidate, mode=0o700, exist_ok=True)
+        except OSError:
+            continue
+        if os.lstat(candidate).st_dev != dev:
+            continue
+        return candidate
+
+    return None
+
+
+def make_entry(path, entry_dir, info):
+    # move path into a new entry of entry_dir with the lines of info in its
+    # info file; the entry is only renamed to a visible name once it is
+    # complete, so that a concurrent drain never deletes it half-built
+    pending = tempfile.mkdtemp(prefix=PENDING_PREFIX, dir=entry_dir)
+    try:
+        with open(os.path.join(pending, INFO_NAME), "w") as f:
+            for line in info:
+                print(line, file=f)
+        os.rename(path, os.path.join(pending, DATA_NAME))
+    except BaseException:
+        delete_tree(pending)
+        raise
+    entry = os.path.join(entry_dir, os.path.basename(pending)[1:])
+    os.rename(pending, entry)
+    return entry
+
+
+def move_to_trash(path, trash_dir):
+    return make_entry(path, trash_dir,
+                      [os.path.abspath(path), time.time()])
+
+
+def iter_entries(trash_dir):
+    try:
+        names = sorted(os.listdir(trash_dir))
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        if name.startswith("."):
+            # the lock and entries which are still being built
+            continue
+        path = os.path.join(trash_dir, name)
+        original_path, timestamp = None, None
+        try:
+            with open(os.path.join(path, INFO_NAME), "r") as f:
+                original_path = f.readline().rstrip("\n") or None
+                timestamp = float(f.readline())
+        except (OSError, ValueError):
+            # a half-written or half-deleted entry; it is deleted all the
+            # same
+            pass
+        yield Entry(path, original_path, timestamp)
+
+
+def iter_stale(entry_dir, max_age=STALE_AGE):
+    # yield the paths of entries whose building was never finished
+    try:
+        names = sorted(os.listdir(entry_dir))
+    except FileNotFoundError:
+        return
+
+    now = time.time()
+    for name in names:
+        if not name.startswith(PENDING_PREFIX):
+            continue
+        path = os.path.join(entry_dir, name)
+        try:
+            if now - os.lstat(path).st_mtime > max_age:
+                yield path
+        except FileNotFoundError:
+            pass
+
+
+def _unlink_entries(path):
+    subdirs = []
+    try:
+        it = os.scandir(path)
+    except FileNotFoundError:
+        return subdirs
+
+    with it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    return subdirs
+
+
+def delete_tree(path, jobs=DEFAULT_JOBS):
+    if not os.path.isdir(path) or os.path.islink(path):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        return
+
+    dirs = [path]
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        pending = {executor.submit(_unlink_entries, path)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                for subdir in future.result():
+                    dirs.append(subdir)
+                    pending.add(executor.submit(_unlink_entries, subdir))
+
+    # children are always discovered after their parents; a directory which
+    # got new entries in the meantime is left for the next drain
+    for dir_ in reversed(dirs):
+        try:
+            os.rmdir(dir_)
+        except OSError as exc:
+            if exc.errno not in (errno.ENOENT, errno.ENOTEMPTY):
+                raise
+
+
+def drain(trash_dir, jobs=DEFAULT_JOBS, block=False):
+    try:
+        lock = open(os.path.join(trash_dir, LOCK_NAME), "w")
+    except FileNotFoundError:
+        return True
+
+    with lock:
+        flags = fcntl.LOCK_EX
+        if not block:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            # another worker is already draining this trash directory
+            return False
+
+        for entry in iter_entries(trash_dir):
+            delete_tree(entry.path, jobs=jobs)
+        for path in iter_stale(trash_dir):
+            delete_tree(path, jobs=jobs)
+
+    return True
+
+
+def read_registry(path):
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return []
+    with f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def register(path, trash_dir):
+    if trash_dir in read_registry(path):
+        return
+    with open(path, "a") as f:
+        print(trash_dir, file=f)
@@ -0,0 +1,143 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+
+from . import target
+
+
+DEFAULT_JOBS = 8
+
+
+def get_cache_path(cache_dir, t):
+    return os.path.join(
+        cache_dir,
+        "usage-" + hashlib.sha1(str(t.dest).encode("utf-8")).hexdigest() +
+        ".json"
+    )
+
+
+def load_cache(path):
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return {}
+
+    with f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+
+
+def save_cache(path, records):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(records, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _scan_dir(root, relpath, cached, selection=None):
+    # return the record [dev, inode, mtime_ns, ctime_ns, selection, own
+    # usage, subdirs] of the directory; the own usage covers the directory
+    # and all non-directory entries in it which are transferred with the
+    # selection
+    path = os.path.join(root, relpath)
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+
+    key = [st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns,
+           None if selection is None
+           else [list(selection.patterns or ()), selection.max_size]]
+    # the ctime of a directory changes whenever entries are added, removed
+    # or renamed, which includes every file written by rsync (it renames a
+    # temporary file into place); unlike the mtime, it cannot be set back,
+    # which rsync -a and the native engine do after a transfer. Files
+    # modified in place are only noticed once their directory changes.
+    if cached is not None and cached[:-2] == key:
+        return cached
+
+    own = st.st_blocks * 512
+    subdirs = []
+    try:
+        it = os.scandir(path)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return key + [own, subdirs]
+
+    with it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                entry_st = entry.stat(follow_symlinks=False)
+                if target.is_selected(selection, entry.name, entry_st):
+                    own += entry_st.st_blocks * 512
+            except FileNotFoundError:
+                continue
+
+    return key + [own, sorted(subdirs)]
+
+
+def walk(root, cache, jobs=DEFAULT_JOBS, get_selection=None):
+    # return the records of all directories below root (including root
+    # itself, with the relpath ""), reusing the records from cache for
+    # unchanged directories; directories which vanished are dropped.
+    # get_selection(relpath) returns the selection of a directory, if any.
+    root = str(root)
+    records = {}
+
+    def submit(relpath):
+        selection = None
+        if get_selection is not None:
+            selection = get_selection(relpath)
+        return executor.submit(_scan_dir, root, relpath,
+                               cache.get(relpath), selection)
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        pending = {submit(""): ""}
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                relpath = pending.pop(future)
+                record = future.result()
+                if record is None:
+                    continue
+                records[relpath] = record
+                for name in record[-1]:
+                    child = os.path.join(relpath, name)
+                    pending[submit(child)] = child
+
+    return records
+
+
+def totals(records):
+    # recursive usage of each directory
+    result = {}
+    for relpath in sorted(records, key=lambda p: p.count("/") + bool(p),
+                          reverse=True):
+        record = records[relpath]
+        result[relpath] = record[-2] + sum(
+            result.get(os.path.join(relpath, name), 0)
+            for name in record[-1]
+        )
+    return result
+
+
+def path_usage(root, dir_totals, relpath):
+    relpath = relpath.strip("/")
+    try:
+        return dir_totals[relpath]
+    except KeyError:
+        pass
+
+    try:
+        st = os.lstat(os.path.join(str(root), relpath))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    return st.st_blocks * 512
@@ -0,0 +1,147 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import stat
+
+
+CHUNK_SIZE = 1024**2
+
+# below this many files to hash, starting worker processes is not worth it
+MIN_POOL_FILES = 8
+
+
+Comparison = collections.namedtuple(
+    "Comparison",
+    ["differ", "local_only", "remote_only"]
+)
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def get_cache_path(cache_dir, root):
+    return os.path.join(
+        cache_dir,
+        "hashes-" + hashlib.sha1(str(root).encode("utf-8")).hexdigest() +
+        ".json"
+    )
+
+
+def load_cache(path):
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return {}
+
+    with f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+
+
+def save_cache(path, cache):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def iter_files(root):
+    # yield (relpath, stat) of all regular files below root
+    root = str(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            yield "/" + os.path.relpath(path, root), st
+
+
+def build_manifest(root, files, cache, jobs=None):
+    # return (manifest, cache) for the regular files among files, which are
+    # (relpath, stat) pairs below root. Files whose device, inode, size and
+    # mtime match their cache entry are not hashed again; the returned cache
+    # only contains the files seen.
+    root = str(root)
+    manifest = {}
+    new_cache = {}
+    todo = []
+    for relpath, st in files:
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        key = [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+        cached = cache.get(relpath)
+        if cached is not None and cached[:4] == key:
+            manifest[relpath] = cached[4]
+            new_cache[relpath] = cached
+        else:
+            todo.append((relpath, key))
+
+    paths = [os.path.join(root, relpath.lstrip("/")) for relpath, _ in todo]
+    if len(todo) < MIN_POOL_FILES or jobs == 1:
+        digests = map(hash_file, paths)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        digests = executor.map(hash_file, paths, chunksize=16)
+
+    try:
+        for (relpath, key), digest in zip(todo, digests):
+            if digest is None:
+                continue
+            manifest[relpath] = digest
+            new_cache[relpath] = key + [digest]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return manifest, new_cache
+
+
+def write_manifest(f, manifest):
+    # the format of sha256sum, so that a manifest can be produced with it as
+    # well
+    for relpath, digest in sorted(manifest.items()):
+        print("{}  {}".format(digest, relpath.lstrip("/")), file=f)
+
+
+def read_manifest(lines):
+    manifest = {}
+    for line in lines:
+        match = re.match(r"^([0-9a-fA-F]{64}) [ *](.*)$", line.rstrip("\n"))
+        if match is None:
+            # this includes escaped names of sha256sum (starting with \)
+            continue
+        path = match.group(2)
+        if path.startswith("./"):
+            path = path[2:]
+        manifest["/" + path.lstrip("/")] = match.group(1).lower()
+    return manifest
+
+
+def compare(local, remote):
+    return Comparison(
+        sorted(path for path in local.keys() & remote.keys()
+               if local[path] != remote[path]),
+        sorted(local.keys() - remote.keys()),
+        sorted(remote.keys() - local.keys()),
+    )
@@ -0,0 +1,116 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import offlinecopy_impl.cache as cache
+import offlinecopy_impl.target as target
+
+
+class Testselect_evictions(unittest.TestCase):
+    def test_within_budget(self):
+        candidates = [
+            cache.Candidate(None, "/A", 10, 1),
+            cache.Candidate(None, "/B", 20, 2),
+        ]
+
+        self.assertSequenceEqual(
+            cache.select_evictions(candidates, 30),
+            [],
+        )
+
+    def test_evicts_least_recently_used_first(self):
+        candidates = [
+            cache.Candidate(None, "/A", 10, 3),
+            cache.Candidate(None, "/B", 20, 1),
+            cache.Candidate(None, "/C", 30, 2),
+        ]
+
+        self.assertSequenceEqual(
+            cache.select_evictions(candidates, 15),
+            [
+                candidates[1],
+                candidates[2],
+            ]
+        )
+
+    def test_zero_budget_evicts_everything(self):
+        candidates = [
+            cache.Candidate(None, "/A", 10, 3),
+            cache.Candidate(None, "/B", 20, 1),
+        ]
+
+        self.assertSequenceEqual(
+            cache.select_evictions(candidates, 0),
+            [
+                candidates[1],
+                candidates[0],
+            ]
+        )
+
+
+class Testiter_candidates(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        for path in ["A/x", "A/B/y", "A/C/z", "D/w", "e"]:
+            path = self.root / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("w") as f:
+                f.write("data")
+
+        self.target = target.Target("host:/src/", self.root)
+
+    def test_included_root(self):
+        self.target.include("")
+
+        self.assertSequenceEqual(
+            [candidate.relpath
+             for candidate in cache.iter_candidates(self.target)],
+            ["/A", "/D", "/e"],
+        )
+
+    def test_skips_rule_nodes(self):
+        self.target.include("")
+        self.target.evict("A")
+        self.target.include("A/B")
+        self.target.prune()
+
+        self.assertSequenceEqual(
+            [candidate.relpath
+             for candidate in cache.iter_candidates(self.target)],
+            ["/D", "/e", "/A/B/y"],
+        )
+
+    def test_included_file(self):
+        self.target.include("e")
+
+        self.assertSequenceEqual(
+            [candidate.relpath
+             for candidate in cache.iter_candidates(self.target)],
+            ["/e"],
+        )
+
+    def test_selection(self):
+        self.target.include("")
+        self.target.include("A", target.Selection(("y", "z"), None))
+
+        # /A/x is not transferred and must not be deleted by an eviction
+        self.assertSequenceEqual(
+            [candidate.relpath
+             for candidate in cache.iter_candidates(self.target)],
+            ["/D", "/e", "/A/B", "/A/C"],
+        )
+
+    def test_size_and_access_time(self):
+        os.utime(str(self.root / "A" / "B" / "y"), (1000, 1000))
+        os.utime(str(self.root / "A" / "B"), (10, 10))
+        self.target.include("A/B")
+
+        candidate, = cache.iter_candidates(self.target)
+        self.assertEqual(candidate.relpath, "/A/B/y")
+        self.assertGreater(candidate.size, 0)
+        self.assertEqual(candidate.last_access, 1000)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
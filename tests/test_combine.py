@@ -0,0 +1,120 @@
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.combine as combine
+import offlinecopy_impl.config as config
+import offlinecopy_impl.main as main
+import offlinecopy_impl.target as target
+
+
+class Testget_roots(unittest.TestCase):
+    def test_roots(self):
+        self.assertEqual(
+            combine.get_roots(target.Target("remote:/data/me/Music/",
+                                            "/home/me/Music")),
+            ("remote:/data/me/", pathlib.Path("/home/me")),
+        )
+        self.assertEqual(
+            combine.get_roots(target.Target("/srv/Music/", "/home/me/Music")),
+            ("/srv/", pathlib.Path("/home/me")),
+        )
+
+    def test_not_combinable(self):
+        for src, dest in [("remote:/data/me/Music", "/home/me/Music"),
+                          ("remote:/data/me/Songs/", "/home/me/Music"),
+                          ("remote:Music/", "/home/me/Music")]:
+            self.assertIsNone(combine.get_roots(target.Target(src, dest)),
+                              src)
+
+
+class Testgroup(unittest.TestCase):
+    def test_group(self):
+        targets = [
+            target.Target("remote:/data/me/{}/".format(name),
+                          "/home/me/{}".format(name))
+            for name in ["Music", "Pictures", "Videos"]
+        ]
+        targets.append(target.Target("other:/data/me/Documents/",
+                                     "/home/me/Documents"))
+        targets.append(target.Target("remote:/data/me/Songs/",
+                                     "/home/me/Songs/x"))
+
+        self.assertSequenceEqual(
+            combine.group(targets),
+            [targets[:3], targets[3:4], targets[4:5]],
+        )
+        self.assertSequenceEqual(
+            combine.group(targets[:3],
+                          key=lambda t: t.dest.name == "Videos"),
+            [targets[:2], targets[2:3]],
+        )
+
+
+class Testcombine(unittest.TestCase):
+    def test_rules(self):
+        music = target.Target("remote:/data/me/Music/", "/home/me/Music")
+        music.include("")
+        music.evict("Old")
+        pictures = target.Target("remote:/data/me/Pictures/",
+                                 "/home/me/Pictures")
+        pictures.include("2020", target.Selection(("*.jpg",), None))
+
+        combined = combine.combine([pictures, music])
+
+        self.assertEqual(combined.src, "remote:/data/me/")
+        self.assertEqual(combined.dest, pathlib.Path("/home/me"))
+        self.assertSequenceEqual(
+            list(combined.iter_filter_rules()),
+            [
+                ("-", "Music/Old"),
+                ("+", "Music"),
+                ("+", "Pictures/2020/**/"),
+                ("+", "Pictures/2020/*.jpg"),
+                ("+", "Pictures/2020/**/*.jpg"),
+                ("-", "Pictures/2020/**"),
+                ("+", "Pictures/2020"),
+                ("-", "Pictures/*"),
+                ("+", "Pictures"),
+                ("-", "*"),
+            ]
+        )
+        for t in [music, pictures]:
+            self.assertEqual(
+                combined.subtarget(t.dest.name).rules.digest(),
+                t.rules.digest(),
+            )
+
+    def test_different_roots(self):
+        with self.assertRaises(ValueError):
+            combine.combine([
+                target.Target("remote:/data/me/Music/", "/home/me/Music"),
+                target.Target("remote:/data/you/Music/", "/home/you/Music"),
+            ])
+
+
+class Testget_combined_units(unittest.TestCase):
+    def test_units(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = pathlib.Path(tmpdir)
+            targets = []
+            for name in ["A", "B", "C"]:
+                (root / name).mkdir()
+                targets.append(target.Target("remote:/x/{}/".format(name),
+                                             root / name))
+            cfg = config.Config(main.read_config(root / "missing"))
+            scopes = [(targets[0], ""), (targets[1], "/sub"),
+                      (targets[2], "")]
+
+            with unittest.mock.patch(
+                    "offlinecopy_impl.main.get_transport_profile",
+                    lambda t: main.transport.Profile()):
+                units = main.get_combined_units(cfg, scopes)
+
+            # subtree pushes are not combined
+            self.assertSequenceEqual(
+                units,
+                [((targets[0], ""), (targets[2], "")),
+                 ((targets[1], "/sub"),)],
+            )
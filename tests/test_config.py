@@ -6,7 +6,9 @@ import unittest.mock
 import lxml.etree
 
 import offlinecopy_impl.config as config
+import offlinecopy_impl.schedule as schedule
 import offlinecopy_impl.target as target
+import offlinecopy_impl.transport as transport
 
 
 class Testextract_flat_nodes(unittest.TestCase):
@@ -63,6 +65,88 @@ class Testembed_flat_nodes(unittest.TestCase):
         )
 
 
+class Testmirrors(unittest.TestCase):
+    def test_round_trip(self):
+        subtree = config.E.target()
+
+        config.embed_mirrors(subtree, ["a:/x/", "b:/x/"])
+        config.embed_flat_nodes(subtree, [(target.State.EVICTED, "")])
+
+        self.assertSequenceEqual(
+            list(config.extract_mirrors(subtree)),
+            ["a:/x/", "b:/x/"],
+        )
+        self.assertSequenceEqual(
+            list(config.extract_flat_nodes(subtree)),
+            [(target.State.EVICTED, "")],
+        )
+
+
+class Testselections(unittest.TestCase):
+    def test_round_trip(self):
+        selections = [
+            (target.Selection(("*.pdf", "*.txt"), None), "Docs"),
+            (target.Selection((), 1024), "Media/Photos"),
+        ]
+        subtree = config.E.target()
+
+        config.embed_selections(subtree, selections)
+
+        self.assertSequenceEqual(list(config.extract_selections(subtree)),
+                                 selections)
+
+    def test_load(self):
+        t = target.Target("host:/x/", "/x")
+        t.include("Docs", target.Selection(("*.pdf",), 1024))
+        subtree = config.E.targets()
+
+        config.save_targets(subtree, [t])
+        loaded, = config.load_targets(subtree)
+
+        self.assertEqual(loaded.get_selection("Docs/a"),
+                         target.Selection(("*.pdf",), 1024))
+        self.assertEqual(loaded.rules.digest(), t.rules.digest())
+
+
+class Testtransport(unittest.TestCase):
+    def test_round_trip(self):
+        profile = transport.Profile(
+            compress=transport.Setting.AUTO,
+            xattrs=transport.Setting.NO,
+            checksum_choice="xxh128",
+        )
+        subtree = config.E.target()
+
+        config.embed_transport(subtree, profile)
+
+        self.assertEqual(config.extract_transport(subtree), profile)
+
+    def test_missing(self):
+        subtree = config.E.target()
+
+        config.embed_transport(subtree, None)
+
+        self.assertIsNone(config.extract_transport(subtree))
+
+
+class Testschedule(unittest.TestCase):
+    def test_round_trip(self):
+        sched = schedule.Schedule(3600,
+                                  [(22 * 60, 6 * 60), (12 * 60, 13 * 60)])
+        subtree = config.E.target()
+
+        config.embed_schedule(subtree, sched)
+
+        self.assertEqual(config.extract_schedule(subtree), sched)
+
+    def test_missing(self):
+        subtree = config.E.target()
+
+        config.embed_schedule(subtree, None)
+
+        self.assertIsNone(config.extract_schedule(subtree))
+
+
 class Testload_targets(unittest.TestCase):
     def test_load_targets_from_etree(self):
         target1 = config.E.target(
@@ -86,6 +170,10 @@ class Testload_targets(unittest.TestCase):
                 "offlinecopy_impl.config.extract_flat_nodes",
                 new=base.extract_flat_nodes,
             ))
+            extract_selections = stack.enter_context(unittest.mock.patch(
+                "offlinecopy_impl.config.extract_selections",
+                new=base.extract_selections,
+            ))
             Target = stack.enter_context(unittest.mock.patch(
                 "offlinecopy_impl.target.Target",
                 new=base.Target,
@@ -99,13 +187,17 @@ class Testload_targets(unittest.TestCase):
             [
                 unittest.mock.call.Target("foo", "bar"),
                 unittest.mock.call.extract_flat_nodes(target1),
+                unittest.mock.call.extract_selections(target1),
                 unittest.mock.call.Target().from_flat_nodes(
                     extract_flat_nodes(),
+                    extract_selections(),
                 ),
                 unittest.mock.call.Target("baz", "fnord"),
                 unittest.mock.call.extract_flat_nodes(target2),
+                unittest.mock.call.extract_selections(target2),
                 unittest.mock.call.Target().from_flat_nodes(
-                    extract_flat_nodes()
+                    extract_flat_nodes(),
+                    extract_selections(),
                 )
             ]
         )
@@ -126,16 +218,28 @@ class Testsave_targets(unittest.TestCase):
         target1 = base.target1
         target1.src = "foo"
         target1.dest = pathlib.Path("bar")
+        target1.budget = None
+        target1.mirrors = []
+        target1.transport = None
+        target1.schedule = None
 
         target2 = base.target2
         target2.src = "baz"
         target2.dest = pathlib.Path("fnord")
+        target2.budget = None
+        target2.mirrors = []
+        target2.transport = None
+        target2.schedule = None
 
         with contextlib.ExitStack() as stack:
             embed_flat_nodes = stack.enter_context(unittest.mock.patch(
                 "offlinecopy_impl.config.embed_flat_nodes",
                 new=base.embed_flat_nodes
             ))
+            embed_selections = stack.enter_context(unittest.mock.patch(
+                "offlinecopy_impl.config.embed_selections",
+                new=base.embed_selections
+            ))
             E = stack.enter_context(unittest.mock.patch(
                 "offlinecopy_impl.config.E",
                 new=base.E
@@ -153,6 +257,11 @@ class Testsave_targets(unittest.TestCase):
                     E.target(),
                     target1.iter_flat_nodes()
                 ),
+                unittest.mock.call.target1.iter_selections(),
+                unittest.mock.call.embed_selections(
+                    E.target(),
+                    target1.iter_selections()
+                ),
                 unittest.mock.call.parent_.append(E.target()),
                 unittest.mock.call.E.target(src="baz", dest="fnord"),
                 unittest.mock.call.target2.iter_flat_nodes(),
@@ -160,6 +269,141 @@ class Testsave_targets(unittest.TestCase):
                     E.target(),
                     target2.iter_flat_nodes()
                 ),
+                unittest.mock.call.target2.iter_selections(),
+                unittest.mock.call.embed_selections(
+                    E.target(),
+                    target2.iter_selections()
+                ),
                 unittest.mock.call.parent_.append(E.target()),
             ]
         )
+
+
+class TestConfig(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(config.Config.parse_size("123"), 123)
+        self.assertEqual(config.Config.parse_size("2K"), 2048)
+        self.assertEqual(config.Config.parse_size("1.5m"), 1572864)
+        self.assertEqual(config.Config.parse_size("1G"), 1024**3)
+
+    def test_parse_size_rejects_garbage(self):
+        with self.assertRaises(ValueError):
+            config.Config.parse_size("foo")
+        with self.assertRaises(ValueError):
+            config.Config.parse_size("-1")
+
+
+class Testmerge_targets(unittest.TestCase):
+    def load(self, *targets):
+        # simulate loading the same file in two processes
+        def copy(t):
+            result = target.Target(t.src, t.dest)
+            result.from_flat_nodes(t.iter_flat_nodes(), t.iter_selections())
+            result.budget = t.budget
+            result.mirrors = list(t.mirrors)
+            return result
+
+        return (config.TargetList(map(copy, targets)),
+                config.TargetList(map(copy, targets)))
+
+    def setUp(self):
+        self.t1 = target.Target("host:/one/", "/one")
+        self.t1.include("A")
+        self.t2 = target.Target("host:/two/", "/two")
+
+    def test_rule_changes(self):
+        ours, theirs = self.load(self.t1, self.t2)
+        ours[0].include("B")
+        ours[0].evict("A/x")
+        theirs[0].include("C")
+        theirs[1].include("D")
+
+        config.merge_targets(ours, theirs)
+
+        self.assertEqual(len(ours), 2)
+        for path, state in [("A", target.State.INCLUDED),
+                            ("A/x", target.State.EVICTED),
+                            ("B", target.State.INCLUDED),
+                            ("C", target.State.INCLUDED),
+                            ("E", target.State.EVICTED)]:
+            self.assertEqual(ours[0].get_state(path), state, path)
+        self.assertEqual(ours[1].get_state("D"), target.State.INCLUDED)
+
+    def test_conflict_ours_wins(self):
+        ours, theirs = self.load(self.t1)
+        ours[0].evict("A")
+        theirs[0].include("A/B")
+
+        config.merge_targets(ours, theirs)
+
+        self.assertEqual(ours[0].get_state("A/B"), target.State.EVICTED)
+
+    def test_selections(self):
+        ours, theirs = self.load(self.t1)
+        pdf = target.Selection(("*.pdf",), None)
+        ours[0].include("A", pdf)
+        theirs[0].include("B", target.Selection((), 1024))
+
+        config.merge_targets(ours, theirs)
+
+        self.assertEqual(ours[0].get_selection("A"), pdf)
+        self.assertEqual(ours[0].get_selection("B"),
+                         target.Selection((), 1024))
+
+    def test_keeps_identity(self):
+        ours, theirs = self.load(self.t1)
+        t = ours[0]
+        theirs[0].include("B")
+
+        config.merge_targets(ours, theirs)
+
+        self.assertIs(ours[0], t)
+        self.assertEqual(t.get_state("B"), target.State.INCLUDED)
+
+    def test_settings(self):
+        ours, theirs = self.load(self.t1)
+        ours[0].budget = 1000
+        theirs[0].mirrors.append("mirror:/one/")
+        theirs[0].src = "other:/one/"
+        theirs[0].schedule = schedule.Schedule(600)
+
+        config.merge_targets(ours, theirs)
+
+        self.assertEqual(ours[0].schedule, schedule.Schedule(600))
+
+        self.assertEqual(ours[0].budget, 1000)
+        self.assertSequenceEqual(ours[0].mirrors, ["mirror:/one/"])
+        self.assertEqual(ours[0].src, "other:/one/")
+
+    def test_added_and_removed_targets(self):
+        ours, theirs = self.load(self.t1, self.t2)
+        ours.remove(ours[0])
+        ours.append(target.Target("host:/three/", "/three"))
+        theirs.append(target.Target("host:/four/", "/four"))
+
+        config.merge_targets(ours, theirs)
+
+        self.assertSequenceEqual(
+            [str(t.dest) for t in ours],
+            ["/two", "/three", "/four"],
+        )
+
+    def test_removed_by_them(self):
+        ours, theirs = self.load(self.t1, self.t2)
+        ours[1].include("X")
+        del theirs[:]
+
+        config.merge_targets(ours, theirs)
+
+        self.assertSequenceEqual([str(t.dest) for t in ours], ["/two"])
+
+    def test_baseline_is_reset(self):
+        ours, theirs = self.load(self.t1)
+        ours[0].include("B")
+        config.merge_targets(ours, theirs)
+
+        _, fresh = self.load(self.t1)
+        config.merge_targets(ours, fresh)
+
+        # our change has been merged before and is not applied again
+        self.assertEqual(ours[0].get_state("B"), target.State.EVICTED)
@@ -0,0 +1,139 @@
+import asyncio
+import io
+import subprocess
+import sys
+import time
+import unittest
+
+import offlinecopy_impl.engine as engine
+
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+
+class TestLinePrefixer(unittest.TestCase):
+    def test_prefix(self):
+        prefixer = engine.LinePrefixer(b"> ")
+        self.assertEqual(prefixer(b"a\nb"), b"> a\n> b")
+        self.assertEqual(prefixer(b"c\rd\n"), b"c\r> d\n")
+        self.assertEqual(prefixer(b"e"), b"> e")
+
+
+class TestTrailerCutter(unittest.TestCase):
+    def test_cut(self):
+        cutter = engine.TrailerCutter(b"Total: ")
+        self.assertEqual(cutter(b"a\n\nb\n\n"), b"a\n\nb\n")
+        self.assertEqual(cutter(b"To"), b"")
+        self.assertEqual(cutter(b"tal: 3\nc\n"), b"")
+        self.assertEqual(cutter(b"d\n"), b"")
+        self.assertEqual(cutter.flush(), b"")
+
+    def test_no_trailer(self):
+        cutter = engine.TrailerCutter(b"Total: ")
+        self.assertEqual(cutter(b"a\n\nTo"), b"a\n")
+        self.assertEqual(cutter(b"p\rTotal"), b"\nTop\r")
+        self.assertEqual(cutter(b" 3\n"), b"Total 3\n")
+        self.assertEqual(cutter(b"\nTo"), b"")
+        self.assertEqual(cutter.flush(), b"\nTo")
+
+
+class Testrun(unittest.TestCase):
+    def setUp(self):
+        self.stdout = io.BytesIO()
+        self.stderr = io.BytesIO()
+
+    def run_cmd(self, cmd, **kwargs):
+        return asyncio.run(engine.run(cmd,
+                                      stdout=self.stdout,
+                                      stderr=self.stderr,
+                                      **kwargs))
+
+    def test_output(self):
+        tail = self.run_cmd(python(
+            "import sys; print('out'); print('err', file=sys.stderr)"
+        ), prefix="[x] ")
+
+        self.assertEqual(tail, "out\n")
+        self.assertEqual(self.stdout.getvalue(), b"[x] out\n")
+        self.assertEqual(self.stderr.getvalue(), b"[x] err\n")
+
+    def test_hide_from(self):
+        tail = self.run_cmd(python(
+            "print('out'); print(); print('Total: 1'); print('more')"
+        ), hide_from=b"Total: ")
+
+        self.assertEqual(tail, "out\n\nTotal: 1\nmore\n")
+        self.assertEqual(self.stdout.getvalue(), b"out\n")
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            self.run_cmd(python("import sys; sys.exit(23)"))
+        self.assertEqual(ctx.exception.returncode, 23)
+
+    def test_stall_timeout(self):
+        t0 = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired) as ctx:
+            self.run_cmd(
+                python("import time; print('x', flush=True); time.sleep(30)"),
+                stall_timeout=0.5,
+            )
+        self.assertLess(time.monotonic() - t0, 10)
+        self.assertEqual(ctx.exception.timeout, 0.5)
+        self.assertEqual(self.stdout.getvalue(), b"x\n")
+
+    def test_active_process_does_not_stall(self):
+        self.run_cmd(
+            python("import time\n"
+                   "for i in range(5):\n"
+                   "    print(i, flush=True)\n"
+                   "    time.sleep(0.2)\n"),
+            stall_timeout=0.5,
+        )
+
+    def test_timeout(self):
+        with self.assertRaises(subprocess.TimeoutExpired) as ctx:
+            self.run_cmd(
+                python("import time\n"
+                       "while True:\n"
+                       "    print('x', flush=True)\n"
+                       "    time.sleep(0.1)\n"),
+                stall_timeout=5,
+                timeout=0.5,
+            )
+        self.assertEqual(ctx.exception.timeout, 0.5)
+
+    def test_cancel_terminates_child(self):
+        async def test():
+            task = asyncio.ensure_future(engine.run(
+                python("import time; time.sleep(30)"),
+                stdout=self.stdout,
+                stderr=self.stderr,
+            ))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        t0 = time.monotonic()
+        asyncio.run(test())
+        self.assertLess(time.monotonic() - t0, 10)
+
+
+class Testgather_limited(unittest.TestCase):
+    def test_limit_and_errors(self):
+        running = [0, 0]
+
+        async def job(i):
+            running[0] += 1
+            running[1] = max(running)
+            await asyncio.sleep(0.01)
+            running[0] -= 1
+            if i == 1:
+                raise ValueError(i)
+            return i
+
+        with self.assertRaises(ValueError):
+            asyncio.run(engine.gather_limited([job(i) for i in range(6)], 2))
+        self.assertEqual(running[1], 2)
+        self.assertEqual(running[0], 0)
@@ -0,0 +1,300 @@
+import itertools
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import offlinecopy_impl.filters as filters
+import offlinecopy_impl.target as target
+
+
+class Testparse_filter_rules(unittest.TestCase):
+    def test_parse(self):
+        self.assertSequenceEqual(
+            list(filters.parse_filter_rules([
+                "# comment\n",
+                "\n",
+                "+ /A/B/\n",
+                "- /A/*\n",
+                "exclude /C\n",
+                "- /*\n",
+            ])),
+            [
+                ("+", ("A", "B"), False),
+                ("-", ("A",), True),
+                ("-", ("C",), False),
+                ("-", (), True),
+            ]
+        )
+
+    def test_reject_unanchored(self):
+        with self.assertRaisesRegex(ValueError, "line 1"):
+            list(filters.parse_filter_rules(["- foo"]))
+
+    def test_reject_wildcards(self):
+        with self.assertRaisesRegex(ValueError, "line 2"):
+            list(filters.parse_filter_rules(["- /foo", "- /*.tmp"]))
+
+    def test_reject_modifiers(self):
+        with self.assertRaises(ValueError):
+            list(filters.parse_filter_rules(["-! /foo"]))
+
+
+class Testflat_nodes_from_filter_rules(unittest.TestCase):
+    def import_rules(self, lines):
+        t = target.Target("src/", "dest")
+        t.from_flat_nodes(filters.flat_nodes_from_filter_rules(
+            filters.parse_filter_rules(lines)
+        ))
+        return t
+
+    def test_first_match_wins(self):
+        t = self.import_rules([
+            "- /A/B",
+            "+ /A/B",
+            "+ /A/C",
+            "- /A/*",
+        ])
+
+        self.assertSequenceEqual(
+            list(t.iter_flat_nodes()),
+            [
+                (target.State.INCLUDED, ""),
+                (target.State.EVICTED, "A"),
+                (target.State.INCLUDED, "A/C"),
+            ]
+        )
+
+    def test_excluded_directory_hides_contents(self):
+        t = self.import_rules([
+            "+ /A/B",
+            "- /A",
+        ])
+
+        self.assertSequenceEqual(
+            list(t.iter_flat_nodes()),
+            [
+                (target.State.INCLUDED, ""),
+                (target.State.EVICTED, "A"),
+            ]
+        )
+
+    def test_round_trip(self):
+        segments = ["A", "B", "C"]
+        for seed in range(200):
+            rng = random.Random(seed)
+            original = target.Target("src/", "dest")
+            for _ in range(rng.randint(1, 15)):
+                path = "/".join(rng.choice(segments)
+                                for _ in range(rng.randint(0, 4)))
+                if rng.random() < 0.5:
+                    original.include(path)
+                else:
+                    original.evict(path)
+
+            imported = self.import_rules(
+                "{} /{}".format(mode, rule)
+                for mode, rule in original.iter_filter_rules()
+            )
+
+            for depth in range(5):
+                for parts in itertools.product(segments + ["D"],
+                                               repeat=depth):
+                    path = "/".join(parts)
+                    self.assertEqual(
+                        imported.get_state(path),
+                        original.get_state(path),
+                        "seed {}, path {!r}".format(seed, path),
+                    )
+
+
+class Testflat_nodes_from_path_list(unittest.TestCase):
+    def test_paths(self):
+        self.assertSequenceEqual(
+            list(filters.flat_nodes_from_path_list([
+                "B/C\n",
+                "\n",
+                "/A/\n",
+            ])),
+            [
+                (target.State.EVICTED, ""),
+                (target.State.INCLUDED, "A"),
+                (target.State.INCLUDED, "B/C"),
+            ]
+        )
+
+    def test_root(self):
+        self.assertSequenceEqual(
+            list(filters.flat_nodes_from_path_list(["A", "/"])),
+            [
+                (target.State.INCLUDED, ""),
+            ]
+        )
+
+
+def random_target(rng, segments):
+    t = target.Target("src/", "dest")
+    for _ in range(rng.randint(1, 15)):
+        path = "/".join(rng.choice(segments)
+                        for _ in range(rng.randint(0, 4)))
+        if rng.random() < 0.5:
+            t.include(path)
+        else:
+            t.evict(path)
+    return t
+
+
+def rsync_reference(rules, parts):
+    # straightforward evaluation of rsync's semantics: every parent
+    # directory and the path itself are matched against the rules in order
+    # and the first matching rule decides; excluded directories are not
+    # descended into
+    for i in range(1, len(parts)+1):
+        prefix = parts[:i]
+        for mode, rule_parts, star in rules:
+            if star:
+                matches = prefix[:-1] == rule_parts
+            else:
+                matches = prefix == rule_parts
+            if matches:
+                if mode == "-":
+                    return target.State.EVICTED
+                break
+    return target.State.INCLUDED
+
+
+def all_paths(segments, max_depth=4):
+    for depth in range(max_depth+1):
+        yield from itertools.product(segments + ["D"], repeat=depth)
+
+
+class TestMatcher(unittest.TestCase):
+    segments = ["A", "B", "C"]
+
+    def test_traversed_directories(self):
+        t = target.Target("src/", "dest")
+        t.include("A/B")
+        matcher = filters.Matcher.from_target(t)
+
+        self.assertEqual(matcher.classify("A"), target.State.INCLUDED)
+        self.assertEqual(matcher.classify("A/B/x"), target.State.INCLUDED)
+        self.assertEqual(matcher.classify("A/C"), target.State.EVICTED)
+        self.assertEqual(matcher.classify("D/B"), target.State.EVICTED)
+
+    def test_selections(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "A", "sub"))
+            with open(os.path.join(tmp, "A", "big.pdf"), "w") as f:
+                f.write("x" * 100)
+            t = target.Target("src/", tmp)
+            t.include("A", target.Selection(("*.pdf",), None))
+            t.include("C", target.Selection((), 10))
+            matcher = filters.Matcher.from_target(t)
+
+            self.assertEqual(matcher.classify("A/x.txt"),
+                             target.State.EVICTED)
+            self.assertEqual(matcher.classify("A/sub/x.pdf"),
+                             target.State.INCLUDED)
+            # directories are traversed regardless of their name
+            self.assertEqual(matcher.classify("A/sub"),
+                             target.State.INCLUDED)
+            self.assertEqual(matcher.classify("B"), target.State.EVICTED)
+            self.assertEqual(matcher.classify("C/missing"),
+                             target.State.INCLUDED)
+
+            t.include("A", target.Selection(("*.pdf",), 10))
+            matcher = filters.Matcher.from_target(t)
+            self.assertEqual(matcher.classify("A/big.pdf"),
+                             target.State.EVICTED)
+
+    def test_no_rules(self):
+        matcher = filters.Matcher([])
+        self.assertEqual(matcher.classify("A/B"), target.State.INCLUDED)
+
+    def test_matches_reference(self):
+        for seed in range(200):
+            rng = random.Random(seed)
+            t = random_target(rng, self.segments)
+            rules = list(filters.parse_filter_rules(
+                "{} /{}".format(mode, rule)
+                for mode, rule in t.iter_filter_rules()
+            ))
+
+            paths = list(all_paths(self.segments))
+            rng.shuffle(paths)
+            # half of the paths in random order, the rest sorted, to cover
+            # both fresh walks and shared prefixes
+            paths[len(paths)//2:] = sorted(paths[len(paths)//2:])
+
+            matcher = filters.Matcher(rules)
+            for parts in paths:
+                self.assertEqual(
+                    matcher.classify_parts(parts),
+                    rsync_reference(rules, parts),
+                    "seed {}, path {!r}".format(seed, parts),
+                )
+
+    def test_consistent_with_rule_tree(self):
+        # included paths are transferred, evicted paths only if they are
+        # directories which have to be traversed to reach nodes below them
+        for seed in range(200):
+            rng = random.Random(seed)
+            t = random_target(rng, self.segments)
+            matcher = filters.Matcher.from_target(t)
+
+            for parts in all_paths(self.segments):
+                if not parts:
+                    # the root directory itself is always transferred
+                    continue
+                path = "/".join(parts)
+                node, subpath = t.rules.get_node(path)
+                expected = (
+                    node.get_state() == target.State.INCLUDED or
+                    (not subpath and bool(node.childmap))
+                )
+                self.assertEqual(
+                    matcher.classify(path) == target.State.INCLUDED,
+                    expected,
+                    "seed {}, path {!r}".format(seed, path),
+                )
+
+
+@unittest.skipUnless(shutil.which("rsync"), "rsync is not available")
+class TestMatcherMatchesRsync(unittest.TestCase):
+    segments = ["A", "B", "C"]
+
+    def test_rsync(self):
+        for seed in range(20):
+            rng = random.Random(seed)
+            t = random_target(rng, self.segments)
+            matcher = filters.Matcher.from_target(t)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                src = os.path.join(tmp, "src")
+                dest = os.path.join(tmp, "dest")
+                for parts in all_paths(self.segments, 3):
+                    os.makedirs(os.path.join(src, *parts), exist_ok=True)
+                    with open(os.path.join(src, *parts, "f"), "w"):
+                        pass
+                with open(os.path.join(tmp, "rules"), "w") as f:
+                    for mode, rule in t.iter_filter_rules():
+                        print("{} /{}".format(mode, rule), file=f)
+
+                subprocess.check_call([
+                    "rsync", "-r",
+                    "--filter", ". {}".format(os.path.join(tmp, "rules")),
+                    src + "/", dest,
+                ])
+
+                for dirpath, dirnames, filenames in os.walk(src):
+                    for name in dirnames + filenames:
+                        relpath = os.path.relpath(
+                            os.path.join(dirpath, name), src)
+                        self.assertEqual(
+                            matcher.classify(relpath) ==
+                            target.State.INCLUDED,
+                            os.path.lexists(os.path.join(dest, relpath)),
+                            "seed {}, path {!r}".format(seed, relpath),
+                        )
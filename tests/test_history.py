@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import offlinecopy_impl.history as history
+
+
+class Testappend(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "history.jsonl")
+
+    def test_round_trip(self):
+        history.append(self.path, {"target": "/a", "duration": 1})
+        history.append(self.path, {"target": "/b", "duration": 2})
+
+        self.assertSequenceEqual(
+            history.read(self.path),
+            [
+                {"target": "/a", "duration": 1},
+                {"target": "/b", "duration": 2},
+            ]
+        )
+        self.assertSequenceEqual(
+            history.read(self.path, target="/b"),
+            [
+                {"target": "/b", "duration": 2},
+            ]
+        )
+
+    def test_skips_truncated_records(self):
+        history.append(self.path, {"target": "/a"})
+        with open(self.path, "a") as f:
+            f.write('{"target": "/')
+
+        self.assertSequenceEqual(
+            history.read(self.path),
+            [{"target": "/a"}],
+        )
+
+    def test_missing(self):
+        self.assertSequenceEqual(history.read(self.path), [])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class Testpercentile(unittest.TestCase):
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(history.percentile(values, 50), 3)
+        self.assertEqual(history.percentile(values, 90), 5)
+        self.assertEqual(history.percentile(values, 0), 1)
+        self.assertIsNone(history.percentile([], 50))
+
+
+class Testtrend(unittest.TestCase):
+    def test_growing(self):
+        records = [
+            {"time": day * 86400, "duration": 10 + 2 * day}
+            for day in range(5)
+        ]
+        self.assertAlmostEqual(history.trend(records), 2)
+
+    def test_insufficient(self):
+        self.assertIsNone(history.trend([{"time": 0, "duration": 1}]))
+        self.assertIsNone(history.trend([
+            {"time": 0, "duration": 1},
+            {"time": 0, "duration": 2},
+        ]))
+
+
+class Testexpected_duration(unittest.TestCase):
+    def test_median_of_successful_pushes(self):
+        records = [
+            {"direction": "push", "status": 0, "duration": 10},
+            {"direction": "push", "status": 23, "duration": 1000},
+            {"direction": "revert", "status": 0, "duration": 1000},
+            {"direction": "push", "status": 0, "duration": 30},
+            {"direction": "push", "status": 0, "duration": 20},
+        ]
+        self.assertEqual(history.expected_duration(records), 20)
+
+    def test_unknown(self):
+        self.assertIsNone(history.expected_duration([]))
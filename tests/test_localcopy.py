@@ -0,0 +1,257 @@
+import os
+import pathlib
+import random
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+
+import offlinecopy_impl.localcopy as localcopy
+import offlinecopy_impl.rulefiles as rulefiles
+import offlinecopy_impl.target as target
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        f.write(data)
+
+
+def snapshot(root):
+    # everything rsync -a would preserve and which is comparable across trees
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(str(root)):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            relpath = os.path.relpath(path, str(root))
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                result[relpath] = ("link", os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                result[relpath] = ("dir", stat.S_IMODE(st.st_mode))
+            else:
+                with open(path) as f:
+                    data = f.read()
+                result[relpath] = ("file", stat.S_IMODE(st.st_mode),
+                                   st.st_mtime_ns, data)
+    return result
+
+
+class Testis_local_source(unittest.TestCase):
+    def test_local(self):
+        self.assertTrue(localcopy.is_local_source("/srv/data/"))
+        self.assertTrue(localcopy.is_local_source("relative/path"))
+        self.assertTrue(localcopy.is_local_source("/srv/a:b"))
+
+    def test_remote(self):
+        self.assertFalse(localcopy.is_local_source("host:/srv/data/"))
+        self.assertFalse(localcopy.is_local_source("host::module/"))
+        self.assertFalse(localcopy.is_local_source("rsync://host/module/"))
+
+
+class LocalCopyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.src = self.root / "src"
+        self.dest = self.root / "dest"
+        self.src.mkdir()
+        self.dest.mkdir()
+
+        for path in ["a", "B/b", "B/C/c", "B/C/D/d", "E/e"]:
+            write(self.src / path, path)
+        os.symlink("B", str(self.src / "link"))
+
+        self.target = target.Target(str(self.src), self.dest)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def copy(self, relpath="", **kwargs):
+        copier = localcopy.Copier(self.target.rules,
+                                  self.src, self.dest,
+                                  **kwargs)
+        return copier.run(relpath)
+
+
+class TestCopier(LocalCopyTestCase):
+    def test_copy_included(self):
+        self.target.include("")
+        self.target.evict("B/C")
+        self.target.include("B/C/D")
+
+        self.copy()
+
+        self.assertSetEqual(
+            set(snapshot(self.dest)),
+            {"a", "B", "B/b", "B/C", "B/C/D", "B/C/D/d", "E", "E/e", "link"},
+        )
+        self.assertEqual(snapshot(self.dest)["link"], ("link", "B"))
+
+    def test_preserves_metadata(self):
+        self.target.include("")
+        os.chmod(str(self.src / "a"), 0o600)
+        os.utime(str(self.src / "a"), ns=(0, 1234567890123456789))
+        os.utime(str(self.src / "B"), ns=(0, 1000000000000000000))
+
+        self.copy()
+
+        st = os.stat(str(self.dest / "a"))
+        self.assertEqual(stat.S_IMODE(st.st_mode), 0o600)
+        self.assertEqual(st.st_mtime_ns, 1234567890123456789)
+        self.assertEqual(os.stat(str(self.dest / "B")).st_mtime_ns,
+                         1000000000000000000)
+
+    def test_quick_check_skips_unchanged(self):
+        self.target.include("")
+
+        self.assertEqual(self.copy()["files"], 6)
+        self.assertEqual(self.copy()["files"], 0)
+
+        write(self.src / "B/b", "changed")
+        stats = self.copy()
+        self.assertEqual(stats["files"], 1)
+        self.assertEqual(stats["bytes"], len("changed"))
+
+    def test_delete_extraneous(self):
+        self.target.include("")
+        write(self.dest / "B/extra", "x")
+        write(self.dest / "F/f", "x")
+
+        stats = self.copy()
+
+        self.assertEqual(stats["deleted"], 2)
+        self.assertFalse((self.dest / "B/extra").exists())
+        self.assertFalse((self.dest / "F").exists())
+
+    def test_no_delete(self):
+        self.target.include("")
+        write(self.dest / "B/extra", "x")
+
+        self.copy(delete=False)
+
+        self.assertTrue((self.dest / "B/extra").exists())
+
+    def test_excluded_paths_are_protected(self):
+        self.target.include("")
+        self.target.evict("B/C")
+        write(self.dest / "B/C/local", "x")
+        write(self.dest / "B/C/c", "different")
+
+        self.copy()
+
+        self.assertEqual((self.dest / "B/C/local").read_text(), "x")
+        self.assertEqual((self.dest / "B/C/c").read_text(), "different")
+
+    def test_delete_below_traversed_directory(self):
+        self.target.include("B/C")
+        write(self.dest / "B/C/extra", "x")
+        write(self.dest / "B/other", "x")
+
+        self.copy()
+
+        self.assertFalse((self.dest / "B/C/extra").exists())
+        self.assertTrue((self.dest / "B/other").exists())
+
+    def test_type_change(self):
+        self.target.include("")
+        write(self.dest / "a/x", "x")
+        write(self.dest / "E", "x")
+
+        self.copy()
+
+        self.assertEqual((self.dest / "a").read_text(), "a")
+        self.assertEqual((self.dest / "E/e").read_text(), "E/e")
+
+    def test_hardlinks(self):
+        self.target.include("")
+        os.link(str(self.src / "B/b"), str(self.src / "E/b"))
+
+        self.copy()
+
+        self.assertEqual(
+            os.stat(str(self.dest / "B/b")).st_ino,
+            os.stat(str(self.dest / "E/b")).st_ino,
+        )
+
+    def test_subtree_ignore_existing(self):
+        self.target.include("B")
+        write(self.dest / "B/b", "local")
+
+        self.copy("/B", delete=False, ignore_existing=True)
+
+        self.assertEqual((self.dest / "B/b").read_text(), "local")
+        self.assertEqual((self.dest / "B/C/c").read_text(), "B/C/c")
+        self.assertFalse((self.dest / "a").exists())
+
+    def test_dry_run(self):
+        self.target.include("")
+        write(self.dest / "extra", "x")
+        actions = []
+
+        self.copy(dry_run=True, log=lambda *args: actions.append(args))
+
+        self.assertSetEqual(set(snapshot(self.dest)), {"extra"})
+        self.assertIn(("copy", "a"), actions)
+        self.assertIn(("delete", "extra"), actions)
+
+    def test_partial_transfer(self):
+        self.target.include("")
+        os.chmod(str(self.src / "a"), 0)
+        if os.access(str(self.src / "a"), os.R_OK):
+            self.skipTest("permissions are not enforced")
+
+        with self.assertRaises(localcopy.PartialTransferError):
+            self.copy()
+
+        self.assertEqual((self.dest / "E/e").read_text(), "E/e")
+
+
+@unittest.skipUnless(shutil.which("rsync"), "rsync is not available")
+class TestCopierMatchesRsync(LocalCopyTestCase):
+    def random_tree(self, rng, root):
+        names = ["A", "B", "C", "d", "e"]
+        for _ in range(30):
+            parts = [rng.choice(names) for _ in range(rng.randint(1, 4))]
+            path = root.joinpath(*parts)
+            if any(p.exists() and not p.is_dir() for p in path.parents):
+                continue
+            if path.exists():
+                continue
+            write(path, str(rng.random()))
+            os.utime(str(path), ns=(0, rng.randint(1, 3) * 10**18))
+
+    def test_random(self):
+        rng = random.Random(36)
+        for _ in range(20):
+            for path in [self.src, self.dest]:
+                shutil.rmtree(str(path))
+                path.mkdir()
+            self.random_tree(rng, self.src)
+            self.random_tree(rng, self.dest)
+            rsync_dest = self.root / "rsync"
+            if rsync_dest.exists():
+                shutil.rmtree(str(rsync_dest))
+            shutil.copytree(str(self.dest), str(rsync_dest), symlinks=True)
+
+            self.target.rules.clear()
+            self.target.rules.state = target.State.EVICTED
+            for _ in range(rng.randint(1, 5)):
+                path = "/".join(rng.choice("ABC")
+                                for _ in range(rng.randint(0, 3)))
+                if rng.random() < 0.6:
+                    self.target.include(path)
+                else:
+                    self.target.evict(path)
+
+            self.copy()
+            name = rulefiles.get_rule_file(str(self.root / "rules"),
+                                           self.target)
+            subprocess.check_call(
+                ["rsync", "-raH", "--delete",
+                 "--filter", ". {}".format(name),
+                 str(self.src) + "/", str(rsync_dest)],
+            )
+
+            self.assertDictEqual(snapshot(self.dest), snapshot(rsync_dest))
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import offlinecopy_impl.locking as locking
+import offlinecopy_impl.target as target
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "lock")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_exclusive(self):
+        # flock locks belong to the open file, so two locks conflict even
+        # within one process
+        with locking.FileLock(self.path):
+            other = locking.FileLock(self.path)
+            self.assertFalse(other.acquire(blocking=False))
+
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
+    def test_acquire_async(self):
+        async def wait_for(lock, holder):
+            task = asyncio.ensure_future(lock.acquire_async(interval=0.01))
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            holder.release()
+            await asyncio.wait_for(task, 1)
+
+        holder = locking.FileLock(self.path)
+        holder.acquire()
+        lock = locking.FileLock(self.path)
+        asyncio.run(wait_for(lock, holder))
+        self.assertFalse(holder.acquire(blocking=False))
+        lock.release()
+
+    def test_acquire_async_cancelled(self):
+        async def cancel(lock):
+            task = asyncio.ensure_future(lock.acquire_async(interval=0.01))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        holder = locking.FileLock(self.path)
+        holder.acquire()
+        lock = locking.FileLock(self.path)
+        asyncio.run(cancel(lock))
+        holder.release()
+
+        # nothing keeps waiting for the lock in the background
+        self.assertTrue(holder.acquire(blocking=False))
+        holder.release()
+
+    def test_released_in_child_exit(self):
+        pid = os.fork()
+        if pid == 0:
+            lock = locking.FileLock(self.path)
+            lock.acquire()
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        lock = locking.FileLock(self.path)
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+
+class Testget_target_lock_path(unittest.TestCase):
+    def test_per_target(self):
+        t1 = target.Target("host:/one/", "/one")
+        t2 = target.Target("host:/two/", "/two")
+
+        self.assertNotEqual(locking.get_target_lock_path("/locks", t1),
+                            locking.get_target_lock_path("/locks", t2))
+        self.assertEqual(
+            os.path.dirname(locking.get_target_lock_path("/locks", t1)),
+            "/locks",
+        )
@@ -0,0 +1,69 @@
+import unittest
+
+import offlinecopy_impl.mirrors as mirrors
+
+
+class Testrank_sources(unittest.TestCase):
+    def test_orders_by_latency(self):
+        latencies = {
+            "a:/x/": 0.5,
+            "b:/x/": None,
+            "c:/x/": 0.1,
+            "d:/x/": 0.3,
+        }
+
+        self.assertSequenceEqual(
+            mirrors.rank_sources(
+                ["a:/x/", "b:/x/", "c:/x/", "d:/x/"],
+                probe=lambda source, timeout: latencies[source],
+            ),
+            ["c:/x/", "d:/x/", "a:/x/"],
+        )
+
+    def test_none_reachable(self):
+        self.assertSequenceEqual(
+            mirrors.rank_sources(
+                ["a:/x/", "b:/x/"],
+                probe=lambda source, timeout: None,
+            ),
+            [],
+        )
+
+
+class Testparse_list_only(unittest.TestCase):
+    def test_parse(self):
+        self.assertSequenceEqual(
+            list(mirrors.parse_list_only([
+                "drwxr-xr-x          4,096 2017/01/01 12:00:00 .\n",
+                "-rw-r--r--             12 2017/01/01 12:00:00 a file\n",
+                "drwxr-xr-x          4,096 2017/01/01 12:00:00 dir\n",
+            ])),
+            ["a file", "dir"],
+        )
+
+    def test_symlinks_and_escapes(self):
+        self.assertSequenceEqual(
+            list(mirrors.parse_list_only([
+                "lrwxrwxrwx              6 2017/01/01 12:00:00"
+                " link -> target\n",
+                "-rw-r--r--             12 2017/01/01 12:00:00 a -> b\n",
+                "-rw-r--r--             12 2017/01/01 12:00:00 tab\\#011x\n",
+                "-rw-r--r--             12 2017/01/01 12:00:00"
+                " caf\\#303\\#251\n",
+            ])),
+            ["link", "a -> b", "tab\tx", "caf\u00e9"],
+        )
+
+
+class Testsplit_entries(unittest.TestCase):
+    def test_split(self):
+        self.assertSequenceEqual(
+            mirrors.split_entries(["a", "b", "c", "d", "e"], 2),
+            [["a", "c", "e"], ["b", "d"]],
+        )
+
+    def test_more_sources_than_entries(self):
+        self.assertSequenceEqual(
+            mirrors.split_entries(["a"], 3),
+            [["a"], [], []],
+        )
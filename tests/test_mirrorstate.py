@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import pathlib
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.config as config
+import offlinecopy_impl.main as main
+import offlinecopy_impl.mirrorstate as mirrorstate
+import offlinecopy_impl.target as target
+
+
+class Testin_step(unittest.TestCase):
+    def setUp(self):
+        self.t = target.Target("host:/src/", "/dest")
+        self.t.mirrors = ["a:/src/", "b:/src/"]
+        self.state = {}
+
+    def test_unknown(self):
+        self.assertFalse(mirrorstate.in_step(self.state, self.t, "a:/src/"))
+
+    def test_generations(self):
+        mirrorstate.advance(self.state, self.t)
+        mirrorstate.mark_synced(self.state, self.t, "a:/src/")
+        mirrorstate.mark_synced(self.state, self.t, "b:/src/")
+        self.assertTrue(mirrorstate.in_step(self.state, self.t, "a:/src/"))
+
+        # a push to the source alone
+        mirrorstate.advance(self.state, self.t)
+        mirrorstate.mark_synced(self.state, self.t, "a:/src/")
+        self.assertTrue(mirrorstate.in_step(self.state, self.t, "a:/src/"))
+        self.assertFalse(mirrorstate.in_step(self.state, self.t, "b:/src/"))
+
+    def test_other_source(self):
+        mirrorstate.mark_synced(self.state, self.t, "a:/src/")
+        self.t.src = "other:/src/"
+
+        self.assertFalse(mirrorstate.in_step(self.state, self.t, "a:/src/"))
+        mirrorstate.advance(self.state, self.t)
+        self.assertDictEqual(self.state["/dest"]["mirrors"], {})
+
+
+class Testpush_mirrors(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.state_path = str(self.root / "mirror-state.json")
+        self.t = target.Target("host:/src/", self.root / "dest")
+        self.t.mirrors = ["a:/src/", "b:/src/"]
+        self.t.include("A")
+        self.cfg = config.Config(main.read_config(self.root / "missing"))
+        self.cmds = []
+        self.directions = []
+        self.fail = set()
+
+        async def run_recorded(cfg, cmd, t, direction, profile, **kwargs):
+            self.cmds.append(cmd)
+            self.directions.append(direction)
+            if cmd[-1] in self.fail and any(
+                    arg.startswith("--read-batch=") for arg in cmd):
+                raise subprocess.CalledProcessError(1, cmd)
+
+        @contextlib.contextmanager
+        def FilterFile(t, relpath=""):
+            yield "rules"
+
+        for name, value in [
+                ("get_mirror_state_path", lambda: self.state_path),
+                ("get_target_lock_path", lambda t: str(self.root / "lock")),
+                ("get_transport_profile", lambda t: main.transport.Profile()),
+                ("record_snapshot", lambda t, relpath: None),
+                ("run_recorded", run_recorded),
+                ("FilterFile", FilterFile)]:
+            patcher = unittest.mock.patch("offlinecopy_impl.main." + name,
+                                          value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def push(self, relpath=""):
+        del self.cmds[:]
+        with unittest.mock.patch("sys.stderr"):
+            asyncio.run(main.push_mirrors_async(self.cfg, self.t,
+                                                relpath=relpath))
+        return [
+            (cmd[-1], "write" if any(arg.startswith("--write-batch=")
+                                     for arg in cmd)
+             else "read" if any(arg.startswith("--read-batch=")
+                                for arg in cmd)
+             else "push")
+            for cmd in self.cmds
+        ]
+
+    def test_out_of_step_mirrors_are_pushed(self):
+        self.assertSequenceEqual(
+            self.push(),
+            [("host:/src/", "push"), ("a:/src/", "push"),
+             ("b:/src/", "push")],
+        )
+        self.assertSequenceEqual(
+            self.push(),
+            [("host:/src/", "write"), ("a:/src/", "read"),
+             ("b:/src/", "read")],
+        )
+
+    def test_mirror_pushes_are_recorded_apart(self):
+        self.push()
+        del self.directions[:]
+        self.push()
+
+        self.assertSequenceEqual(
+            self.directions,
+            ["push", "push-mirror", "push-mirror"],
+        )
+
+    def test_push_to_source_alone(self):
+        self.push()
+        asyncio.run(main.rsync_target_async(self.cfg, self.t))
+
+        self.assertSequenceEqual(
+            self.push(),
+            [("host:/src/", "push"), ("a:/src/", "push"),
+             ("b:/src/", "push")],
+        )
+
+    def test_failed_replay(self):
+        self.push()
+        self.fail.add("a:/src/")
+
+        self.assertSequenceEqual(
+            self.push(),
+            [("host:/src/", "write"), ("a:/src/", "read"),
+             ("a:/src/", "push"), ("b:/src/", "read")],
+        )
+        state = mirrorstate.load(self.state_path)
+        self.assertTrue(mirrorstate.in_step(state, self.t, "a:/src/"))
+
+    def test_subtree_does_not_bring_mirror_in_step(self):
+        self.push("/A")
+
+        state = mirrorstate.load(self.state_path)
+        self.assertFalse(mirrorstate.in_step(state, self.t, "a:/src/"))
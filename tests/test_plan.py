@@ -0,0 +1,110 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import offlinecopy_impl.plan as plan
+import offlinecopy_impl.target as target
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.target = target.Target("host:/src/", "/dest")
+        self.target.include("")
+        self.snapshot = {
+            "/a": (10, 1),
+            "/b": (20, 1),
+            "/c": (30, 1),
+            "/X/x": (40, 1),
+        }
+
+    def test_push(self):
+        current = {
+            "/a": (10, 1),
+            "/b": (21, 2),
+            "/d": (5, 1),
+            "/X/x": (40, 1),
+        }
+
+        self.assertEqual(
+            plan.plan_push(self.target, current, self.snapshot),
+            plan.Plan(2, 26, 1, 30),
+        )
+
+    def test_revert(self):
+        current = {
+            "/a": (10, 1),
+            "/b": (21, 2),
+            "/d": (5, 1),
+            "/X/x": (40, 1),
+        }
+
+        self.assertEqual(
+            plan.plan_revert(self.target, current, self.snapshot),
+            plan.Plan(2, 50, 1, 5),
+        )
+
+    def test_ignores_evicted_snapshot_entries(self):
+        self.target.evict("X")
+
+        self.assertEqual(
+            plan.plan_push(self.target, {}, self.snapshot),
+            plan.Plan(0, 0, 3, 60),
+        )
+
+    def test_without_snapshot(self):
+        current = {"/a": (10, 1), "/b": (20, 1)}
+
+        self.assertEqual(
+            plan.plan_push(self.target, current, None),
+            plan.Plan(2, 30, 0, 0),
+        )
+        self.assertIsNone(plan.plan_revert(self.target, current, None))
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.dest = self.root / "dest"
+        for path in ["a", "B/b", "B/c"]:
+            path = self.dest / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("w") as f:
+                f.write(path.name)
+
+        self.target = target.Target("host:/src/", self.dest)
+        self.target.include("")
+        self.path = plan.get_snapshot_path(str(self.root), self.target)
+
+    def test_round_trip(self):
+        files = plan.take_snapshot(self.target)
+        self.assertSetEqual(set(files), {"/a", "/B/b", "/B/c"})
+
+        plan.save_snapshot(self.path, self.target, files)
+        self.assertEqual(plan.load_snapshot(self.path, self.target), files)
+
+    def test_other_source(self):
+        plan.save_snapshot(self.path, self.target,
+                           plan.take_snapshot(self.target))
+        self.target.src = "otherhost:/src/"
+
+        self.assertIsNone(plan.load_snapshot(self.path, self.target))
+
+    def test_missing(self):
+        self.assertIsNone(plan.load_snapshot(self.path, self.target))
+
+    def test_update_snapshot(self):
+        files = plan.take_snapshot(self.target)
+        os.unlink(str(self.dest / "B" / "b"))
+        with (self.dest / "B" / "d").open("w") as f:
+            f.write("d")
+        with (self.dest / "e").open("w") as f:
+            f.write("e")
+
+        plan.update_snapshot(files, self.target, "/B")
+
+        self.assertSetEqual(set(files), {"/a", "/B/c", "/B/d"})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
@@ -0,0 +1,193 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import offlinecopy_impl.retention as retention
+import offlinecopy_impl.trash as trash
+
+
+class RetentionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name).resolve()
+        self.retention_dir = str(self.root / "retained")
+        os.mkdir(self.retention_dir)
+
+    def make_entry(self, relpath, timestamp, size=4096):
+        path = self.root / "data" / relpath
+        (path / "sub").mkdir(parents=True)
+        with (path / "sub" / "file").open("w") as f:
+            f.write("data")
+        entry = retention.retain(str(path), self.retention_dir)
+        with open(os.path.join(entry, trash.INFO_NAME), "w") as f:
+            print(str(path), file=f)
+            print(timestamp, file=f)
+            print(size, file=f)
+        return entry
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class Testretain(RetentionTestCase):
+    def test_retain(self):
+        path = self.root / "data"
+        path.mkdir()
+        with (path / "file").open("w") as f:
+            f.write("data")
+
+        entry = retention.retain(str(path), self.retention_dir)
+
+        self.assertFalse(path.exists())
+        self.assertTrue(
+            os.path.isfile(os.path.join(entry, trash.DATA_NAME, "file"))
+        )
+        entries = list(retention.iter_entries(self.retention_dir))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].path, entry)
+        self.assertEqual(entries[0].original_path, str(path))
+        self.assertIsNotNone(entries[0].timestamp)
+        # only measured by the drain worker
+        self.assertIsNone(entries[0].size)
+        self.assertFalse(retention.is_damaged(entries[0]))
+
+        retention.measure(self.retention_dir)
+
+        entries = list(retention.iter_entries(self.retention_dir))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].original_path, str(path))
+        self.assertGreater(entries[0].size, 0)
+
+    def test_damaged_entry(self):
+        os.mkdir(os.path.join(self.retention_dir, "broken"))
+
+        entries = list(retention.iter_entries(self.retention_dir))
+
+        self.assertEqual(len(entries), 1)
+        self.assertIsNone(entries[0].original_path)
+        self.assertIsNone(entries[0].size)
+        self.assertTrue(retention.is_damaged(entries[0]))
+
+
+class Testexpired(RetentionTestCase):
+    def test_least_recently_retained_first(self):
+        old = self.make_entry("old", 100)
+        new = self.make_entry("new", 300)
+        middle = self.make_entry("middle", 200)
+
+        self.assertSequenceEqual(
+            [entry.path for entry in retention.expired(
+                [self.retention_dir], 3 * 4096)],
+            [],
+        )
+        self.assertSequenceEqual(
+            [entry.path for entry in retention.expired(
+                [self.retention_dir], 2 * 4096)],
+            [old],
+        )
+        self.assertSequenceEqual(
+            [entry.path for entry in retention.expired(
+                [self.retention_dir], 4096 - 1)],
+            [old, middle, new],
+        )
+
+    def test_damaged_entries_expire(self):
+        os.mkdir(os.path.join(self.retention_dir, "broken"))
+        self.make_entry("a", 100)
+
+        self.assertSequenceEqual(
+            [os.path.basename(entry.path) for entry in retention.expired(
+                [self.retention_dir], 4096)],
+            ["broken"],
+        )
+
+    def test_unmeasured_entries(self):
+        # count as empty until they are measured, but are not damaged
+        old = self.make_entry("old", 100)
+        path = self.root / "data" / "new"
+        path.mkdir()
+        retention.retain(str(path), self.retention_dir)
+
+        self.assertSequenceEqual(
+            [entry.path for entry in retention.expired(
+                [self.retention_dir], 4096)],
+            [],
+        )
+        self.assertSequenceEqual(
+            [entry.path for entry in retention.expired(
+                [self.retention_dir], 4096 - 1)],
+            [old],
+        )
+
+    def test_pending_entries(self):
+        # an entry which another process is still building is left alone,
+        # one which was abandoned by a crash is dropped
+        tempfile.mkdtemp(prefix=trash.PENDING_PREFIX,
+                         dir=self.retention_dir)
+        stale = tempfile.mkdtemp(prefix=trash.PENDING_PREFIX,
+                                 dir=self.retention_dir)
+        os.utime(stale, (0, 0))
+
+        self.assertSequenceEqual(
+            list(retention.iter_entries(self.retention_dir)), [])
+        self.assertSequenceEqual(
+            [entry.path for entry in retention.expired(
+                [self.retention_dir], 4096)],
+            [stale],
+        )
+
+
+class Testfind_bases(RetentionTestCase):
+    def test_exact_and_ancestor(self):
+        parent = self.make_entry("A", 100)
+        exact = self.make_entry("A/B", 200)
+        self.make_entry("C", 300)
+
+        self.assertSequenceEqual(
+            retention.find_bases([self.retention_dir],
+                                 str(self.root / "data" / "A" / "B")),
+            [os.path.join(exact, trash.DATA_NAME)],
+        )
+        self.assertSequenceEqual(
+            retention.find_bases([self.retention_dir],
+                                 str(self.root / "data" / "A" / "B" / "sub")),
+            [os.path.join(exact, trash.DATA_NAME, "sub")],
+        )
+        self.assertSequenceEqual(
+            retention.find_bases([self.retention_dir],
+                                 str(self.root / "data" / "A" / "sub")),
+            [os.path.join(parent, trash.DATA_NAME, "sub")],
+        )
+
+    def test_unrelated(self):
+        self.make_entry("A", 100)
+
+        self.assertSequenceEqual(
+            retention.find_bases([self.retention_dir],
+                                 str(self.root / "data" / "AB")),
+            [],
+        )
+        self.assertSequenceEqual(
+            retention.find_bases([self.retention_dir],
+                                 str(self.root / "data")),
+            [],
+        )
+
+
+class Testsuperseded(RetentionTestCase):
+    def test_superseded(self):
+        a = self.make_entry("A", 100)
+        ab = self.make_entry("A/B", 200)
+        self.make_entry("AB", 300)
+
+        self.assertSequenceEqual(
+            sorted(entry.path for entry in retention.superseded(
+                [self.retention_dir], str(self.root / "data" / "A"))),
+            sorted([a, ab]),
+        )
+        self.assertSequenceEqual(
+            [entry.path for entry in retention.superseded(
+                [self.retention_dir], str(self.root / "data" / "A" / "B"))],
+            [ab],
+        )
@@ -0,0 +1,120 @@
+import asyncio
+import random
+import subprocess
+import unittest
+
+import offlinecopy_impl.retry as retry
+
+
+def rsync_error(returncode):
+    return subprocess.CalledProcessError(returncode, ["rsync"])
+
+
+class Testis_transient(unittest.TestCase):
+    def test_exit_codes(self):
+        for returncode in [10, 12, 23, 24, 30, 35, 255]:
+            self.assertTrue(retry.is_transient(rsync_error(returncode)))
+        for returncode in [1, 2, 3, 11, 20]:
+            self.assertFalse(retry.is_transient(rsync_error(returncode)))
+
+    def test_other_errors(self):
+        self.assertTrue(retry.is_transient(
+            subprocess.TimeoutExpired(["rsync"], 10)))
+        self.assertFalse(retry.is_transient(FileNotFoundError("rsync")))
+
+
+class Testbackoff_delay(unittest.TestCase):
+    def test_bounds(self):
+        rng = random.Random(0)
+        for attempt, low, high in [(1, 5, 10), (2, 10, 20), (3, 20, 40),
+                                   (20, 300, 600)]:
+            for _ in range(20):
+                delay = retry.backoff_delay(attempt, 10, rng=rng)
+                self.assertGreaterEqual(delay, low)
+                self.assertLessEqual(delay, high)
+
+
+class Testrun_all(unittest.TestCase):
+    def run_all(self, failures, **kwargs):
+        # failures maps items to the errors of their first attempts
+        calls = []
+        delays = []
+        failed = []
+
+        async def run(item):
+            calls.append(item)
+            errors = failures.get(item, [])
+            if errors:
+                raise errors.pop(0)
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        def on_failure(item, exc, delay):
+            failed.append((item, delay is not None))
+
+        results = asyncio.run(retry.run_all(
+            sorted(failures), run,
+            on_failure=on_failure,
+            rng=random.Random(0),
+            sleep=sleep,
+            **kwargs
+        ))
+        return results, calls, delays, failed
+
+    def test_failures_are_isolated(self):
+        results, calls, _, _ = self.run_all({
+            "a": [rsync_error(1)],
+            "b": [],
+        })
+
+        self.assertEqual(results[0].status, retry.FAILED)
+        self.assertEqual(results[0].error.returncode, 1)
+        self.assertEqual(results[1], retry.Result(retry.OK, 1, None))
+        self.assertCountEqual(calls, ["a", "b"])
+
+    def test_transient_errors_are_retried(self):
+        results, calls, delays, failed = self.run_all(
+            {"a": [rsync_error(23), rsync_error(30)],
+             "b": [rsync_error(23)] * 3},
+            attempts=3,
+            base_delay=10,
+        )
+
+        self.assertEqual(results[0], retry.Result(retry.OK, 3, None))
+        self.assertEqual(results[1].status, retry.TRANSIENT)
+        self.assertEqual(results[1].attempts, 3)
+        self.assertEqual(calls.count("a"), 3)
+        self.assertEqual(len(delays), 4)
+        self.assertEqual(failed.count(("b", False)), 1)
+
+    def test_fatal_errors_are_not_retried(self):
+        results, calls, delays, _ = self.run_all(
+            {"a": [rsync_error(23), rsync_error(2)]},
+            attempts=5,
+        )
+
+        self.assertEqual(results[0].status, retry.FAILED)
+        self.assertEqual(results[0].attempts, 2)
+        self.assertEqual(len(delays), 1)
+
+    def test_waiting_does_not_block_jobs(self):
+        events = []
+
+        async def run(item):
+            events.append(item)
+            if item == "a" and events.count("a") == 1:
+                raise rsync_error(23)
+
+        async def sleep(delay):
+            # only returns once the other item has been run
+            while "b" not in events:
+                await asyncio.sleep(0)
+
+        results = asyncio.run(asyncio.wait_for(retry.run_all(
+            ["a", "b"], run, jobs=1, attempts=2, sleep=sleep,
+        ), 5))
+
+        self.assertSequenceEqual(events, ["a", "b", "a"])
+        self.assertEqual([result.status for result in results],
+                         [retry.OK, retry.OK])
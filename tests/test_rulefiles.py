@@ -0,0 +1,105 @@
+import os
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.rulefiles as rulefiles
+import offlinecopy_impl.target as target
+
+
+class RuleFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, "filters")
+        self.target = target.Target("host:/src/", pathlib.Path("/dest"))
+        self.target.include("A/B")
+        self.target.evict("A/B/C")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class Testget_rule_file(RuleFilesTestCase):
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_contents(self):
+        path = rulefiles.get_rule_file(self.cache_dir, self.target)
+
+        self.assertEqual(
+            self.read(path),
+            "- /A/B/C\n+ /A/B\n- /A/*\n+ /A\n- /*\n",
+        )
+
+    def test_subtree(self):
+        path = rulefiles.get_rule_file(self.cache_dir, self.target, "/A")
+
+        self.assertEqual(self.read(path), "- /B/C\n+ /B\n- /*\n")
+        self.assertNotEqual(
+            path,
+            rulefiles.get_rule_file(self.cache_dir, self.target),
+        )
+
+    def test_reused_while_unchanged(self):
+        path = rulefiles.get_rule_file(self.cache_dir, self.target)
+
+        with unittest.mock.patch.object(self.target, "subtarget") as m:
+            self.assertEqual(
+                rulefiles.get_rule_file(self.cache_dir, self.target),
+                path,
+            )
+            m.assert_not_called()
+
+    def test_regenerated_after_change(self):
+        path = rulefiles.get_rule_file(self.cache_dir, self.target)
+
+        self.target.include("A/B/C")
+        new_path = rulefiles.get_rule_file(self.cache_dir, self.target)
+
+        self.assertNotEqual(new_path, path)
+        self.assertEqual(self.read(new_path), "+ /A/B\n- /A/*\n+ /A\n- /*\n")
+
+        self.target.evict("A/B/C")
+        self.assertEqual(
+            rulefiles.get_rule_file(self.cache_dir, self.target),
+            path,
+        )
+
+    def test_equal_rules_share_file(self):
+        other = target.Target("other:/src/", pathlib.Path("/other"))
+        other.from_flat_nodes(self.target.iter_flat_nodes())
+
+        self.assertEqual(
+            rulefiles.get_rule_file(self.cache_dir, other),
+            rulefiles.get_rule_file(self.cache_dir, self.target),
+        )
+
+
+class Testexpire(RuleFilesTestCase):
+    def test_expire(self):
+        os.makedirs(self.cache_dir)
+        for i in range(5):
+            path = os.path.join(self.cache_dir, "{}.rules".format(i))
+            with open(path, "w"):
+                pass
+            os.utime(path, (0, i * 10000))
+        with open(os.path.join(self.cache_dir, "other"), "w"):
+            pass
+
+        rulefiles.expire(self.cache_dir, max_files=2)
+
+        self.assertSetEqual(set(os.listdir(self.cache_dir)),
+                            {"3.rules", "4.rules", "other"})
+
+    def test_recently_used_are_kept(self):
+        os.makedirs(self.cache_dir)
+        for i in range(3):
+            with open(os.path.join(self.cache_dir,
+                                   "{}.rules".format(i)), "w"):
+                pass
+
+        rulefiles.expire(self.cache_dir, max_files=1)
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
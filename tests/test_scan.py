@@ -0,0 +1,80 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import offlinecopy_impl.scan as scan
+import offlinecopy_impl.target as target
+
+
+class Testiter_included_files(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        for path in ["a", "B/b", "B/C/c", "B/C/D/d", "E/e"]:
+            path = self.root / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("w") as f:
+                f.write(path.name)
+        os.symlink("B", str(self.root / "link"))
+
+        self.target = target.Target("host:/src/", self.root)
+
+    def relpaths(self, relpath=""):
+        return [path
+                for path, _ in scan.iter_included_files(self.target, relpath)]
+
+    def test_included_root(self):
+        self.target.include("")
+
+        self.assertSequenceEqual(
+            self.relpaths(),
+            ["/B/C/D/d", "/B/C/c", "/B/b", "/E/e", "/a", "/link"],
+        )
+
+    def test_evicted_root(self):
+        self.assertSequenceEqual(self.relpaths(), [])
+
+    def test_mixed(self):
+        self.target.evict("")
+        self.target.include("B")
+        self.target.evict("B/C")
+        self.target.include("B/C/D")
+
+        self.assertSequenceEqual(
+            self.relpaths(),
+            ["/B/C/D/d", "/B/b"],
+        )
+
+    def test_subtree(self):
+        self.target.include("")
+        self.target.evict("B/C/D")
+
+        self.assertSequenceEqual(
+            self.relpaths("B/C"),
+            ["/B/C/c"],
+        )
+        self.assertSequenceEqual(
+            self.relpaths("/a"),
+            ["/a"],
+        )
+
+    def test_selections(self):
+        self.target.include("B", target.Selection(("c", "d"), None))
+        self.target.include("B/C/D")
+        self.target.include("E", target.Selection((), 0))
+
+        self.assertSequenceEqual(
+            self.relpaths(),
+            ["/B/C/D/d", "/B/C/c"],
+        )
+        self.assertSequenceEqual(self.relpaths("B/b"), [])
+
+    def test_stat(self):
+        self.target.include("")
+
+        result = dict(scan.iter_included_files(self.target))
+        self.assertEqual(result["/a"].st_size, 1)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
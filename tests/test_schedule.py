@@ -0,0 +1,203 @@
+import asyncio
+import datetime
+import pathlib
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.schedule as schedule
+import offlinecopy_impl.target as target
+
+
+def local(hour, minute=0, day=5):
+    return datetime.datetime(2026, 1, day, hour, minute).timestamp()
+
+
+class Testparse_interval(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(schedule.parse_interval("90"), 90)
+        self.assertEqual(schedule.parse_interval("30m"), 1800)
+        self.assertEqual(schedule.parse_interval("1h30m"), 5400)
+        self.assertEqual(schedule.parse_interval("2D"), 2 * 86400)
+
+    def test_rejects_garbage(self):
+        for s in ["", "0", "h", "1x", "-1h", "1h 30m"]:
+            with self.assertRaises(ValueError):
+                schedule.parse_interval(s)
+
+    def test_format(self):
+        for s in ["90s", "30m", "1h30m", "1w2d"]:
+            self.assertEqual(
+                schedule.format_interval(schedule.parse_interval(s)),
+                "1m30s" if s == "90s" else s,
+            )
+
+
+class Testparse_window(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(schedule.parse_window("22:00-06:30"),
+                         (22 * 60, 6 * 60 + 30))
+        self.assertEqual(schedule.format_window((22 * 60, 6 * 60 + 30)),
+                         "22:00-06:30")
+
+    def test_rejects_garbage(self):
+        for s in ["22:00", "24:00-01:00", "10:60-11:00", "10:00-10:00"]:
+            with self.assertRaises(ValueError):
+                schedule.parse_window(s)
+
+
+class Testnext_run(unittest.TestCase):
+    def test_interval(self):
+        sched = schedule.Schedule(3600)
+        now = local(12)
+
+        self.assertEqual(schedule.next_run(sched, None, now), now)
+        self.assertEqual(schedule.next_run(sched, now - 600, now),
+                         now + 3000)
+        self.assertEqual(schedule.next_run(sched, now - 7200, now), now)
+
+    def test_window(self):
+        sched = schedule.Schedule(3600, [(9 * 60, 17 * 60)])
+
+        self.assertEqual(schedule.next_run(sched, None, local(12)),
+                         local(12))
+        self.assertEqual(schedule.next_run(sched, None, local(7)), local(9))
+        self.assertEqual(schedule.next_run(sched, None, local(17)),
+                         local(9, day=6))
+        self.assertEqual(
+            schedule.next_run(sched, local(16, 30), local(16, 45)),
+            local(9, day=6),
+        )
+
+    def test_window_spanning_midnight(self):
+        sched = schedule.Schedule(3600, [(22 * 60, 6 * 60),
+                                         (12 * 60, 13 * 60)])
+
+        self.assertEqual(schedule.next_run(sched, None, local(3)), local(3))
+        self.assertEqual(schedule.next_run(sched, None, local(23)),
+                         local(23))
+        self.assertEqual(schedule.next_run(sched, None, local(7)), local(12))
+        self.assertEqual(schedule.next_run(sched, None, local(14)), local(22))
+
+
+class Testlast_runs(unittest.TestCase):
+    def test_last_runs(self):
+        self.assertDictEqual(
+            schedule.last_runs([
+                {"target": "/a", "direction": "push", "time": 10},
+                {"target": "/a", "direction": "push", "time": 20},
+                {"target": "/a", "direction": "push", "time": 30,
+                 "relpath": "/sub"},
+                {"target": "/b", "direction": "revert", "time": 40},
+                {"target": "/b", "direction": "push", "time": 5},
+            ]),
+            {"/a": 20, "/b": 5},
+        )
+
+
+class Testrun(unittest.TestCase):
+    def setUp(self):
+        self.now = 100000
+        self.targets = []
+        for name in ["a", "b", "c"]:
+            t = target.Target("host:/{}/".format(name),
+                              pathlib.Path("/" + name))
+            t.schedule = schedule.Schedule(3600)
+            self.targets.append(t)
+        self.targets[2].schedule = None
+
+    def run_scheduler(self, run_target, last_run, until, **kwargs):
+        async def main():
+            task = asyncio.ensure_future(schedule.run(
+                lambda: self.targets,
+                run_target,
+                last_run,
+                poll_interval=0.01,
+                clock=lambda: self.now,
+                **kwargs
+            ))
+            await until()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(asyncio.wait_for(main(), 5))
+
+    def test_due_targets_with_cap(self):
+        started = []
+        running = []
+        max_running = []
+
+        async def run_target(t):
+            started.append(str(t.dest))
+            running.append(t)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(t)
+
+        async def until():
+            while len(started) < 2:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+
+        last_run = {"/b": self.now - 7200}
+        self.run_scheduler(run_target, last_run, until, jobs=1)
+
+        self.assertCountEqual(started, ["/a", "/b"])
+        self.assertEqual(max(max_running), 1)
+        self.assertDictEqual(last_run, {"/a": self.now, "/b": self.now})
+
+    def test_not_due(self):
+        started = []
+
+        async def run_target(t):
+            started.append(str(t.dest))
+
+        async def until():
+            await asyncio.sleep(0.05)
+
+        last_run = {"/a": self.now - 60, "/b": self.now - 3599}
+        self.run_scheduler(run_target, last_run, until)
+
+        self.assertSequenceEqual(started, [])
+
+    def test_no_overlap(self):
+        del self.targets[1:]
+        started = []
+
+        async def run_target(t):
+            started.append(self.now)
+            while self.now < 200000:
+                await asyncio.sleep(0.01)
+
+        async def until():
+            while not started:
+                await asyncio.sleep(0.01)
+            # several intervals pass while the push is still running
+            self.now += 20000
+            await asyncio.sleep(0.05)
+            self.now = 200000
+            while len(started) < 2:
+                await asyncio.sleep(0.01)
+
+        self.run_scheduler(run_target, {}, until)
+
+        self.assertSequenceEqual(started, [100000, 200000])
+
+    def test_failing_target(self):
+        started = []
+
+        async def run_target(t):
+            started.append(str(t.dest))
+            raise OSError("failed")
+
+        async def until():
+            while len(started) < 2:
+                await asyncio.sleep(0.01)
+            self.now += 3600
+            while len(started) < 4:
+                await asyncio.sleep(0.01)
+
+        with unittest.mock.patch("sys.stderr"):
+            self.run_scheduler(run_target, {}, until, jobs=2)
+
+        self.assertCountEqual(started, ["/a", "/b"] * 2)
@@ -0,0 +1,217 @@
+import asyncio
+import contextlib
+import pathlib
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.main as main
+import offlinecopy_impl.session as session
+import offlinecopy_impl.target as target
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name).resolve()
+        self.targets_path = str(self.root / "targets.xml")
+        self.config_path = str(self.root / "config.ini")
+
+        self.dest1 = self.root / "one"
+        self.dest2 = self.root / "two"
+        (self.dest1 / "A" / "B").mkdir(parents=True)
+        self.dest2.mkdir()
+
+        t1 = target.Target("host:/one/", self.dest1)
+        t1.include("")
+        t2 = target.Target("host:/two/", self.dest2)
+        main.write_targets(self.targets_path, [t1, t2])
+
+        self.session = session.Session(self.config_path, self.targets_path)
+
+        patcher = unittest.mock.patch(
+            "offlinecopy_impl.main.get_target_lock_path",
+            lambda t: str(self.root / "lock-{}".format(t.dest.name)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_find_target(self):
+        t, relpath = self.session.find_target(self.dest1 / "A" / "B")
+        self.assertEqual(t.dest, self.dest1)
+        self.assertEqual(relpath, "/A/B")
+
+        t, relpath = self.session.find_target(self.dest2 / "missing")
+        self.assertEqual(t.dest, self.dest2)
+        self.assertEqual(relpath, "/missing")
+
+        with self.assertRaises(session.Error):
+            self.session.find_target(self.root)
+
+    def test_changes_are_written_on_save(self):
+        self.session.exclude(self.dest1 / "A")
+        self.session.include(self.dest2 / "X")
+
+        self.assertEqual(self.session.get_state(self.dest1 / "A"),
+                         target.State.EVICTED)
+        self.assertEqual(
+            session.Session(self.config_path,
+                            self.targets_path).get_state(self.dest1 / "A"),
+            target.State.INCLUDED,
+        )
+
+        self.session.save()
+
+        other = session.Session(self.config_path, self.targets_path)
+        self.assertEqual(other.get_state(self.dest1 / "A"),
+                         target.State.EVICTED)
+        self.assertEqual(other.get_state(self.dest2 / "X"),
+                         target.State.INCLUDED)
+
+    def test_errors(self):
+        with self.assertRaises(session.Error):
+            self.session.include(self.dest1 / "A")
+        with self.assertRaises(session.Error):
+            self.session.exclude(self.dest2 / "A")
+        with self.assertRaises(session.Error):
+            self.session.push([self.root])
+        with self.assertRaises(session.Error):
+            self.session.revert([])
+
+    def test_evict_after_save(self):
+        with unittest.mock.patch(
+                "offlinecopy_impl.main.evict_local") as evict_local:
+            self.session.exclude(self.dest1 / "A", evict=True)
+            evict_local.assert_not_called()
+
+            self.session.save()
+
+        evict_local.assert_called_once_with(
+            self.session.targets,
+            [self.dest1 / "A"],
+            retain_budget=None,
+        )
+
+    def test_push_results(self):
+        async def rsync_target(cfg, t, **kwargs):
+            if t.dest == self.dest2:
+                raise subprocess.CalledProcessError(23, ["rsync"])
+
+        with unittest.mock.patch("offlinecopy_impl.main.rsync_target_async",
+                                 new=rsync_target):
+            results = self.session.push()
+
+        self.assertSequenceEqual(
+            results,
+            [
+                session.TransferResult(self.dest1, 0),
+                session.TransferResult(self.dest2, 23),
+            ]
+        )
+
+    def test_push_subtree(self):
+        calls = []
+
+        async def rsync_target(cfg, t, **kwargs):
+            calls.append((t.dest, kwargs["relpath"]))
+
+        with unittest.mock.patch("offlinecopy_impl.main.rsync_target_async",
+                                 new=rsync_target):
+            results = self.session.push([self.dest1 / "A" / "B"])
+
+        self.assertSequenceEqual(calls, [(self.dest1, "/A/B")])
+        self.assertSequenceEqual(
+            results,
+            [session.TransferResult(self.dest1 / "A" / "B", 0)],
+        )
+
+    def test_dry_run(self):
+        cmds = []
+
+        async def run_rsync(cfg, cmd, prefix=None):
+            cmds.append(cmd)
+            return ""
+
+        @contextlib.contextmanager
+        def FilterFile(t, relpath=""):
+            yield "rules"
+
+        with unittest.mock.patch("offlinecopy_impl.main.run_rsync",
+                                 new=run_rsync), \
+                unittest.mock.patch("offlinecopy_impl.main.FilterFile",
+                                    new=FilterFile), \
+                unittest.mock.patch(
+                    "offlinecopy_impl.main.get_transport_profile",
+                    lambda t: main.transport.Profile()):
+            results = self.session.push([self.dest1], dry_run=True)
+            self.session.summon(self.dest2 / "X", dry_run=True)
+
+        self.assertSequenceEqual(results,
+                                 [session.TransferResult(self.dest1, 0)])
+        self.assertEqual(len(cmds), 2)
+        for cmd in cmds:
+            self.assertEqual(cmd[:2], ["rsync", "--dry-run"])
+        self.assertEqual(self.session.get_state(self.dest2 / "X"),
+                         target.State.EVICTED)
+        self.assertFalse(self.session.dirty)
+
+    def test_failed_summon_restores_state(self):
+        with unittest.mock.patch(
+                "offlinecopy_impl.main._summon_async",
+                side_effect=subprocess.CalledProcessError(1, ["rsync"])):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.session.summon(self.dest2 / "X")
+
+        self.assertEqual(self.session.get_state(self.dest2 / "X"),
+                         target.State.EVICTED)
+        self.assertFalse(self.session.dirty)
+
+    def test_async_within_running_loop(self):
+        calls = []
+
+        async def rsync_target(cfg, t, **kwargs):
+            calls.append(t.dest)
+
+        async def summon(cfg, t, relpath, **kwargs):
+            calls.append(relpath)
+
+        async def run():
+            await self.session.summon_async(self.dest2 / "X")
+            return await self.session.push_async([self.dest1])
+
+        with unittest.mock.patch("offlinecopy_impl.main.rsync_target_async",
+                                 new=rsync_target), \
+                unittest.mock.patch("offlinecopy_impl.main._summon_async",
+                                    new=summon):
+            results = asyncio.run(run())
+
+        self.assertSequenceEqual(calls, ["/X", self.dest1])
+        self.assertSequenceEqual(results,
+                                 [session.TransferResult(self.dest1, 0)])
+        self.assertEqual(self.session.get_state(self.dest2 / "X"),
+                         target.State.INCLUDED)
+
+    def test_status(self):
+        status = self.session.status()
+        self.assertEqual(status[0].src, "host:/one/")
+        self.assertSequenceEqual(status[1].rules, [("-", "*")])
+
+    def test_concurrent_sessions_are_merged(self):
+        other = session.Session(self.config_path, self.targets_path)
+        self.session.exclude(self.dest1 / "A")
+        other.include(self.dest2 / "X")
+
+        self.session.save()
+        other.save()
+
+        fresh = session.Session(self.config_path, self.targets_path)
+        self.assertEqual(fresh.get_state(self.dest1 / "A"),
+                         target.State.EVICTED)
+        self.assertEqual(fresh.get_state(self.dest2 / "X"),
+                         target.State.INCLUDED)
+        # the saving session sees the merged state as well
+        self.assertEqual(other.get_state(self.dest1 / "A"),
+                         target.State.EVICTED)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
@@ -0,0 +1,157 @@
+import os
+import pathlib
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import offlinecopy_impl.main as main
+import offlinecopy_impl.rulefiles as rulefiles
+import offlinecopy_impl.strategy as strategy
+import offlinecopy_impl.target as target
+
+
+class StrategyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.target = target.Target("host:/src/", self.root)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class Testiter_included_roots(StrategyTestCase):
+    def test_included_root(self):
+        self.target.include("")
+        self.target.evict("A")
+        self.target.include("A/B")
+
+        self.assertSequenceEqual(
+            list(strategy.iter_included_roots(self.target.rules)),
+            [""],
+        )
+
+    def test_sparse(self):
+        self.target.include("A/B/C")
+        self.target.evict("A/B/C/D")
+        self.target.include("A/B/C/D/E")
+        self.target.include("F")
+
+        self.assertSequenceEqual(
+            list(strategy.iter_included_roots(self.target.rules)),
+            ["/A/B/C", "/F"],
+        )
+
+
+class Testchoose(StrategyTestCase):
+    def test_sparse_uses_list(self):
+        self.target.include("A/B")
+        self.target.include("C")
+
+        self.assertEqual(
+            strategy.choose(self.target),
+            (strategy.LIST, ["/A/B", "/C"]),
+        )
+
+    def test_included_root_uses_filter(self):
+        self.target.include("")
+        self.target.evict("A")
+
+        self.assertEqual(strategy.choose(self.target),
+                         (strategy.FILTER, None))
+        self.assertEqual(strategy.choose(self.target, strategy.LIST),
+                         (strategy.FILTER, None))
+
+    def test_nothing_included_uses_filter(self):
+        self.assertEqual(strategy.choose(self.target),
+                         (strategy.FILTER, None))
+
+    def test_many_roots_use_filter(self):
+        for i in range(strategy.MAX_LIST_ROOTS + 1):
+            self.target.include("dir{}".format(i))
+
+        self.assertEqual(strategy.choose(self.target),
+                         (strategy.FILTER, None))
+        self.assertEqual(strategy.choose(self.target, strategy.LIST)[0],
+                         strategy.LIST)
+
+    def test_forced_filter(self):
+        self.target.include("A")
+
+        self.assertEqual(strategy.choose(self.target, strategy.FILTER),
+                         (strategy.FILTER, None))
+
+    def test_file_target_uses_filter(self):
+        t = target.Target("host:/file", self.root / "file")
+        t.include("A")
+
+        self.assertEqual(strategy.choose(t), (strategy.FILTER, None))
+
+    def test_newline_uses_filter(self):
+        self.target.include("A\nB")
+
+        self.assertEqual(strategy.choose(self.target),
+                         (strategy.FILTER, None))
+
+
+@unittest.skipUnless(shutil.which("rsync"), "rsync is not available")
+class TestListModeMatchesFilterMode(StrategyTestCase):
+    def random_tree(self, rng, root):
+        for _ in range(30):
+            parts = [rng.choice("ABCde") for _ in range(rng.randint(1, 4))]
+            path = root.joinpath(*parts)
+            if any(p.exists() and not p.is_dir() for p in path.parents) \
+                    or path.exists():
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(str(rng.random()))
+
+    def listing(self, root):
+        # only files are compared: the filter mode also creates directories
+        # which are traversed towards included paths which do not exist
+        return sorted(
+            os.path.relpath(os.path.join(dirpath, name), str(root))
+            for dirpath, dirnames, filenames in os.walk(str(root))
+            for name in filenames
+        )
+
+    def test_random(self):
+        rng = random.Random(40)
+        for _ in range(20):
+            for name in ["src", "filter", "list"]:
+                shutil.rmtree(str(self.root / name), ignore_errors=True)
+            self.random_tree(rng, self.root / "src")
+            self.random_tree(rng, self.root / "filter")
+            shutil.copytree(str(self.root / "filter"),
+                            str(self.root / "list"))
+
+            t = target.Target(str(self.root / "src") + "/",
+                              self.root / "src")
+            for _ in range(rng.randint(1, 4)):
+                path = "/".join(rng.choice("ABC")
+                                for _ in range(rng.randint(1, 3)))
+                if rng.random() < 0.7:
+                    t.include(path)
+                else:
+                    t.evict(path)
+
+            _, roots = strategy.choose(t, strategy.LIST)
+            name = rulefiles.get_rule_file(str(self.root / "rules"), t)
+            base = ["rsync", "-r", "--delete",
+                    "--filter", ". {}".format(name)]
+            subprocess.check_call(
+                base + [str(self.root / "src") + "/",
+                        str(self.root / "filter")])
+            if roots is None:
+                continue
+            with main.FilesFromFile(roots) as files_from:
+                subprocess.check_call(
+                    base + ["--files-from", files_from,
+                            "--delete-missing-args",
+                            str(self.root / "src") + "/",
+                            str(self.root / "list")])
+
+            self.assertSequenceEqual(self.listing(self.root / "list"),
+                                     self.listing(self.root / "filter"))
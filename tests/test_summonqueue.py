@@ -0,0 +1,198 @@
+import asyncio
+import os
+import pathlib
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.config as config
+import offlinecopy_impl.locking as locking
+import offlinecopy_impl.main as main
+import offlinecopy_impl.summonqueue as summonqueue
+import offlinecopy_impl.target as target
+
+
+class Testadd(unittest.TestCase):
+    def setUp(self):
+        self.queue = summonqueue.load("/nonexistent/queue.json")
+
+    def test_add(self):
+        first = summonqueue.add(self.queue, "/a", "/X", split=True)
+        second = summonqueue.add(self.queue, "/a", "/Y", priority=3)
+
+        self.assertEqual((first["id"], second["id"]), (1, 2))
+        self.assertEqual(first["state"], summonqueue.QUEUED)
+        self.assertDictEqual(first["options"], {"split": True})
+        self.assertEqual(second["priority"], 3)
+
+    def test_same_path(self):
+        entry = summonqueue.add(self.queue, "/a", "/X")
+
+        self.assertIs(summonqueue.add(self.queue, "/a", "/X", priority=5),
+                      entry)
+        self.assertEqual(entry["priority"], 5)
+        self.assertEqual(len(self.queue["entries"]), 1)
+
+        entry["state"] = summonqueue.FAILED
+        new = summonqueue.add(self.queue, "/a", "/X")
+        self.assertSequenceEqual(self.queue["entries"], [new])
+        self.assertEqual(new["state"], summonqueue.QUEUED)
+
+
+class Testnext_entries(unittest.TestCase):
+    def setUp(self):
+        self.queue = summonqueue.load("/nonexistent/queue.json")
+        for dest, relpath, priority in [("/a", "/1", 0),
+                                        ("/a", "/2", 5),
+                                        ("/b", "/3", 0),
+                                        ("/c", "/4", 1)]:
+            summonqueue.add(self.queue, dest, relpath, priority=priority)
+
+    def ids(self, entries):
+        return [entry["id"] for entry in entries]
+
+    def test_order(self):
+        self.assertSequenceEqual(
+            self.ids(summonqueue.next_entries(self.queue, 10)),
+            [2, 4, 3],
+        )
+        self.assertSequenceEqual(
+            self.ids(summonqueue.next_entries(self.queue, 2)),
+            [2, 4],
+        )
+
+    def test_busy_targets_are_skipped(self):
+        summonqueue.find(self.queue, 4)["state"] = summonqueue.RUNNING
+        summonqueue.find(self.queue, 3)["state"] = summonqueue.FAILED
+
+        self.assertSequenceEqual(
+            self.ids(summonqueue.next_entries(self.queue, 10)),
+            [2],
+        )
+        self.assertSequenceEqual(
+            self.ids(summonqueue.ordered(self.queue)),
+            [4, 2, 1, 3],
+        )
+
+    def test_reset_running(self):
+        summonqueue.find(self.queue, 1)["state"] = summonqueue.RUNNING
+        summonqueue.find(self.queue, 2)["state"] = summonqueue.RUNNING
+        summonqueue.find(self.queue, 2)["cancel"] = True
+
+        summonqueue.reset_running(self.queue)
+
+        self.assertSequenceEqual(self.ids(self.queue["entries"]), [1, 3, 4])
+        self.assertEqual(summonqueue.find(self.queue, 1)["state"],
+                         summonqueue.QUEUED)
+
+
+class Testmodify(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "queue.json")
+            with summonqueue.modify(path) as queue:
+                summonqueue.add(queue, "/a", "/X")
+
+            with self.assertRaises(ValueError):
+                with summonqueue.modify(path) as queue:
+                    summonqueue.add(queue, "/a", "/Y")
+                    raise ValueError()
+
+            queue = summonqueue.load(path)
+            self.assertEqual(len(queue["entries"]), 1)
+            self.assertEqual(queue["next_id"], 2)
+
+
+class Testwork_queue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name).resolve()
+        self.queue_path = str(self.root / "queue.json")
+        self.targets_path = str(self.root / "targets.xml")
+        self.dest = self.root / "dest"
+        self.dest.mkdir()
+        main.write_targets(self.targets_path,
+                           [target.Target("host:/src/", self.dest)])
+        self.cfg = config.Config(main.read_config(self.root / "missing"))
+
+        for name, value in [("get_queue_path", lambda: self.queue_path),
+                            ("get_targets_path", lambda: self.targets_path)]:
+            patcher = unittest.mock.patch("offlinecopy_impl.main." + name,
+                                          value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def enqueue(self, *relpaths):
+        with summonqueue.modify(self.queue_path) as queue:
+            for relpath in relpaths:
+                summonqueue.add(queue, str(self.dest), relpath)
+
+    def work(self, summon_async, jobs=2):
+        with unittest.mock.patch("offlinecopy_impl.main.summon_async",
+                                 summon_async), \
+                unittest.mock.patch("sys.stdout"), \
+                unittest.mock.patch("sys.stderr"):
+            return asyncio.run(main.work_queue(self.cfg, jobs,
+                                               poll_interval=0.01))
+
+    def test_included_after_transfer(self):
+        self.enqueue("/A", "/B")
+        summoned = []
+
+        async def summon_async(cfg, t, relpath, **kwargs):
+            # the path is only included in the file after the transfer
+            on_disk = main.read_targets(self.targets_path)[0]
+            self.assertEqual(on_disk.get_state(relpath),
+                             target.State.EVICTED)
+            summoned.append(relpath)
+
+        self.assertTrue(self.work(summon_async))
+
+        self.assertSequenceEqual(summoned, ["/A", "/B"])
+        t = main.read_targets(self.targets_path)[0]
+        self.assertEqual(t.get_state("/A"), target.State.INCLUDED)
+        self.assertEqual(t.get_state("/B"), target.State.INCLUDED)
+        self.assertSequenceEqual(
+            summonqueue.load(self.queue_path)["entries"], [])
+
+    def test_failed(self):
+        self.enqueue("/A")
+
+        async def summon_async(cfg, t, relpath, **kwargs):
+            raise subprocess.CalledProcessError(23, ["rsync"])
+
+        self.work(summon_async)
+
+        t = main.read_targets(self.targets_path)[0]
+        self.assertEqual(t.get_state("/A"), target.State.EVICTED)
+        entry, = summonqueue.load(self.queue_path)["entries"]
+        self.assertEqual(entry["state"], summonqueue.FAILED)
+        self.assertEqual(entry["error"], "rsync exited with status 23")
+
+    def test_cancel_running(self):
+        self.enqueue("/A")
+
+        async def summon_async(cfg, t, relpath, **kwargs):
+            with summonqueue.modify(self.queue_path) as queue:
+                summonqueue.find(queue, 1)["cancel"] = True
+            await asyncio.sleep(10)
+
+        self.work(summon_async)
+
+        t = main.read_targets(self.targets_path)[0]
+        self.assertEqual(t.get_state("/A"), target.State.EVICTED)
+        self.assertSequenceEqual(
+            summonqueue.load(self.queue_path)["entries"], [])
+
+    def test_single_worker(self):
+        self.enqueue("/A")
+        lock = locking.FileLock(self.queue_path + ".worker")
+        lock.acquire()
+        try:
+            self.assertFalse(self.work(None))
+        finally:
+            lock.release()
@@ -1,6 +1,9 @@
 import contextlib
+import itertools
 import os.path
+import random
 import pathlib
+import stat
 import unittest
 import unittest.mock
 
@@ -141,6 +144,44 @@ class TestNode(unittest.TestCase):
         self.assertIn("foo", nroot.childmap)
         self.assertNotIn("bar", nroot.childmap["foo"].childmap)
 
+    def test_build_reuses_prefix(self):
+        nroot = target.Node()
+        nroot.build([
+            (target.State.EVICTED, ""),
+            (target.State.INCLUDED, "A/B"),
+            (target.State.EVICTED, "A/B/C"),
+            (target.State.INCLUDED, "A/D"),
+            (target.State.INCLUDED, "E"),
+        ])
+
+        a = nroot.childmap["A"]
+        self.assertEqual(nroot.state, target.State.EVICTED)
+        self.assertIsNone(a.state)
+        self.assertIs(a.childmap["B"].parent, a)
+        self.assertIs(a.childmap["D"].parent, a)
+        self.assertEqual(a.childmap["B"].state, target.State.INCLUDED)
+        self.assertEqual(a.childmap["B"].childmap["C"].state,
+                         target.State.EVICTED)
+        self.assertEqual(a.childmap["D"].state, target.State.INCLUDED)
+        self.assertEqual(nroot.childmap["E"].state, target.State.INCLUDED)
+
+    def test_build_unsorted(self):
+        nroot = target.Node()
+        nroot.build([
+            (target.State.INCLUDED, "A/B"),
+            (target.State.INCLUDED, "C"),
+            (target.State.EVICTED, "A"),
+        ])
+
+        self.assertSequenceEqual(
+            list(nroot.iter_nodes()),
+            [
+                (target.State.EVICTED, "A"),
+                (target.State.INCLUDED, "A/B"),
+                (target.State.INCLUDED, "C"),
+            ]
+        )
+
     def test_clear(self):
         self.n1.clear()
         self.assertIsNone(self.n1.state)
@@ -393,5 +434,409 @@ class TestTarget(unittest.TestCase):
             ]
         )
 
+    def test_include_collapses_redundant_children(self):
+        self.target.evict("A")
+        self.target.include("A/B")
+        self.target.include("A/C")
+
+        self.target.include("A")
+
+        self.assertSequenceEqual(
+            list(self.target.iter_flat_nodes()),
+            [
+                (target.State.INCLUDED, ""),
+            ]
+        )
+
+    def test_evict_removes_redundant_node(self):
+        self.target.evict("A")
+        self.target.include("A/B")
+
+        self.target.evict("A/B")
+
+        self.assertSequenceEqual(
+            list(self.target.iter_flat_nodes()),
+            [
+                (target.State.INCLUDED, ""),
+                (target.State.EVICTED, "A"),
+            ]
+        )
+        self.assertSequenceEqual(
+            list(self.target.iter_filter_rules()),
+            [
+                ("-", "A"),
+            ]
+        )
+
+    def test_include_folds_redundant_ancestors(self):
+        self.target.evict("A")
+        self.target.include("A/B")
+        self.target.evict("A/B/C")
+        self.target.include("A")
+
+        self.assertSequenceEqual(
+            list(self.target.iter_flat_nodes()),
+            [
+                (target.State.INCLUDED, ""),
+                (target.State.INCLUDED, "A"),
+                (target.State.INCLUDED, "A/B"),
+                (target.State.EVICTED, "A/B/C"),
+            ]
+        )
+
+        self.target.include("A/B/C")
+
+        self.assertSequenceEqual(
+            list(self.target.iter_flat_nodes()),
+            [
+                (target.State.INCLUDED, ""),
+            ]
+        )
+
+    def test_from_flat_nodes_prunes(self):
+        self.target.from_flat_nodes([
+            (target.State.INCLUDED, ""),
+            (target.State.INCLUDED, "A"),
+            (target.State.EVICTED, "B"),
+            (target.State.EVICTED, "B/C"),
+        ])
+
+        self.assertSequenceEqual(
+            list(self.target.iter_flat_nodes()),
+            [
+                (target.State.INCLUDED, ""),
+                (target.State.EVICTED, "B"),
+            ]
+        )
+
     def tearDown(self):
         del self.target
+
+
+def dump_tree(node):
+    return (
+        node.state,
+        node.selection,
+        {
+            segment: dump_tree(child)
+            for segment, child in node.childmap.items()
+        }
+    )
+
+
+class TestTargetNormalization(unittest.TestCase):
+    SEGMENTS = ["A", "B", "C"]
+    SELECTIONS = [None, target.Selection(("*.pdf",), None),
+                  target.Selection((), 1024)]
+
+    def reference_apply(self, t, state, path, selection=None):
+        # include/evict as they were before they normalized locally,
+        # followed by a rebuild from the flat nodes and a full prune
+        if t.get_state(path) == state and (
+                state == target.State.EVICTED or
+                t.get_selection(path) == selection):
+            return
+        node = t.rules.ensure_node(path)
+        node.state = state
+        node.selection = selection
+        t.from_flat_nodes(list(t.iter_flat_nodes()),
+                          list(t.iter_selections()))
+
+    def apply(self, t, state, path, selection=None):
+        if state == target.State.INCLUDED:
+            t.include(path, selection)
+        else:
+            t.evict(path)
+
+    def random_path(self, rng):
+        depth = rng.randint(0, 4)
+        return "/".join(rng.choice(self.SEGMENTS) for _ in range(depth))
+
+    def assertSameTree(self, incremental, reference, msg):
+        self.assertEqual(dump_tree(incremental.rules),
+                         dump_tree(reference.rules), msg)
+        self.assertEqual(incremental.rules.digest(),
+                         reference.rules.digest(), msg)
+        self.assertSequenceEqual(list(incremental.iter_filter_rules()),
+                                 list(reference.iter_filter_rules()), msg)
+
+    def test_intermediate_nodes_are_dropped(self):
+        t = target.Target("x/", "n")
+        t.include("a")
+        t.evict("a/b/a")
+        t.evict("a")
+
+        self.assertSequenceEqual(list(t.iter_flat_nodes()),
+                                 [(target.State.EVICTED, "")])
+        self.assertSequenceEqual(list(t.iter_filter_rules()), [("-", "*")])
+        self.assertEqual(t.rules.digest(), t.copy().rules.digest())
+
+    def test_matches_full_prune(self):
+        for seed in range(500):
+            rng = random.Random(seed)
+            incremental = target.Target("src/", "dest")
+            reference = target.Target("src/", "dest")
+
+            for _ in range(rng.randint(1, 30)):
+                state = rng.choice(list(target.State))
+                path = self.random_path(rng)
+                selection = None
+                if state == target.State.INCLUDED:
+                    selection = rng.choice(self.SELECTIONS)
+
+                self.apply(incremental, state, path, selection)
+                self.reference_apply(reference, state, path, selection)
+
+                self.assertSameTree(incremental, reference,
+                                    "seed {}".format(seed))
+
+    def test_exhaustive_triples(self):
+        paths = ["", "A", "A/B", "A/C", "A/B/A", "A/B/C", "B"]
+        ops = [(target.State.EVICTED, path, None) for path in paths] + [
+            (target.State.INCLUDED, path, selection)
+            for path in paths
+            for selection in self.SELECTIONS[:2]
+        ]
+        for sequence in itertools.product(ops, repeat=3):
+            incremental = target.Target("src/", "dest")
+            reference = target.Target("src/", "dest")
+            for state, path, selection in sequence:
+                self.apply(incremental, state, path, selection)
+                self.reference_apply(reference, state, path, selection)
+
+            self.assertSameTree(incremental, reference, repr(sequence))
+
+
+class TestNodeDigest(unittest.TestCase):
+    def setUp(self):
+        self.target = target.Target("host:/src/", "/dest")
+        self.target.include("A/B")
+        self.target.evict("A/B/C")
+
+    def test_equal_trees(self):
+        other = target.Target("other:/src/", "/other")
+        other.include("A/B")
+        other.evict("A/B/C")
+
+        self.assertEqual(other.rules.digest(), self.target.rules.digest())
+
+    def test_changes_on_mutation(self):
+        seen = {self.target.rules.digest()}
+
+        for mutate in [
+                lambda: self.target.include("A/B/C/D"),
+                lambda: self.target.include("A/B/C"),
+                lambda: self.target.include(
+                    "A/B/C", target.Selection(("*.pdf",), None)),
+                lambda: self.target.evict("A/B"),
+                lambda: self.target.from_flat_nodes([
+                    (target.State.EVICTED, ""),
+                    (target.State.INCLUDED, "X"),
+                ]),
+                lambda: self.target.rules.clear()]:
+            mutate()
+            digest = self.target.rules.digest()
+            self.assertNotIn(digest, seen)
+            seen.add(digest)
+
+    def test_restored_tree(self):
+        digest = self.target.rules.digest()
+
+        self.target.include("A/B/C")
+        self.target.evict("A/B/C")
+
+        self.assertEqual(self.target.rules.digest(), digest)
+
+
+class TestTargetSubtarget(unittest.TestCase):
+    def setUp(self):
+        self.target = target.Target("host:/src/", "/dest")
+        self.target.mirrors = ["mirror:/src/"]
+        self.target.include("A/B")
+        self.target.evict("A/B/C")
+        self.target.include("A/B/C/D")
+
+    def test_root(self):
+        self.assertIs(self.target.subtarget(""), self.target)
+        self.assertIs(self.target.subtarget("/"), self.target)
+
+    def test_paths(self):
+        sub = self.target.subtarget("/A/B")
+
+        self.assertEqual(sub.src, "host:/src/A/B/")
+        self.assertEqual(sub.dest, pathlib.Path("/dest/A/B"))
+        self.assertSequenceEqual(sub.mirrors, ["mirror:/src/A/B/"])
+
+    def test_rules_are_rebased(self):
+        self.assertSequenceEqual(
+            list(self.target.subtarget("A/B").iter_filter_rules()),
+            [("+", "C/D"), ("-", "C/*")],
+        )
+        self.assertSequenceEqual(
+            list(self.target.subtarget("A").iter_filter_rules()),
+            [("+", "B/C/D"), ("-", "B/C/*"), ("+", "B"), ("-", "*")],
+        )
+
+    def test_state_matches(self):
+        for path in ["A", "A/B", "A/B/C", "A/X"]:
+            sub = self.target.subtarget(path)
+            for subpath in ["", "B", "B/C", "B/C/D", "C", "C/D", "C/D/E"]:
+                self.assertEqual(
+                    sub.get_state(subpath),
+                    self.target.get_state(path + "/" + subpath),
+                    (path, subpath),
+                )
+
+    def test_below_nodes(self):
+        sub = self.target.subtarget("A/B/C/D/E")
+        self.assertEqual(sub.get_state(""), target.State.INCLUDED)
+        self.assertSequenceEqual(list(sub.iter_filter_rules()), [])
+
+        sub = self.target.subtarget("X/Y")
+        self.assertSequenceEqual(list(sub.iter_filter_rules()), [("-", "*")])
+
+
+class TestTargetSelections(unittest.TestCase):
+    def setUp(self):
+        self.pdf = target.Selection(("*.pdf",), None)
+        self.small = target.Selection((), 1024)
+        self.target = target.Target("host:/src/", "/dest")
+        self.target.include("Docs", self.pdf)
+        self.target.evict("Docs/Old")
+        self.target.include("Docs/Keep")
+        self.target.include("Media", self.small)
+
+    def test_rules(self):
+        self.assertSequenceEqual(
+            list(self.target.iter_filter_rules()),
+            [
+                ("+", "Docs/Keep/***"),
+                ("-", "Docs/Old"),
+                ("+", "Docs/**/"),
+                ("+", "Docs/*.pdf"),
+                ("+", "Docs/**/*.pdf"),
+                ("-", "Docs/**"),
+                ("+", "Docs"),
+                ("+", "Media"),
+                ("-", "*"),
+            ]
+        )
+
+    def test_rules_without_selections(self):
+        self.assertSequenceEqual(
+            list(self.target.rules.iter_rules(selections=False)),
+            [
+                ("+", "Docs/Keep"),
+                ("-", "Docs/Old"),
+                ("+", "Docs"),
+                ("+", "Media"),
+                ("-", "*"),
+            ]
+        )
+
+    def test_get_selection(self):
+        self.assertEqual(self.target.get_selection("Docs/a/b"), self.pdf)
+        self.assertIsNone(self.target.get_selection("Docs/Old/a"))
+        self.assertIsNone(self.target.get_selection("Docs/Keep"))
+        self.assertIsNone(self.target.get_selection("Other"))
+        self.assertSequenceEqual(list(self.target.iter_size_limits()),
+                                 [("/Media", 1024)])
+
+    def test_get_entry_state(self):
+        big = os.stat_result((stat.S_IFREG | 0o644,) + (0,) * 5 +
+                             (4096,) + (0,) * 3)
+        directory = os.stat_result((stat.S_IFDIR | 0o755,) + (0,) * 9)
+
+        self.assertEqual(self.target.get_entry_state("Docs/a.pdf"),
+                         target.State.INCLUDED)
+        self.assertEqual(self.target.get_entry_state("Docs/a/b.txt"),
+                         target.State.EVICTED)
+        self.assertEqual(self.target.get_entry_state("Docs/a", directory),
+                         target.State.INCLUDED)
+        self.assertEqual(self.target.get_entry_state("Docs/Keep/b.txt"),
+                         target.State.INCLUDED)
+        self.assertEqual(self.target.get_entry_state("Docs/Old/a.pdf"),
+                         target.State.EVICTED)
+        self.assertEqual(self.target.get_entry_state("Media/x"),
+                         target.State.INCLUDED)
+        self.assertEqual(self.target.get_entry_state("Media/x", big),
+                         target.State.EVICTED)
+
+    def test_include_changes_selection(self):
+        self.target.include("Docs")
+        self.assertIsNone(self.target.get_selection("Docs"))
+        # the plain include below is redundant now
+        self.assertSequenceEqual(
+            list(self.target.iter_flat_nodes()),
+            [
+                (target.State.EVICTED, ""),
+                (target.State.INCLUDED, "Docs"),
+                (target.State.EVICTED, "Docs/Old"),
+                (target.State.INCLUDED, "Media"),
+            ]
+        )
+
+        # the same selection below is redundant as well
+        self.target.include("Media/Sub", self.small)
+        self.assertNotIn(("Media/Sub", target.State.INCLUDED),
+                         list(self.target.iter_flat_nodes()))
+
+    def test_evict_clears_selection(self):
+        self.target.evict("Media")
+        self.target.include("Media")
+        self.assertIsNone(self.target.get_selection("Media"))
+
+    def test_copy(self):
+        copy = self.target.copy()
+        self.assertEqual(copy.rules.digest(), self.target.rules.digest())
+        self.assertSequenceEqual(list(copy.iter_selections()),
+                                 [(self.pdf, "Docs"), (self.small, "Media")])
+
+    def test_subtarget(self):
+        sub = self.target.subtarget("Docs")
+        self.assertEqual(sub.get_selection(""), self.pdf)
+        self.assertSequenceEqual(
+            list(sub.iter_filter_rules()),
+            [
+                ("+", "Keep/***"),
+                ("-", "Old"),
+                ("+", "**/"),
+                ("+", "*.pdf"),
+                ("+", "**/*.pdf"),
+                ("-", "**"),
+            ]
+        )
+
+        sub = self.target.subtarget("Media/Sub")
+        self.assertSequenceEqual(list(sub.iter_size_limits()),
+                                 [("", 1024)])
+
+    def test_split_size_limits(self):
+        self.target.include("Media/Large", target.Selection((), 2**30))
+
+        parts = [(part.subtarget(relpath), relpath, max_size)
+                 for part, relpath, max_size
+                 in self.target.split_size_limits()]
+
+        self.assertSequenceEqual(
+            [(relpath, max_size) for _, relpath, max_size in parts],
+            [("", None), ("/Media", 1024), ("/Media/Large", 2**30)],
+        )
+        self.assertEqual(parts[0][0].get_state("Media"),
+                         target.State.EVICTED)
+        self.assertEqual(parts[0][0].get_state("Docs/Keep"),
+                         target.State.INCLUDED)
+        self.assertEqual(parts[1][0].get_state("Large"),
+                         target.State.EVICTED)
+        self.assertEqual(parts[2][0].get_state(""), target.State.INCLUDED)
+
+    def test_split_without_limits(self):
+        self.assertSequenceEqual(
+            list(self.target.split_size_limits("Docs")),
+            [(self.target, "/Docs", None)],
+        )
+        self.assertSequenceEqual(
+            [(relpath, max_size) for _, relpath, max_size
+             in self.target.split_size_limits("Media")],
+            [("/Media", 1024)],
+        )
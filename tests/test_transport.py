@@ -0,0 +1,130 @@
+import unittest
+
+import offlinecopy_impl.transport as transport
+
+
+MiB = 1024**2
+
+
+def record(duration, wire_bytes, literal=None, compress=False, status=0):
+    if literal is None:
+        literal = wire_bytes
+    return {
+        "duration": duration,
+        "bytes_sent": wire_bytes,
+        "bytes_received": 0,
+        "literal": literal,
+        "compress": compress,
+        "status": status,
+    }
+
+
+class Testflags(unittest.TestCase):
+    def test_default_profile(self):
+        self.assertSequenceEqual(
+            transport.flags(transport.Profile()),
+            ["-raHEAXS"],
+        )
+
+    def test_custom_profile(self):
+        profile = transport.Profile(
+            compress=transport.Setting.YES,
+            whole_file=transport.Setting.YES,
+            acls=transport.Setting.NO,
+            sparse=transport.Setting.NO,
+            checksum_choice="xxh128",
+        )
+
+        self.assertSequenceEqual(
+            transport.flags(profile),
+            ["-raHEXz", "--whole-file", "--checksum-choice=xxh128"],
+        )
+
+
+class Testparse_stats(unittest.TestCase):
+    def test_parse(self):
+        text = """
+Number of files: 3 (reg: 2, dir: 1)
+Number of created files: 0
+Number of regular files transferred: 2
+Total file size: 1,234,567 bytes
+Total transferred file size: 4,567 bytes
+Literal data: 4,000 bytes
+Matched data: 567 bytes
+File list size: 0
+Total bytes sent: 2,100
+Total bytes received: 35
+
+sent 2,100 bytes  received 35 bytes  4,270.00 bytes/sec
+"""
+
+        self.assertDictEqual(
+            transport.parse_stats(text),
+            {
+                "files": 2,
+                "size": 4567,
+                "literal": 4000,
+                "matched": 567,
+                "bytes_sent": 2100,
+                "bytes_received": 35,
+            }
+        )
+
+    def test_skip_human_readable(self):
+        self.assertDictEqual(
+            transport.parse_stats("Total bytes sent: 2.10K\n"),
+            {},
+        )
+
+
+class Testresolve(unittest.TestCase):
+    def setUp(self):
+        self.profile = transport.Profile(
+            compress=transport.Setting.AUTO,
+            whole_file=transport.Setting.AUTO,
+        )
+
+    def test_without_history(self):
+        result = transport.resolve(self.profile, [])
+        self.assertEqual(result.compress, transport.Setting.YES)
+        self.assertEqual(result.whole_file, transport.Setting.NO)
+
+    def test_fast_link(self):
+        result = transport.resolve(self.profile, [
+            record(1, 100 * MiB),
+        ])
+        self.assertEqual(result.compress, transport.Setting.NO)
+        self.assertEqual(result.whole_file, transport.Setting.YES)
+
+    def test_slow_link_incompressible(self):
+        result = transport.resolve(self.profile, [
+            record(10, 10 * MiB, literal=10 * MiB, compress=True),
+        ])
+        self.assertEqual(result.compress, transport.Setting.NO)
+        self.assertEqual(result.whole_file, transport.Setting.NO)
+
+    def test_slow_link_compressible(self):
+        result = transport.resolve(self.profile, [
+            record(10, 10 * MiB, literal=30 * MiB, compress=True),
+        ])
+        self.assertEqual(result.compress, transport.Setting.YES)
+
+    def test_fast_link_with_compression(self):
+        # compression shrinks the bytes on the wire, not the file data
+        result = transport.resolve(self.profile, [
+            record(1, 20 * MiB, literal=100 * MiB, compress=True),
+        ])
+        self.assertEqual(result.whole_file, transport.Setting.YES)
+        self.assertEqual(result.compress, transport.Setting.NO)
+
+    def test_ignores_small_and_failed_transfers(self):
+        result = transport.resolve(self.profile, [
+            record(0.001, 100 * 1024),
+            record(0.1, 100 * MiB, status=23),
+        ])
+        self.assertEqual(result.whole_file, transport.Setting.NO)
+
+    def test_keeps_fixed_settings(self):
+        profile = transport.Profile(compress=transport.Setting.NO)
+        result = transport.resolve(profile, [])
+        self.assertEqual(result, profile)
@@ -0,0 +1,179 @@
+import fcntl
+import os
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.trash as trash
+
+
+class TrashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.trash_dir = str(self.root / "trash")
+        os.mkdir(self.trash_dir)
+
+    def make_tree(self, base):
+        for path in ["a", "B/b", "B/C/c", "B/C/D/d", "E/e"]:
+            path = base / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("w") as f:
+                f.write("data")
+        os.symlink("B", str(base / "link"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class Testfind_trash_dir(TrashTestCase):
+    def test_default_on_same_file_system(self):
+        path = self.root / "data"
+        path.mkdir()
+
+        self.assertEqual(
+            trash.find_trash_dir(str(path), self.trash_dir),
+            self.trash_dir,
+        )
+
+    def test_skip_forbidden(self):
+        path = self.root / "target" / "data"
+        path.mkdir(parents=True)
+        default = str(self.root / "target" / "trash")
+
+        result = trash.find_trash_dir(str(path), default,
+                                      forbidden=[self.root / "target"])
+        self.assertNotEqual(result, default)
+
+
+class Testmove_to_trash(TrashTestCase):
+    def test_move_and_list(self):
+        path = self.root / "data"
+        self.make_tree(path)
+
+        entry = trash.move_to_trash(str(path), self.trash_dir)
+
+        self.assertFalse(path.exists())
+        self.assertTrue(
+            os.path.isfile(os.path.join(entry, trash.DATA_NAME, "a"))
+        )
+
+        entries = list(trash.iter_entries(self.trash_dir))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].path, entry)
+        self.assertEqual(entries[0].original_path, str(path))
+        self.assertIsNotNone(entries[0].timestamp)
+
+    def test_missing_path_leaves_no_entry(self):
+        with self.assertRaises(FileNotFoundError):
+            trash.move_to_trash(str(self.root / "missing"), self.trash_dir)
+
+        self.assertSequenceEqual(os.listdir(self.trash_dir), [])
+
+    def test_list_half_written_entry(self):
+        os.mkdir(os.path.join(self.trash_dir, "broken"))
+
+        entries = list(trash.iter_entries(self.trash_dir))
+        self.assertEqual(len(entries), 1)
+        self.assertIsNone(entries[0].original_path)
+        self.assertIsNone(entries[0].timestamp)
+
+
+class Testdelete_tree(TrashTestCase):
+    def test_delete_tree(self):
+        path = self.root / "data"
+        self.make_tree(path)
+
+        trash.delete_tree(str(path), jobs=4)
+
+        self.assertFalse(path.exists())
+
+    def test_does_not_follow_symlinks(self):
+        path = self.root / "data"
+        self.make_tree(path)
+        os.symlink(str(self.root / "keep"), str(path / "outside"))
+        (self.root / "keep").mkdir()
+        (self.root / "keep" / "file").touch()
+
+        trash.delete_tree(str(path))
+
+        self.assertFalse(path.exists())
+        self.assertTrue((self.root / "keep" / "file").exists())
+
+    def test_delete_file(self):
+        path = self.root / "file"
+        path.touch()
+
+        trash.delete_tree(str(path))
+
+        self.assertFalse(path.exists())
+
+    def test_missing_is_ok(self):
+        trash.delete_tree(str(self.root / "missing"))
+
+    def test_directory_filled_concurrently(self):
+        path = self.root / "data"
+        self.make_tree(path)
+        real_rmdir = os.rmdir
+
+        def rmdir(dir_):
+            if dir_ == str(path / "E"):
+                (path / "E" / "new").touch()
+            real_rmdir(dir_)
+
+        with unittest.mock.patch("os.rmdir", rmdir):
+            trash.delete_tree(str(path))
+
+        self.assertTrue((path / "E" / "new").exists())
+        self.assertFalse((path / "B").exists())
+
+
+class Testdrain(TrashTestCase):
+    def test_drain(self):
+        for name in ["x", "y"]:
+            self.make_tree(self.root / name)
+            trash.move_to_trash(str(self.root / name), self.trash_dir)
+        # a partially deleted entry from an interrupted worker
+        os.mkdir(os.path.join(self.trash_dir, "partial"))
+
+        self.assertTrue(trash.drain(self.trash_dir))
+
+        self.assertSequenceEqual(list(trash.iter_entries(self.trash_dir)), [])
+
+    def test_drain_skips_pending_entries(self):
+        # an entry which another process is still building
+        pending = tempfile.mkdtemp(prefix=trash.PENDING_PREFIX,
+                                   dir=self.trash_dir)
+        self.make_tree(pathlib.Path(pending) / trash.DATA_NAME)
+        # and one which was abandoned by a crash
+        stale = tempfile.mkdtemp(prefix=trash.PENDING_PREFIX,
+                                 dir=self.trash_dir)
+        os.utime(stale, (0, 0))
+
+        self.assertSequenceEqual(list(trash.iter_entries(self.trash_dir)), [])
+        self.assertTrue(trash.drain(self.trash_dir))
+
+        self.assertTrue(os.path.isdir(pending))
+        self.assertFalse(os.path.exists(stale))
+
+    def test_drain_skips_locked(self):
+        self.make_tree(self.root / "x")
+        trash.move_to_trash(str(self.root / "x"), self.trash_dir)
+
+        with open(os.path.join(self.trash_dir, trash.LOCK_NAME), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self.assertFalse(trash.drain(self.trash_dir))
+
+        self.assertEqual(len(list(trash.iter_entries(self.trash_dir))), 1)
+
+
+class Testregistry(TrashTestCase):
+    def test_register(self):
+        path = str(self.root / "registry")
+
+        self.assertSequenceEqual(trash.read_registry(path), [])
+        trash.register(path, "/a")
+        trash.register(path, "/b")
+        trash.register(path, "/a")
+        self.assertSequenceEqual(trash.read_registry(path), ["/a", "/b"])
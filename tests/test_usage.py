@@ -0,0 +1,130 @@
+import os
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.target as target
+import offlinecopy_impl.usage as usage
+
+
+def du(path):
+    total = os.lstat(path).st_blocks * 512
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+    return total
+
+
+class UsageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        for path, size in [("a", 10000), ("B/b", 20000), ("B/C/c", 30000),
+                           ("B/C/D/d", 40000), ("E/e", 50000)]:
+            path = self.root / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("wb") as f:
+                f.write(b"x" * size)
+        os.symlink("B", str(self.root / "link"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class Testwalk(UsageTestCase):
+    def test_totals(self):
+        totals = usage.totals(usage.walk(self.root, {}))
+
+        self.assertSetEqual(set(totals), {"", "B", "B/C", "B/C/D", "E"})
+        for relpath, total in totals.items():
+            self.assertEqual(total, du(str(self.root / relpath)), relpath)
+
+    def test_path_usage(self):
+        totals = usage.totals(usage.walk(self.root, {}))
+
+        self.assertEqual(usage.path_usage(self.root, totals, "/B/C"),
+                         du(str(self.root / "B/C")))
+        self.assertEqual(usage.path_usage(self.root, totals, "a"),
+                         os.lstat(str(self.root / "a")).st_blocks * 512)
+        self.assertEqual(usage.path_usage(self.root, totals, "missing"), 0)
+
+    def test_selection(self):
+        selections = {"B/C": target.Selection(("d",), None)}
+        totals = usage.totals(usage.walk(self.root, {},
+                                         get_selection=selections.get))
+
+        self.assertEqual(
+            totals["B/C"],
+            du(str(self.root / "B/C")) -
+            os.lstat(str(self.root / "B/C/c")).st_blocks * 512,
+        )
+
+        # a changed selection invalidates the records
+        records = usage.walk(self.root, {})
+        self.assertEqual(
+            usage.totals(usage.walk(self.root, records,
+                                    get_selection=selections.get))["B/C"],
+            totals["B/C"],
+        )
+
+    def test_unchanged_directories_are_not_scanned(self):
+        records = usage.walk(self.root, {})
+
+        with unittest.mock.patch("os.scandir") as scandir:
+            self.assertDictEqual(usage.walk(self.root, records), records)
+        scandir.assert_not_called()
+
+    def test_changed_directory_is_rescanned(self):
+        records = usage.walk(self.root, {})
+
+        with (self.root / "B/C/new").open("wb") as f:
+            f.write(b"x" * 100000)
+        (self.root / "E/e").unlink()
+        (self.root / "E").rmdir()
+
+        scanned = []
+        real_scandir = os.scandir
+
+        def scandir(path):
+            scanned.append(os.path.relpath(path, str(self.root)))
+            return real_scandir(path)
+
+        with unittest.mock.patch("os.scandir", scandir):
+            records = usage.walk(self.root, records)
+
+        self.assertCountEqual(scanned, [".", "B/C"])
+        self.assertNotIn("E", records)
+        totals = usage.totals(records)
+        self.assertEqual(totals[""], du(str(self.root)))
+
+
+    def test_restored_mtime_is_noticed(self):
+        # rsync -a sets the times of directories back after a transfer
+        records = usage.walk(self.root, {})
+        st = os.lstat(str(self.root / "E"))
+
+        with (self.root / "E/new").open("wb") as f:
+            f.write(b"x" * 100000)
+        os.utime(str(self.root / "E"), ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        totals = usage.totals(usage.walk(self.root, records))
+        self.assertEqual(totals["E"], du(str(self.root / "E")))
+
+
+class Testcache(UsageTestCase):
+    def test_round_trip(self):
+        path = str(self.root / "cache.json")
+        records = usage.walk(self.root, {})
+
+        usage.save_cache(path, records)
+
+        self.assertDictEqual(usage.load_cache(path), records)
+
+    def test_missing_or_corrupt(self):
+        path = str(self.root / "cache.json")
+        self.assertDictEqual(usage.load_cache(path), {})
+
+        with open(path, "w") as f:
+            f.write("{")
+        self.assertDictEqual(usage.load_cache(path), {})
@@ -0,0 +1,129 @@
+import hashlib
+import io
+import os
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import offlinecopy_impl.verify as verify
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class VerifyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.files = {}
+        for i in range(20):
+            path = "d{}/f{}".format(i % 3, i)
+            self.write(path, "data {}".format(i).encode())
+        os.symlink("d0", str(self.root / "link"))
+
+    def write(self, path, data):
+        (self.root / path).parent.mkdir(parents=True, exist_ok=True)
+        with (self.root / path).open("wb") as f:
+            f.write(data)
+        self.files["/" + path] = sha256(data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class Testbuild_manifest(VerifyTestCase):
+    def test_hashes(self):
+        for jobs in [1, 2]:
+            manifest, cache = verify.build_manifest(
+                self.root, verify.iter_files(self.root), {}, jobs=jobs
+            )
+            self.assertDictEqual(manifest, self.files)
+            self.assertSetEqual(set(cache), set(self.files))
+
+    def test_cache(self):
+        _, cache = verify.build_manifest(
+            self.root, verify.iter_files(self.root), {}, jobs=1
+        )
+        self.write("d1/f1", b"changed")
+        self.write("new", b"new")
+        os.unlink(str(self.root / "d2/f2"))
+        del self.files["/d2/f2"]
+
+        hashed = []
+
+        def hash_file(path):
+            hashed.append(os.path.relpath(path, str(self.root)))
+            with open(path, "rb") as f:
+                return sha256(f.read())
+
+        with unittest.mock.patch("offlinecopy_impl.verify.hash_file",
+                                 hash_file):
+            manifest, cache = verify.build_manifest(
+                self.root, verify.iter_files(self.root), cache, jobs=1
+            )
+
+        self.assertCountEqual(hashed, ["d1/f1", "new"])
+        self.assertDictEqual(manifest, self.files)
+        self.assertNotIn("/d2/f2", cache)
+
+    def test_vanished_file(self):
+        files = list(verify.iter_files(self.root))
+        os.unlink(str(self.root / "d0/f0"))
+        del self.files["/d0/f0"]
+
+        manifest, _ = verify.build_manifest(self.root, files, {}, jobs=1)
+
+        self.assertDictEqual(manifest, self.files)
+
+
+class Testcache(VerifyTestCase):
+    def test_round_trip(self):
+        path = str(self.root / "cache.json")
+        _, cache = verify.build_manifest(
+            self.root, verify.iter_files(self.root), {}, jobs=1
+        )
+
+        verify.save_cache(path, cache)
+
+        self.assertDictEqual(verify.load_cache(path), cache)
+        self.assertDictEqual(verify.load_cache(path + ".missing"), {})
+
+
+class Testmanifest(unittest.TestCase):
+    def test_round_trip(self):
+        manifest = {"/a": sha256(b"a"), "/B/b c": sha256(b"b")}
+        f = io.StringIO()
+
+        verify.write_manifest(f, manifest)
+
+        self.assertEqual(
+            f.getvalue(),
+            "{}  B/b c\n{}  a\n".format(sha256(b"b"), sha256(b"a")),
+        )
+        f.seek(0)
+        self.assertDictEqual(verify.read_manifest(f), manifest)
+
+    def test_sha256sum_output(self):
+        digest = sha256(b"a")
+        self.assertDictEqual(
+            verify.read_manifest([
+                "{}  ./a\n".format(digest),
+                "{} *./bin/x\n".format(digest.upper()),
+                "\\{}  ./new\\nline\n".format(digest),
+                "garbage\n",
+            ]),
+            {"/a": digest, "/bin/x": digest},
+        )
+
+
+class Testcompare(unittest.TestCase):
+    def test_compare(self):
+        self.assertEqual(
+            verify.compare(
+                {"/a": "1", "/b": "2", "/c": "3"},
+                {"/a": "1", "/b": "x", "/d": "4"},
+            ),
+            verify.Comparison(["/b"], ["/c"], ["/d"]),
+        )
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Compare the native local copy engine with rsync on a generated tree.
+#
+#   python3 tools/bench_localcopy.py [--files N] [--size BYTES] [DIR]
+#
+# Each engine does a full copy into an empty directory and an incremental
+# run after a tenth of the files has been touched.
+import argparse
+import os
+import pathlib
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import offlinecopy_impl.localcopy as localcopy  # NOQA
+import offlinecopy_impl.main as main  # NOQA
+import offlinecopy_impl.target as target  # NOQA
+
+
+def generate(root, nfiles, size, rng):
+    paths = []
+    for i in range(nfiles):
+        path = root / "d{}".format(i % 32) / "e{}".format(i % 7) / \
+            "f{}".format(i)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as f:
+            f.write(rng.getrandbits(8 * size).to_bytes(size, "little"))
+        paths.append(path)
+    return paths
+
+
+def run_native(t, src, dest):
+    localcopy.Copier(t.rules, src, dest).run()
+
+
+def run_rsync(t, src, dest):
+    with main.FilterFile(t) as name:
+        subprocess.check_call(
+            ["rsync", "-raHEAXS", "--delete",
+             "--filter", ". {}".format(name),
+             str(src) + "/", str(dest)],
+        )
+
+
+def timed(func, *args):
+    t0 = time.monotonic()
+    func(*args)
+    return time.monotonic() - t0
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=16384)
+    parser.add_argument("dir", nargs="?", default=None,
+                        help="Directory to run in (default: a temporary"
+                        " directory)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        root = pathlib.Path(tmp)
+        rng = random.Random(0)
+        src = root / "src"
+        paths = generate(src, args.files, args.size, rng)
+
+        t = target.Target(str(src), root / "dest")
+        t.include("")
+        t.evict("d0")
+
+        engines = [("native", run_native)]
+        if shutil.which("rsync"):
+            engines.append(("rsync", run_rsync))
+
+        for name, func in engines:
+            dest = root / name
+            dest.mkdir()
+            full = timed(func, t, src, dest)
+            for path in rng.sample(paths, len(paths) // 10):
+                os.utime(str(path))
+            incremental = timed(func, t, src, dest)
+            print("{:8s} full {:8.3f}s  incremental {:8.3f}s".format(
+                name, full, incremental))
+
+
+if __name__ == "__main__":
+    main_()